@@ -1,27 +1,54 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-import io
 import base64
+import io
 import yaml
 from yaml.loader import SafeLoader
 from streamlit.components.v1 import html
 import streamlit_authenticator as stauth
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Table, TableStyle
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_LEFT, TA_CENTER
-import re
 import os
 import time
 import json as _json
+from cache_relatorios import ReportCache, file_version, report_cache_key
+from snapshot_dados import read_snapshot, read_snapshot_metadata, write_snapshot
+from atualizacao_dados import BackgroundRefresher
+from disjuntor import CircuitBreaker
+from exportacao import export_zip
+from fotos_vistoria import DEFAULT_FETCH_WORKERS, DRIVE_READONLY_SCOPE, DriveFileFetcher, PhotoStore
+from tendencias import DEFAULT_FULL_REBUILD_INTERVAL, DailyRollup, trend_series
+from instrumentacao import JsonLinesLog, dataframe_memory_bytes, end_trace, note, span, start_trace
+from relatorio import (
+    REPORT_TEMPLATE_VERSION,
+    ColumnMapping,
+    VistoriaIndex,
+    append_vistorias,
+    dataset_fingerprint,
+    display_rows,
+    generate_consolidated_pdf,
+    generate_pdf,
+    get_vistoria_schema,
+    non_conformity_matrix,
+    non_conformity_summary,
+    normalize_vistoria_df,
+    read_column_mapping,
+    read_vistorias_xlsx,
+    record_photo_ids,
+    report_filename,
+    set_dataset_fingerprint,
+)
 
 # Integração Google Sheets (opcional): dependências só usadas se configurado
 try:
-    import gspread
     from google.oauth2.service_account import Credentials as ServiceAccountCredentials
+    from planilha_google import (
+        DEFAULT_FULL_SYNC_INTERVAL,
+        DRIVE_METADATA_SCOPE,
+        SHEETS_SCOPES,
+        DriveRevisionProbe,
+        IncrementalSheetSync,
+        SheetsClient,
+    )
     _GOOGLE_AVAILABLE = True
 except ImportError:
     _GOOGLE_AVAILABLE = False
@@ -38,7 +65,7 @@ st.set_page_config(
 def load_auth_config():
     """Carrega configuração de autenticação"""
     try:
-        with open('config.yaml') as file:
+        with span("config.yaml"), open('config.yaml') as file:
             config = yaml.load(file, Loader=SafeLoader)
         return config
     except FileNotFoundError:
@@ -193,392 +220,654 @@ def _get_google_credentials():
     return None
 
 
-def _normalize_vistoria_df(df):
-    """Normaliza o DataFrame: coluna carimbo como datetime e ordenação por data (mais recente primeiro)."""
-    if df is None or df.empty:
-        return df
-    df = df.copy()
-    for col in df.columns:
-        if "carimbo" in str(col).lower() and "data" in str(col).lower():
-            df[col] = pd.to_datetime(df[col], errors="coerce")
-            df = df.sort_values(col, ascending=False).reset_index(drop=True)
-            break
-    return df
+def _get_setting(name, default=None):
+    """Lê uma configuração opcional: Streamlit Secrets ou variável de ambiente."""
+    try:
+        if hasattr(st, "secrets") and name in st.secrets:
+            return st.secrets[name]
+    except Exception:
+        pass
+    return os.environ.get(name, default)
 
 
-# Cache com TTL para não sobrecarregar a API e manter dados relativamente frescos
+# Idade máxima dos dados antes da atualização em segundo plano (não sobrecarregar a API)
 _DATA_CACHE_TTL_SECONDS = 300  # 5 minutos
 
 
-@st.cache_data(ttl=_DATA_CACHE_TTL_SECONDS)
-def _fetch_data_from_google_sheets(spreadsheet_id: str):
+def _sheet_probe_enabled():
     """
-    Lê a primeira aba da planilha Google. Retorna DataFrame com primeira linha como cabeçalho.
-    Usada apenas quando GOOGLE_SHEETS_ID e credenciais estão configurados.
+    Sonda de alterações antes de cada leitura da planilha (versão do arquivo no Drive).
+    Desativada por padrão (pede o escopo do Drive e uma requisição a mais por atualização);
+    GOOGLE_SHEETS_PROBE = "drive" ativa.
+    """
+    return str(_get_setting("GOOGLE_SHEETS_PROBE", "nenhuma")).strip().lower() == "drive"
+
+
+@st.cache_resource
+def _get_sheet_sync(spreadsheet_id: str):
+    """
+    Estado da sincronização incremental da planilha, compartilhado entre sessões e
+    preservado quando o TTL de _fetch_data_from_google_sheets expira.
+    GOOGLE_SHEETS_FULL_SYNC_SECONDS define o intervalo das leituras completas de conferência.
+    """
+    try:
+        interval = float(_get_setting("GOOGLE_SHEETS_FULL_SYNC_SECONDS", DEFAULT_FULL_SYNC_INTERVAL))
+    except (TypeError, ValueError):
+        interval = DEFAULT_FULL_SYNC_INTERVAL
+    probe = DriveRevisionProbe() if _sheet_probe_enabled() else None
+    return IncrementalSheetSync(full_sync_interval=interval, probe=probe)
+
+
+@st.cache_resource
+def _get_sheets_breaker(spreadsheet_id: str):
+    """
+    Disjuntor da planilha, compartilhado entre sessões: após GOOGLE_SHEETS_BREAKER_FAILURES
+    buscas seguidas com falha (padrão 3), o Google não é consultado por
+    GOOGLE_SHEETS_BREAKER_COOLDOWN_SECONDS (padrão 120) e o app usa a fonte local.
+    """
+    try:
+        failures = int(_get_setting("GOOGLE_SHEETS_BREAKER_FAILURES", 3))
+    except (TypeError, ValueError):
+        failures = 3
+    try:
+        cooldown = float(_get_setting("GOOGLE_SHEETS_BREAKER_COOLDOWN_SECONDS", 120))
+    except (TypeError, ValueError):
+        cooldown = 120.0
+    return CircuitBreaker(failure_threshold=failures, cooldown=cooldown)
+
+
+@st.cache_resource
+def _get_sheets_client(spreadsheet_id: str):
+    """
+    Cliente autorizado da planilha, criado uma vez por processo: as credenciais são
+    lidas uma vez e a sessão HTTP, o token e a aba são reaproveitados entre reruns.
+    GOOGLE_SHEETS_API_URL (opcional) aponta para outro endereço da API (ex.: servidor local de teste).
     """
-    if not _GOOGLE_AVAILABLE:
-        raise RuntimeError("gspread/google-auth não instalados")
     creds = _get_google_credentials()
     if creds is None:
+        # Exceção não fica em cache: credenciais configuradas depois são usadas no próximo acesso
         raise ValueError("Credenciais Google não configuradas")
-    scopes = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
-    creds = creds.with_scopes(scopes)
-    max_retries = 3
+    scopes = SHEETS_SCOPES + [DRIVE_METADATA_SCOPE] if _sheet_probe_enabled() else SHEETS_SCOPES
+    return SheetsClient(
+        creds.with_scopes(scopes),
+        spreadsheet_id,
+        base_url=_get_setting("GOOGLE_SHEETS_API_URL") or None,
+    )
+
+
+def _fetch_data_from_google_sheets(client, sheet_sync, max_retries=3, built=None):
+    """
+    Lê a primeira aba da planilha Google. Retorna DataFrame com primeira linha como cabeçalho.
+    Usada apenas quando GOOGLE_SHEETS_ID e credenciais estão configurados.
+    Após a primeira leitura busca apenas as linhas novas (ver planilha_google.IncrementalSheetSync).
+    built (opcional): dict {versão da sincronização: DataFrame} com o último DataFrame montado;
+    se a planilha não mudou, esse mesmo objeto é retornado (sem montar e normalizar de novo);
+    se só ganhou linhas, apenas elas são normalizadas e acrescentadas (relatorio.append_vistorias).
+    Roda na thread de atualização (_get_data_refresher): não usa st.* nem caches do Streamlit.
+    """
     last_error = None
     for attempt in range(max_retries):
+        note(tentativas=attempt + 1)
         try:
-            gc = gspread.authorize(creds)
-            sh = gc.open_by_key(spreadsheet_id)
-            ws = sh.sheet1
-            rows = ws.get_all_values()
-            if not rows:
+            ws = client.worksheet()
+            sheet_sync.sync(ws)
+            header, rows, version = sheet_sync.snapshot()
+            if built is not None and version in built:
+                return built[version]
+            if not header:
                 return pd.DataFrame()
-            df = pd.DataFrame(rows[1:], columns=rows[0])
+            df = None
+            # Só linhas novas desde o último DataFrame montado: normalizar apenas elas
+            previous_version, previous = next(iter(built.items()), (None, None)) if built else (None, None)
+            if previous is not None and not previous.empty and sheet_sync.appended_since(previous_version):
+                df = append_vistorias(previous, pd.DataFrame(rows[len(previous):], columns=header))
+                note(linhas_novas=len(rows) - len(previous), incremental=df is not None)
+            if df is None:
+                # Normalizar aqui (uma vez por versão dos dados) e não a cada rerun
+                df = normalize_vistoria_df(pd.DataFrame(rows, columns=header))
+            if built is not None:
+                built.clear()
+                built[version] = df
             return df
         except Exception as e:
             last_error = e
+            # Resolver a aba de novo na próxima tentativa (a sessão autorizada é mantida)
+            client.reset()
             if attempt < max_retries - 1:
                 time.sleep(1.0 * (attempt + 1))
     raise last_error
 
 
-@st.cache_data
+# ---------- Snapshot local (Parquet) do conjunto normalizado ----------
+
+def _get_snapshot_path():
+    """Caminho do snapshot local (VISTORIAS_SNAPSHOT_PATH; vazio desativa)."""
+    return _get_setting("VISTORIAS_SNAPSHOT_PATH", os.path.join(".cache", "vistorias.parquet")) or None
+
+
+@st.cache_resource
+def _get_snapshot_state():
+    """Versão dos dados gravada por último em cada caminho (evita regravar a mesma versão)."""
+    return {}
+
+
+@st.cache_resource(max_entries=2)
+def _read_snapshot_cached(path, mtime_ns):
+    """
+    Lê o snapshot uma vez por versão do arquivo (mtime). Um mesmo DataFrame (somente leitura)
+    para todas as sessões, com a versão dos dados já registrada (dataset_fingerprint).
+    """
+    df, metadata = read_snapshot(path)
+    if df is not None and metadata.get("data_fingerprint"):
+        set_dataset_fingerprint(df, metadata["data_fingerprint"])
+    return df, metadata
+
+
+def _load_snapshot():
+    """Retorna (DataFrame, metadados) do snapshot local ou (None, None)."""
+    path = _get_snapshot_path()
+    if not path:
+        return None, None
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None, None
+    return _read_snapshot_cached(path, mtime_ns)
+
+
+def _save_snapshot(df, source, source_version=None):
+    """Grava o snapshot após uma carga bem-sucedida, uma vez por versão dos dados."""
+    _write_snapshot_once(_get_snapshot_path(), _get_snapshot_state(), df, source, source_version)
+
+
+def _write_snapshot_once(path, saved, df, source, source_version):
+    """Parte de _save_snapshot sem st.* (usada também pela thread de atualização)."""
+    if not path or df is None or df.empty:
+        return
+    version = (source, source_version, dataset_fingerprint(df))
+    if saved.get(path) == version:
+        return
+    metadata = read_snapshot_metadata(path)
+    if metadata and (metadata.get("source"), metadata.get("source_version"), metadata.get("data_fingerprint")) == version:
+        saved[path] = version
+        return
+    if write_snapshot(df, path, source, source_version, version[2]):
+        saved[path] = version
+
+
+@st.cache_resource
 def _load_data_from_xlsx():
-    """Carrega base a partir do arquivo local (fallback quando Google não está configurado ou falha)."""
+    """
+    Carrega base a partir do arquivo local (fallback quando Google não está configurado ou falha).
+    Se o snapshot local foi gerado desta mesma versão do xlsx, lê o snapshot (bem mais rápido que o openpyxl).
+    Como os dados do Google, é um mesmo DataFrame (somente leitura) para todas as sessões:
+    a versão dos dados (dataset_fingerprint) é calculada uma vez, não a cada rerun.
+    """
+    note(cache="falha")
+    xlsx_version = file_version("base_de_dados.xlsx")
+    snapshot, metadata = _load_snapshot()
+    if snapshot is not None and metadata.get("source") == "xlsx" and metadata.get("source_version") == xlsx_version:
+        note(lido_de="snapshot")
+        return snapshot
+    note(lido_de="xlsx")
     try:
-        try:
-            df = pd.read_excel("base_de_dados.xlsx", engine="openpyxl")
-        except Exception:
-            df = pd.read_excel("base_de_dados.xlsx")
+        df = read_vistorias_xlsx("base_de_dados.xlsx")
     except Exception:
         return pd.DataFrame()
-    return _normalize_vistoria_df(df)
+    # Não sobrescrever um snapshot do Google (dados mais recentes que o xlsx do repositório)
+    if metadata is None or metadata.get("source") == "xlsx":
+        _save_snapshot(df, "xlsx", xlsx_version)
+    return df
 
 
 # Carregar mapeamento de colunas
 @st.cache_data
 def load_column_mapping():
     """Carrega o mapeamento de colunas originais para tratadas e áreas"""
+    note(cache="falha")
     try:
-        df_map = pd.read_excel('formatacao_colunas.xlsx', engine='openpyxl')
-        
-        # Criar dicionário de mapeamento: coluna_original -> (coluna_tratada, area)
-        mapping = {}
-        for idx, row in df_map.iterrows():
-            col_original = str(row.iloc[0]).strip()
-            col_tratada = str(row.iloc[1]).strip()
-            area = str(row.iloc[2]).strip()
-            
-            # Ignorar se área for NaN ou vazia, ou se for IDENTIFICAÇÃO/GERAL
-            if pd.notna(row.iloc[2]) and area not in ['nan', 'IDENTIFICAÇÃO', 'GERAL', '']:
-                mapping[col_original] = {
-                    'nome_tratado': col_tratada if col_tratada != 'nan' else col_original,
-                    'area': area
-                }
-        
-        return mapping
+        return read_column_mapping('formatacao_colunas.xlsx')
     except Exception as e:
         st.warning(f"Erro ao carregar mapeamento de colunas: {e}")
-        return {}
+        return ColumnMapping()
 
 # Carregar dados: Google Planilhas (se configurado) com fallback automático para xlsx
+def _load_google_snapshot(spreadsheet_id):
+    """Snapshot local gerado a partir desta planilha: (DataFrame, metadados) ou (None, None)."""
+    snapshot, metadata = _load_snapshot()
+    if (
+        snapshot is None
+        or snapshot.empty
+        or metadata.get("source") != "google"
+        or metadata.get("source_version") != spreadsheet_id
+    ):
+        return None, None
+    return snapshot, metadata
+
+
+@st.cache_resource
+def _get_data_refresher(spreadsheet_id: str):
+    """
+    Versão atual dos dados da planilha, compartilhada entre sessões e atualizada em
+    segundo plano quando passa de _DATA_CACHE_TTL_SECONDS (stale-while-revalidate).
+    Começa pelo snapshot local da planilha, se houver; cada atualização com dados novos
+    regrava o snapshot. Sem alterações na planilha, a versão atual só tem a validade renovada.
+    """
+    # Resolvidos aqui (thread do script): a thread de atualização não acessa st.*
+    client = _get_sheets_client(spreadsheet_id)
+    sheet_sync = _get_sheet_sync(spreadsheet_id)
+    breaker = _get_sheets_breaker(spreadsheet_id)
+    snapshot_path = _get_snapshot_path()
+    snapshot_state = _get_snapshot_state()
+    # Último DataFrame montado, por versão da sincronização (mesmo objeto enquanto a planilha não muda)
+    built = {}
+
+    def fetch():
+        # Disjuntor aberto: falha na hora. Sondagem (meio-aberto): uma tentativa, sem esperas
+        max_retries = 1 if breaker.state == CircuitBreaker.HALF_OPEN else 3
+        # Só tem efeito na carga síncrona (thread do script); na thread de atualização não há trace
+        note(cache="falha", disjuntor=breaker.state)
+        return breaker.call(_fetch_data_from_google_sheets, client, sheet_sync, max_retries, built)
+
+    refresher = BackgroundRefresher(
+        fetch,
+        max_age=_DATA_CACHE_TTL_SECONDS,
+        on_refresh=lambda df: _write_snapshot_once(snapshot_path, snapshot_state, df, "google", spreadsheet_id),
+    )
+    snapshot, metadata = _load_google_snapshot(spreadsheet_id)
+    if snapshot is not None:
+        refresher.seed(snapshot, "snapshot", metadata["saved_at"])
+    return refresher
+
+
 def load_data():
     """
     Fonte robusta: tenta Google Sheets primeiro; em caso de falha ou ausência de config,
-    usa base_de_dados.xlsx. Define st.session_state["data_source"] para exibir a fonte.
+    usa o snapshot local (dados recentes) e, por último, base_de_dados.xlsx.
+    Os dados do Google são servidos na hora e atualizados em segundo plano (_get_data_refresher).
+    Define st.session_state["data_source"] para exibir a fonte.
     """
     spreadsheet_id = _get_google_sheets_id()
     if spreadsheet_id and _GOOGLE_AVAILABLE:
         try:
-            df = _fetch_data_from_google_sheets(spreadsheet_id)
-            df = _normalize_vistoria_df(df)
+            df, origin, loaded_at = _get_data_refresher(spreadsheet_id).get()
+            note(origem=origin, idade_s=round(time.time() - loaded_at, 1))
             if df is not None and not df.empty:
-                st.session_state["data_source"] = "google"
+                st.session_state["data_source"] = "google" if origin == "live" else "snapshot"
+                st.session_state["data_snapshot"] = {"saved_at": loaded_at}
                 return df
-        except Exception:
-            # Fallback silencioso para xlsx; não quebrar a experiência do usuário
-            pass
+        except Exception as e:
+            # Fallback silencioso; não quebrar a experiência do usuário
+            note(erro_google=type(e).__name__)
+        # Google indisponível: dados recentes do snapshot antes do xlsx do repositório
+        snapshot, metadata = _load_google_snapshot(spreadsheet_id)
+        if snapshot is not None:
+            st.session_state["data_source"] = "snapshot"
+            st.session_state["data_snapshot"] = metadata
+            return snapshot
     # Fonte local (xlsx) ou fallback após falha do Google
     df = _load_data_from_xlsx()
     st.session_state["data_source"] = "xlsx"
     return df
 
-# Função para obter informações da coluna do mapeamento
-def get_column_info(col_name, column_mapping):
-    """Retorna nome tratado e área da coluna baseado no mapeamento"""
-    if not column_mapping:
-        return None, None
-    
-    # Tentar match exato primeiro
-    if col_name in column_mapping:
-        return column_mapping[col_name]['nome_tratado'], column_mapping[col_name]['area']
-    
-    # Tentar match case-insensitive
-    col_name_lower = col_name.lower().strip()
-    for orig_col, info in column_mapping.items():
-        if orig_col.lower().strip() == col_name_lower:
-            return info['nome_tratado'], info['area']
-    
-    return None, None
+# Quantidade máxima de relatórios preparados mantidos por sessão
+_MAX_RELATORIOS_SESSAO = 20
 
-# Função para identificar área da coluna (fallback)
-def get_area_from_column(col_name):
-    col_upper = col_name.upper()
-    col_lower = col_name.lower()
-    
-    # Verificar por ordem de especificidade (mais específico primeiro)
-    
-    # Geladeiras
-    if 'GELADEIRA' in col_upper:
-        return 'Geladeiras'
-    
-    # Sanitário
-    if 'SANITÁRIO' in col_upper or 'SANITARIO' in col_upper:
-        return 'Sanitário'
-    
-    # Salão - verificar padrões específicos
-    if 'SALÃO' in col_upper or 'SALAO' in col_upper:
-        return 'Salão'
-    # Poltronas geralmente são do salão
-    if 'POLTRONAS' in col_upper or col_upper.startswith('POLTRONAS'):
-        return 'Salão'
-    # Verificar se contém [POLTRONAS]
-    if '[POLTRONAS]' in col_upper:
-        return 'Salão'
-    
-    # Cabine - verificar padrões específicos
-    if col_upper.startswith('CABINE') or '[CABINE' in col_upper:
-        return 'Cabine'
-    if 'CABINE' in col_upper and ('MOTORISTA' in col_upper or 'DO MOTORISTA' in col_upper):
-        return 'Cabine'
-    
-    # Externa - verificar padrões específicos
-    if 'AVALIAÇÃO EXTERNA' in col_upper or 'AVALIACAO EXTERNA' in col_upper:
-        return 'Externa'
-    if 'EXTERNA' in col_upper or 'EXTERNO' in col_upper:
-        return 'Externa'
-    
-    # Verificar por palavras-chave comuns de área externa
-    if any(x in col_lower for x in ['avaria', 'higienização', 'estado', 'pintura', 
-                                     'adesivo', 'extintor', 'bagageiro', 
-                                     'placa', 'pneu', 'retrovisor', 'vidro', 'carroceria',
-                                     'porta de entrada']):
-        # Verificar se não é de outra área
-        if 'CABINE' not in col_upper and 'SANITÁRIO' not in col_upper and 'SANITARIO' not in col_upper:
-            if 'POLTRONAS' not in col_upper and 'SALÃO' not in col_upper and 'SALAO' not in col_upper:
-                if 'GELADEIRA' not in col_upper:
-                    return 'Externa'
-    
-    return None
+@st.cache_resource
+def _get_report_cache():
+    """
+    Cache de PDFs compartilhado por todas as sessões do processo.
+    REPORT_CACHE_DIR (opcional) ativa o nível em disco; limites em MB via
+    REPORT_CACHE_MEMORY_MB e REPORT_CACHE_DISK_MB.
+    """
+    try:
+        memory_mb = float(_get_setting("REPORT_CACHE_MEMORY_MB", 64))
+    except (TypeError, ValueError):
+        memory_mb = 64.0
+    try:
+        disk_mb = float(_get_setting("REPORT_CACHE_DISK_MB", 512))
+    except (TypeError, ValueError):
+        disk_mb = 512.0
+    disk_dir = _get_setting("REPORT_CACHE_DIR") or None
+    return ReportCache(
+        max_memory_bytes=int(memory_mb * 1024 * 1024),
+        disk_dir=disk_dir,
+        max_disk_bytes=int(disk_mb * 1024 * 1024),
+    )
 
-# Função para verificar se há não conformidade
-def has_non_conformity(value):
-    if pd.isna(value):
-        return False
-    value_str = str(value).upper().strip()
-    # Verifica se é "NÃO CONFORME" ou se tem algum valor preenchido (indicando não conformidade)
-    if 'NÃO CONFORME' in value_str or 'NAO CONFORME' in value_str:
-        return True
-    # Se não for NaN e tiver algum conteúdo, considera não conformidade
-    if value_str and value_str not in ['NAN', 'NONE', '']:
-        return True
-    return False
-
-# Função para formatar o nome do item
-def format_item_name(col_name):
-    # Remove prefixos comuns
-    name = col_name
-    prefixes = ['Campo para observações pontuais sobre', 'Campo para fotografias pontuais sobre']
-    for prefix in prefixes:
-        if name.startswith(prefix):
-            return name.replace(prefix, '').strip()
-    return name
-
-# Função para formatar valores numéricos e datas corretamente
-def format_value(value, column_name=None):
-    """Formata valores removendo decimais desnecessários e formatando datas"""
-    if pd.isna(value):
-        return "NÃO CONFORME"
-    
-    # Verificar se é campo de extintor (validade)
-    is_extintor_date = False
-    if column_name:
-        col_lower = str(column_name).lower()
-        if 'extintor' in col_lower and ('validade' in col_lower or 'data' in col_lower):
-            is_extintor_date = True
-    
-    # Tentar detectar e formatar datas primeiro (PRIORIDADE: Timestamp > datetime > string > número serial)
+
+@st.cache_resource(max_entries=4)
+def _non_conformity_matrix_cached(fingerprint, _df, columns):
+    """Matriz de não conformidades por versão dos dados (o DataFrame não entra no hash)."""
+    return non_conformity_matrix(_df, columns)
+
+
+def get_non_conformity_matrix(df, column_mapping):
+    """Matriz de não conformidades das colunas de itens, calculada uma vez por versão dos dados."""
+    schema = get_vistoria_schema(df.columns, column_mapping)
+    columns = tuple(col for col, _, _ in schema.item_columns)
+    return _non_conformity_matrix_cached(dataset_fingerprint(df), df, columns)
+
+
+@st.cache_resource(max_entries=16)
+def _non_conformity_summary_cached(fingerprint, items, selection, _df, _positions, _column_mapping):
+    """Indicadores por versão dos dados, itens do mapeamento e filtros (DataFrame e posições fora do hash)."""
+    schema = get_vistoria_schema(_df.columns, _column_mapping)
+    return non_conformity_summary(_df, schema, get_non_conformity_matrix(_df, _column_mapping), _positions)
+
+
+def get_non_conformity_summary(df, column_mapping, positions=None, selection=None):
+    """Indicadores de não conformidade (todas as vistorias ou as filtradas), calculados uma vez por versão."""
+    schema = get_vistoria_schema(df.columns, column_mapping)
+    return _non_conformity_summary_cached(
+        dataset_fingerprint(df), tuple(schema.item_columns), selection, df, positions, column_mapping
+    )
+
+
+@st.cache_resource(max_entries=4)
+def _vistoria_index_cached(fingerprint, _df):
+    """Índices dos filtros por versão dos dados (o DataFrame não entra no hash)."""
+    return VistoriaIndex(_df, get_vistoria_schema(_df.columns))
+
+
+def get_vistoria_index(df):
+    """Índices de período, prefixo, cidade e vistoriador, montados uma vez por versão dos dados."""
+    return _vistoria_index_cached(dataset_fingerprint(df), df)
+
+
+@st.cache_resource
+def _get_photo_store():
+    """
+    Fotos nos relatórios (opcional): REPORT_PHOTOS = "1" ativa. As miniaturas ficam em
+    PHOTO_CACHE_DIR (padrão .cache/fotos, até PHOTO_CACHE_MB, padrão 256) e são baixadas pela API do Drive com a conta de
+    serviço (escopo drive.readonly), em até PHOTO_FETCH_WORKERS downloads simultâneos (padrão 4).
+    GOOGLE_SHEETS_API_URL (opcional) aponta para um servidor local de teste. None se desativado.
+    """
+    if str(_get_setting("REPORT_PHOTOS", "")).strip().lower() not in ("1", "true", "sim"):
+        return None
+    creds = _get_google_credentials()
+    if creds is not None:
+        from google.auth.transport.requests import AuthorizedSession
+        session = AuthorizedSession(creds.with_scopes([DRIVE_READONLY_SCOPE]))
+    else:
+        # Sem conta de serviço: só arquivos públicos (ou o servidor local de teste)
+        import requests
+        session = requests.Session()
     try:
-        # Se for um Timestamp do pandas (PRIORIDADE MÁXIMA - pandas já converteu corretamente)
-        if isinstance(value, pd.Timestamp):
-            if is_extintor_date:
-                # Formato MMM-AAAA para extintores
-                meses = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 
-                        'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
-                return f"{meses[value.month - 1]}-{value.year}"
-            return value.strftime('%d-%m-%Y')
-        
-        # Se for datetime
-        if isinstance(value, datetime):
-            if is_extintor_date:
-                # Formato MMM-AAAA para extintores
-                meses = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 
-                        'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
-                return f"{meses[value.month - 1]}-{value.year}"
-            return value.strftime('%d-%m-%Y')
-        
-        # Se for string, tentar detectar formato de data
-        value_str = str(value).strip()
-        
-        # Tentar converter string para datetime PRIMEIRO (antes de tentar como número serial)
-        if is_extintor_date:
-            try:
-                # Tentar vários formatos de data comuns
-                date_formats = ['%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d', '%d/%m/%y']
-                date_value = None
-                for fmt in date_formats:
-                    try:
-                        date_value = pd.to_datetime(value_str, format=fmt, errors='raise')
-                        break
-                    except:
-                        continue
-                
-                # Se não funcionou com formatos específicos, tentar parse automático
-                if date_value is None:
-                    date_value = pd.to_datetime(value_str, errors='raise')
-                
-                # Formato MMM-AAAA para extintores
-                meses = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 
-                        'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
-                return f"{meses[date_value.month - 1]}-{date_value.year}"
-            except (ValueError, TypeError):
-                pass  # Não é uma data em formato string, continuar
-        
-        
-        # Padrões comuns de data: YYYY-MM-DD HH:MM:SS ou YYYY-MM-DD
-        import re
-        date_patterns = [
-            r'(\d{4})-(\d{2})-(\d{2})\s+\d{2}:\d{2}:\d{2}',  # 2026-12-01 00:00:00
-            r'(\d{4})-(\d{2})-(\d{2})',  # 2026-12-01
-            r'(\d{2})/(\d{2})/(\d{4})',  # 01/12/2026
-            r'(\d{2})-(\d{2})-(\d{4})',  # 01-12-2026
-        ]
-        
-        for pattern in date_patterns:
-            match = re.search(pattern, value_str)
-            if match:
-                if len(match.groups()) == 3:
-                    meses = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 
-                            'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
-                    
-                    if pattern.startswith(r'(\d{4})'):  # Formato YYYY-MM-DD
-                        year, month, day = match.groups()
-                        if is_extintor_date:
-                            return f"{meses[int(month) - 1]}-{year}"
-                        return f"{day}-{month}-{year}"
-                    else:  # Formato DD/MM/YYYY ou DD-MM-YYYY
-                        day, month, year = match.groups()
-                        if is_extintor_date:
-                            return f"{meses[int(month) - 1]}-{year}"
-                        return f"{day}-{month}-{year}"
-        
-        # Tentar converter string para datetime (fallback)
-        try:
-            date_value = pd.to_datetime(value_str, errors='raise')
-            if is_extintor_date:
-                # Formato MMM-AAAA para extintores
-                meses = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 
-                        'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
-                return f"{meses[date_value.month - 1]}-{date_value.year}"
-            return date_value.strftime('%d-%m-%Y')
-        except (ValueError, TypeError):
-            pass  # Não é uma data, continuar com formatação numérica
-    except:
-        pass  # Continuar com formatação numérica
-    
-    # Tentar converter para número (ÚLTIMA OPÇÃO - só se não for Timestamp, datetime ou string de data)
+        workers = max(1, int(_get_setting("PHOTO_FETCH_WORKERS", DEFAULT_FETCH_WORKERS)))
+    except (TypeError, ValueError):
+        workers = DEFAULT_FETCH_WORKERS
     try:
-        # Se for um número float que é equivalente a um inteiro
-        if isinstance(value, (int, float)):
-            # Se for extintor e for um número grande, tentar converter como data serial do Excel
-            # (Só fazer isso se não foi possível converter como Timestamp/datetime/string antes)
-            if is_extintor_date:
-                num_val = float(value)
-                # Números seriais do Excel para datas estão geralmente entre 1 e 100000
-                # Mas precisamos ter certeza que não é apenas um número normal
-                if 1 <= num_val <= 100000:
-                    try:
-                        from datetime import datetime, timedelta
-                        excel_epoch = datetime(1899, 12, 30)
-                        date_value = excel_epoch + timedelta(days=int(num_val) - 2)
-                        meses = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 
-                                'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
-                        return f"{meses[date_value.month - 1]}-{date_value.year}"
-                    except:
-                        pass
-            
-            if isinstance(value, float) and value.is_integer():
-                return str(int(value))
-            return str(value)
-        
-        # Se for string, tentar converter
-        value_str = str(value).strip()
-        
-        # Verificar se é uma lista de números separados por vírgula ou ponto e vírgula
-        # Exemplo: "1, 5, 24" ou "1;5;24" ou "1,5,24"
-        import re
-        # Padrão para detectar listas de números: números separados por vírgula/ponto e vírgula/espaço
-        list_pattern = r'^[\d\s,;]+$'
-        if re.match(list_pattern, value_str):
-            # Limpar e formatar como lista separada por vírgula
-            # Remover espaços extras e normalizar separadores
-            numbers = re.findall(r'\d+', value_str)
-            if len(numbers) > 1:
-                # Formatar como "1, 5, 24"
-                return ', '.join(numbers)
-            elif len(numbers) == 1:
-                # Se for apenas um número, retornar formatado
-                return numbers[0]
-        
-        # Primeiro, substituir números como "48.0" por "48" (mas manter "48.5" como está)
-        pattern = r'\b\d+\.0\b'
-        value_str = re.sub(pattern, lambda m: str(int(float(m.group()))), value_str)
-        
-        # Tentar converter para float
-        try:
-            num_value = float(value_str)
-            if num_value.is_integer():
-                return str(int(num_value))
-            return value_str
-        except ValueError:
-            # Se não for número, retornar string já formatada (sem .0)
-            return value_str
-    except:
-        # Se houver qualquer erro, retornar como string
-        return str(value)
+        cache_mb = float(_get_setting("PHOTO_CACHE_MB", 256))
+    except (TypeError, ValueError):
+        cache_mb = 256.0
+    return PhotoStore(
+        DriveFileFetcher(session, base_url=_get_setting("GOOGLE_SHEETS_API_URL") or None),
+        _get_setting("PHOTO_CACHE_DIR") or os.path.join(".cache", "fotos"),
+        max_workers=workers,
+        max_cache_bytes=int(cache_mb * 1024 * 1024),
+    )
+
+
+def _report_key(df, index, photos=False, missing_photos=()):
+    """
+    Chave do relatório no cache: conteúdo do registro + versões do mapeamento e do template.
+    missing_photos: IDs das fotos indisponíveis (o relatório sem elas tem chave própria).
+    """
+    template_version = REPORT_TEMPLATE_VERSION
+    if photos:
+        template_version += "+fotos"
+    if missing_photos:
+        template_version += "-" + ",".join(missing_photos)
+    return report_cache_key(
+        df.columns,
+        df.iloc[index].tolist(),
+        file_version('formatacao_colunas.xlsx'),
+        template_version,
+    )
+
+
+def _record_photos(df, index, column_mapping, photo_store):
+    """
+    ([(legenda, bytes ou None)], IDs indisponíveis) das fotos do registro; as que faltam
+    são baixadas em paralelo.
+    """
+    schema = get_vistoria_schema(df.columns, column_mapping)
+    photo_ids = record_photo_ids(df.iloc[index], schema)
+    with span("fotos", quantidade=len(photo_ids)):
+        thumbnails = photo_store.thumbnails([file_id for _, file_id in photo_ids])
+    photos = [(caption, thumbnails.get(file_id)) for caption, file_id in photo_ids]
+    missing = tuple(sorted({file_id for _, file_id in photo_ids if thumbnails.get(file_id) is None}))
+    return photos, missing
+
+
+def _report_bytes(df, index, column_mapping):
+    """
+    Bytes do PDF do registro, gerados apenas se o conteúdo ainda não estiver no cache.
+    Com fotos ativas, um relatório com alguma foto indisponível fica no cache sob uma chave
+    com os IDs que faltam: enquanto o PhotoStore der a foto como indisponível ele é reaproveitado,
+    e quando ela for baixada o relatório completo é gerado com a chave normal.
+    """
+    photo_store = _get_photo_store()
+    key = _report_key(df, index, photos=photo_store is not None)
+
+    def render(photos=None):
+        note(cache="falha")
+        non_conformities = get_non_conformity_matrix(df, column_mapping)
+        with span("generate_pdf", registro=int(index)):
+            return generate_pdf(df, index, column_mapping, non_conformities, photos).getvalue()
+
+    with span("relatorio", cache="acerto"):
+        report_cache = _get_report_cache()
+        if photo_store is None:
+            return report_cache.get_or_create(key, render)
+        data = report_cache.get(key)
+        if data is None:
+            photos, missing = _record_photos(df, index, column_mapping, photo_store)
+            if missing:
+                missing_key = _report_key(df, index, photos=True, missing_photos=missing)
+                return report_cache.get_or_create(missing_key, lambda: render(photos))
+            data = render(photos)
+            report_cache.put(key, data)
+        return data
+
+
+def _report_filename(row_data):
+    """Nome do arquivo PDF no padrão Relatorio_Vistoria_{prefixo}_{data}.pdf"""
+    return report_filename(row_data['Prefixo'], row_data['Data'])
+
+
+def _get_export_workers():
+    """Processos da exportação em lote (REPORT_EXPORT_WORKERS; padrão: núcleos da máquina)."""
+    try:
+        return max(1, int(_get_setting("REPORT_EXPORT_WORKERS", os.cpu_count() or 1)))
+    except (TypeError, ValueError):
+        return os.cpu_count() or 1
+
+
+def _render_bulk_export(df, column_mapping, positions, selection):
+    """
+    Exporta em um ZIP os relatórios dos registros selecionados (positions: array de posições;
+    selection identifica os filtros). Os PDFs que não estão no cache são gerados em um pool de processos (ver
+    exportacao.py), com barra de progresso.
+    """
+    export_key = (dataset_fingerprint(df), file_version('formatacao_colunas.xlsx'), REPORT_TEMPLATE_VERSION, selection)
+    if st.button(f"📦 Gerar ZIP com {len(positions)} relatórios", key="exportar_zip"):
+        progress = st.progress(0.0, text="Gerando relatórios...")
+        buffer = io.BytesIO()
+        started = time.perf_counter()
+        with span("exportar_zip", relatorios=len(positions)):
+            export_zip(
+                df,
+                positions.tolist(),
+                buffer,
+                column_mapping,
+                workers=_get_export_workers(),
+                cache=_get_report_cache(),
+                cache_key=lambda pos: _report_key(df, pos),
+                progress=lambda done, total: progress.progress(done / total, text=f"Gerando relatórios... {done}/{total}"),
+                non_conformities=get_non_conformity_matrix(df, column_mapping),
+            )
+        progress.empty()
+        st.session_state["exportacao_zip"] = {
+            "key": export_key,
+            "data": buffer.getvalue(),
+            "file_name": f"Relatorios_Vistoria_{datetime.now().strftime('%Y_%m_%d_%H%M')}.zip",
+            "seconds": time.perf_counter() - started,
+        }
+    exported = st.session_state.get("exportacao_zip")
+    if exported and exported["key"] == export_key:
+        st.download_button(
+            label="⬇️ Baixar ZIP",
+            data=exported["data"],
+            file_name=exported["file_name"],
+            mime="application/zip",
+            key="download_zip",
+        )
+        st.caption(f"{len(exported['data']) / 1024 / 1024:.1f} MB gerados em {exported['seconds']:.1f} s")
+
+
+# Layouts do PDF consolidado (rótulo -> layout de generate_consolidated_pdf)
+_CONSOLIDATED_LAYOUTS = {
+    "Uma vistoria por página": "pagina",
+    "Compacto (por veículo)": "compacto",
+}
+
+
+def _render_consolidated_export(df, column_mapping, positions, selection):
+    """PDF único com as vistorias selecionadas (ver relatorio.generate_consolidated_pdf), gerado sob demanda."""
+    label = st.radio(
+        "PDF consolidado", list(_CONSOLIDATED_LAYOUTS), horizontal=True, key="consolidado_layout"
+    )
+    layout = _CONSOLIDATED_LAYOUTS[label]
+    export_key = (
+        dataset_fingerprint(df), file_version('formatacao_colunas.xlsx'), REPORT_TEMPLATE_VERSION, layout, selection
+    )
+    if st.button(f"📚 Gerar PDF consolidado ({len(positions)} vistorias)", key="exportar_consolidado"):
+        progress = st.progress(0.0, text="Montando o PDF consolidado...")
+        buffer = io.BytesIO()
+        started = time.perf_counter()
+        with span("pdf_consolidado", relatorios=len(positions), layout=layout):
+            generate_consolidated_pdf(
+                df,
+                positions.tolist(),
+                buffer,
+                column_mapping,
+                non_conformities=get_non_conformity_matrix(df, column_mapping),
+                layout=layout,
+                progress=lambda done, total: progress.progress(done / total, text=f"Montando o PDF consolidado... {done}/{total}"),
+            )
+        progress.empty()
+        st.session_state["consolidado_pdf"] = {
+            "key": export_key,
+            "data": buffer.getvalue(),
+            "file_name": f"Relatorio_Consolidado_Vistorias_{datetime.now().strftime('%Y_%m_%d_%H%M')}.pdf",
+            "seconds": time.perf_counter() - started,
+        }
+    exported = st.session_state.get("consolidado_pdf")
+    if exported and exported["key"] == export_key:
+        st.download_button(
+            label="⬇️ Baixar PDF consolidado",
+            data=exported["data"],
+            file_name=exported["file_name"],
+            mime="application/pdf",
+            key="download_consolidado",
+        )
+        st.caption(f"{len(exported['data']) / 1024 / 1024:.1f} MB gerados em {exported['seconds']:.1f} s")
+
+
+def _is_report_prepared(chave):
+    """Indica se o usuário já pediu o relatório deste registro nesta sessão."""
+    return chave in st.session_state.get("relatorios_prontos", {})
+
+
+def _mark_report_prepared(chave):
+    """Marca o relatório como preparado na sessão, esquecendo os mais antigos.
+    Os bytes ficam no cache de relatórios, compartilhado entre sessões."""
+    relatorios = st.session_state.setdefault("relatorios_prontos", {})
+    relatorios.pop(chave, None)
+    relatorios[chave] = True
+    while len(relatorios) > _MAX_RELATORIOS_SESSAO:
+        relatorios.pop(next(iter(relatorios)))
+
+
+def _pdf_media_url(pdf_bytes, chave):
+    """
+    URL curta do PDF no armazenamento de mídia do Streamlit (o mesmo dos downloads), válida
+    até o próximo rerun da sessão. None fora do servidor do Streamlit ou se a API mudar.
+    """
+    try:
+        from streamlit import runtime
+        if not runtime.exists():
+            return None
+        url = runtime.get_instance().media_file_mgr.add(pdf_bytes, "application/pdf", f"impressao.{chave}")
+    except Exception:
+        return None
+    # O endereço é relativo à raiz do servidor; o frontend acrescenta o baseUrlPath
+    base_path = (st.get_option("server.baseUrlPath") or "").strip("/")
+    return f"/{base_path}{url}" if base_path else url
+
+
+def _print_script(pdf_bytes, chave):
+    """
+    JavaScript que abre o PDF e chama print(). Usa a URL do PDF (sem copiar os bytes para a
+    página); sem ela, embute o PDF em base64 como antes.
+    """
+    url = _pdf_media_url(pdf_bytes, chave)
+    if url is not None:
+        open_pdf = f"var url = {_json.dumps(url)};"
+    else:
+        pdf_base64 = base64.b64encode(pdf_bytes).decode('utf-8')
+        open_pdf = f"""
+                    var pdfBlob = atob('{pdf_base64}');
+                    var pdfArray = new Uint8Array(pdfBlob.length);
+                    for (var i = 0; i < pdfBlob.length; i++) {{
+                        pdfArray[i] = pdfBlob.charCodeAt(i);
+                    }}
+                    var url = URL.createObjectURL(new Blob([pdfArray], {{type: 'application/pdf'}}));"""
+    return f"""
+                <script>
+                (function() {{
+                    {open_pdf}
+                    var printWindow = window.open(url, '_blank');
+                    if (printWindow) {{
+                        printWindow.onload = function() {{
+                            setTimeout(function() {{
+                                printWindow.print();
+                            }}, 500);
+                        }};
+                    }}
+                }})();
+                </script>
+                """
+
 
 # Função para renderizar botões de PDF e Impressão
 def _render_buttons(df, row_data, idx, column_mapping, is_mobile=False):
-    """Renderiza botões de PDF e Impressão"""
+    """
+    Renderiza botões de PDF e Impressão. O PDF só é gerado quando o usuário pede
+    ("Preparar"); download e impressão reaproveitam os mesmos bytes.
+    """
     try:
-        pdf_buffer = generate_pdf(df, row_data['Índice'], column_mapping)
-        prefixo = row_data['Prefixo'].replace('/', '_').replace('\\', '_').replace('-', '_')
-        data_str = row_data['Data'].replace('-', '_').replace(' ', '_')
-        filename = f"Relatorio_Vistoria_{prefixo}_{data_str}.pdf"
-        
-        # Converter PDF para base64 para impressão
-        pdf_base64 = base64.b64encode(pdf_buffer.getvalue()).decode('utf-8')
+        # Chave única para os botões
+        suffix = ""
+        chave = row_data['Chave']
+
+        if not _is_report_prepared(chave):
+            if not st.button("📝 Preparar relatório", key=f"prepare_{idx}{suffix}", use_container_width=True):
+                return
+            _mark_report_prepared(chave)
+        pdf_bytes = _report_bytes(df, row_data['Índice'], column_mapping)
+
+        filename = _report_filename(row_data)
         
         # Criar duas subcolunas para os botões
         btn_col1, btn_col2 = st.columns(2)
         
-        # Chave única para os botões
-        suffix = ""
-        
         with btn_col1:
             st.download_button(
                 label="📄 PDF",
-                data=pdf_buffer,
+                data=pdf_bytes,
                 file_name=filename,
                 mime="application/pdf",
                 key=f"download_{idx}{suffix}",
@@ -586,347 +875,371 @@ def _render_buttons(df, row_data, idx, column_mapping, is_mobile=False):
             )
         
         with btn_col2:
-            # Botão de impressão usando JavaScript
-            print_key = f"print_btn_{idx}{suffix}"
-            if print_key not in st.session_state:
-                st.session_state[print_key] = False
-            
+            # Impressão: abre o PDF em outra aba e chama print() (JavaScript só do registro impresso)
             if st.button("🖨️ Imprimir", key=f"print_{idx}{suffix}", use_container_width=True):
-                st.session_state[print_key] = True
-            
-            # Executar JavaScript quando o botão for clicado
-            if st.session_state[print_key]:
-                # Criar função JavaScript para imprimir
-                print_js = f"""
-                <script>
-                (function() {{
-                    var pdfBase64 = '{pdf_base64}';
-                    var pdfBlob = atob(pdfBase64);
-                    var pdfArray = new Uint8Array(pdfBlob.length);
-                    for (var i = 0; i < pdfBlob.length; i++) {{
-                        pdfArray[i] = pdfBlob.charCodeAt(i);
-                    }}
-                    var blob = new Blob([pdfArray], {{type: 'application/pdf'}});
-                    var url = URL.createObjectURL(blob);
-                    var printWindow = window.open(url, '_blank');
-                    if (printWindow) {{
-                        printWindow.onload = function() {{
-                            setTimeout(function() {{
-                                printWindow.print();
-                            }}, 500);
-                        }};
-                    }}
-                }})();
-                </script>
-                """
-                html(print_js, height=0)
-                st.session_state[print_key] = False
+                html(_print_script(pdf_bytes, chave), height=0)
                 
     except Exception as e:
         st.error(f"Erro: {str(e)[:30]}")
 
-# Função para gerar PDF
-def generate_pdf(df, index, column_mapping=None):
-    buffer = io.BytesIO()
-    # Margens reduzidas para aproveitar melhor o espaço horizontal
-    doc = SimpleDocTemplate(buffer, pagesize=A4, 
-                           rightMargin=0.25*inch, leftMargin=0.25*inch,
-                           topMargin=0.3*inch, bottomMargin=0.3*inch)
-    
-    # Estilos
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=14,
-        textColor=colors.HexColor('#1f4e79'),
-        spaceAfter=8,
-        alignment=TA_CENTER
-    )
-    
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=11,
-        textColor=colors.HexColor('#1f4e79'),
-        spaceAfter=4,
-        spaceBefore=8
-    )
-    
-    normal_style = ParagraphStyle(
-        'CustomNormal',
-        parent=styles['Normal'],
-        fontSize=8,
-        spaceAfter=2,
-        leading=10
+def _format_ms(seconds):
+    return f"{seconds * 1000:.0f} ms" if seconds is not None else "—"
+
+
+def _render_sheets_client_stats():
+    """Tempos de conexão/autenticação do cliente da planilha (mostra o ganho da reutilização)."""
+    spreadsheet_id = _get_google_sheets_id()
+    if not spreadsheet_id:
+        return
+    try:
+        client_stats = _get_sheets_client(spreadsheet_id).stats()
+    except Exception:
+        return
+    st.sidebar.caption(
+        f"🔌 Sheets: conexão {_format_ms(client_stats['last_connect_seconds'])} "
+        f"({client_stats['connect_count']}x) · auth {_format_ms(client_stats['last_auth_seconds'])} "
+        f"({client_stats['auth_count']}x) · última requisição {_format_ms(client_stats['last_request_seconds'])}"
     )
-    
-    info_style = ParagraphStyle(
-        'InfoStyle',
-        parent=styles['Normal'],
-        fontSize=7,
-        spaceAfter=6,
-        leading=9
+
+
+def _format_age(seconds):
+    if seconds is None:
+        return "—"
+    if seconds < 60:
+        return f"{seconds:.0f} s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+
+def _render_breaker_status():
+    """Estado do disjuntor do Google ao lado da fonte (explica por que os dados são locais)."""
+    spreadsheet_id = _get_google_sheets_id()
+    if not spreadsheet_id or not _GOOGLE_AVAILABLE:
+        return
+    breaker_stats = _get_sheets_breaker(spreadsheet_id).stats()
+    if breaker_stats["state"] == CircuitBreaker.OPEN:
+        retry_at = datetime.fromtimestamp(breaker_stats["retry_at"]).strftime('%H:%M:%S')
+        st.sidebar.caption(
+            f"⚡ Google indisponível: disjuntor aberto após {breaker_stats['consecutive_failures']} "
+            f"falhas seguidas · nova tentativa às {retry_at}"
+        )
+    elif breaker_stats["state"] == CircuitBreaker.HALF_OPEN:
+        st.sidebar.caption("⚡ Google: disjuntor meio-aberto · testando a recuperação")
+
+
+def _render_data_refresh_stats():
+    """Idade dos dados servidos e duração da última atualização em segundo plano."""
+    spreadsheet_id = _get_google_sheets_id()
+    if not spreadsheet_id:
+        return
+    try:
+        refresh_stats = _get_data_refresher(spreadsheet_id).stats()
+    except Exception:
+        return
+    text = (
+        f"🕒 Dados de {_format_age(refresh_stats['age_seconds'])} atrás · "
+        f"última atualização {_format_ms(refresh_stats['last_refresh_seconds'])}"
     )
-    
-    # Dados do registro
-    row = df.iloc[index]
-    
-    # Buscar colunas de forma flexível (tratando encoding)
-    prefixo = 'N/A'
-    cidade = 'N/A'
-    vistoriador = 'N/A'
-    data_vistoria = 'N/A'
-    carimbo = None
-    quilometragem = None
-    wifi = None
-    
-    for col in df.columns:
-        col_lower = col.lower()
-        # Buscar especificamente por "ônibus (prefixo)" primeiro
-        if 'ônibus' in col_lower and 'prefixo' in col_lower:
-            prefixo = str(row.get(col, 'N/A'))
-        elif 'prefixo' in col_lower:
-            prefixo = str(row.get(col, 'N/A'))
-        elif 'cidade' in col_lower:
-            cidade = str(row.get(col, 'N/A'))
-        elif 'vistoriador' in col_lower:
-            vistoriador = str(row.get(col, 'N/A'))
-        elif 'data da vistoria' in col_lower:
-            data_vistoria = str(row.get(col, 'N/A'))
-        elif 'carimbo' in col_lower and 'data' in col_lower:
-            carimbo = row.get(col, None)
-        elif 'quilometragem' in col_lower:
-            quilometragem = row.get(col, None)
-        elif 'wi-fi' in col_lower or 'wifi' in col_lower:
-            wifi = row.get(col, None)
-    # Formatar data_hora no formato brasileiro DD-MM-AAAA
-    if pd.notna(carimbo):
-        if isinstance(carimbo, pd.Timestamp):
-            data_hora_formatada = carimbo.strftime('%d-%m-%Y %H:%M')
-        else:
-            # Tentar converter se for string
-            try:
-                data_hora_formatada = pd.to_datetime(carimbo).strftime('%d-%m-%Y %H:%M')
-            except:
-                data_hora_formatada = str(carimbo).replace('/', '-')
-    else:
-        data_hora_formatada = 'N/A'
-    
-    # Conteúdo do PDF
-    story = []
-    
-    # Título
-    title = f"<b>RELATÓRIO DE VISTORIA - PREFIXO {prefixo}</b>"
-    story.append(Paragraph(title, title_style))
-    story.append(Spacer(1, 0.1*inch))
-    
-    # Informações gerais (em formato mais compacto)
-    # Usar data_hora_formatada (do carimbo) como "Data da Vistoria"
-    info_text = f"<b>Cidade:</b> {cidade} | <b>Vistoriador:</b> {vistoriador}<br/>"
-    info_text += f"<b>Data da Vistoria:</b> {data_hora_formatada}"
-    
-    # Adicionar Km se estiver preenchido
-    if pd.notna(quilometragem) and str(quilometragem).strip() and str(quilometragem).strip() not in ['N/A', 'nan', 'None', '']:
-        # Formatar quilometragem (remover decimais desnecessários se for número)
-        try:
-            km_value = float(quilometragem)
-            if km_value == int(km_value):
-                km_value = int(km_value)
-            info_text += f" | <b>Km:</b> {km_value}"
-        except (ValueError, TypeError):
-            info_text += f" | <b>Km:</b> {str(quilometragem).strip()}"
-    
-    # Adicionar Wifi se estiver preenchido
-    if pd.notna(wifi) and str(wifi).strip() and str(wifi).strip() not in ['N/A', 'nan', 'None', '']:
-        info_text += f" | <b>Wifi:</b> {str(wifi).strip()}"
-    
-    story.append(Paragraph(info_text, info_style))
-    story.append(Spacer(1, 0.1*inch))
-    
-    # Organizar não conformidades por área
-    # Ordem das áreas conforme a planilha de formatação
-    areas_order = ['EXTERNA', 'CABINE', 'SALÃO', 'SANITÁRIO', 'GELADEIRA']
-    non_conformities_by_area = {area: [] for area in areas_order}
-    
-    # Se não houver mapeamento, usar função antiga como fallback
-    if column_mapping is None:
-        column_mapping = {}
-    
-    # Processar cada coluna
-    for col in df.columns:
-        col_lower = col.lower()
-        
-        # Ignorar colunas de metadados
-        if any(x in col_lower for x in ['carimbo', 'endereço', 'e-mail', 'email', 'prefixo', 
-                                         'data da vistoria', 'cidade', 'vistoriador', 'wi-fi', 'wifi',
-                                         'quilometragem']):
-            continue
-        
-        # Ignorar colunas de fotos
-        if 'fotografia' in col_lower or 'fotografias' in col_lower:
-            continue
-        
-        # Verificar se é observação geral
-        if 'observações gerais' in col_lower or 'observacoes gerais' in col_lower:
+    if refresh_stats["unchanged_count"]:
+        text += f" · {refresh_stats['unchanged_count']} de {refresh_stats['refresh_count']} sem alterações"
+    if refresh_stats["refreshing"]:
+        text += " · atualizando…"
+    elif refresh_stats["last_error"]:
+        text += " · última tentativa falhou"
+    st.sidebar.caption(text)
+
+
+# ---------- Medição dos reruns (painel de desempenho e log) ----------
+
+# Reruns anteriores mantidos na sessão para o painel
+_MAX_RERUNS_PAINEL = 10
+
+
+@st.cache_resource
+def _get_perf_log():
+    """
+    Log JSON lines com um registro por rerun, compartilhado entre sessões.
+    PERF_LOG_PATH (padrão .cache/desempenho.jsonl; vazio desativa), PERF_LOG_MAX_MB
+    (padrão 5) por arquivo e PERF_LOG_BACKUPS (padrão 3) arquivos antigos mantidos.
+    """
+    path = _get_setting("PERF_LOG_PATH", os.path.join(".cache", "desempenho.jsonl"))
+    if not path:
+        return None
+    try:
+        max_mb = float(_get_setting("PERF_LOG_MAX_MB", 5))
+        backups = int(_get_setting("PERF_LOG_BACKUPS", 3))
+    except (TypeError, ValueError):
+        max_mb, backups = 5.0, 3
+    try:
+        return JsonLinesLog(path, max_bytes=int(max_mb * 1024 * 1024), backup_count=backups)
+    except OSError:
+        return None
+
+
+def _is_perf_panel_user():
+    """Painel de desempenho só para os usuários de PERF_PANEL_USERS (separados por vírgula; padrão admin)."""
+    users = {u.strip() for u in str(_get_setting("PERF_PANEL_USERS", "admin")).split(",") if u.strip()}
+    return st.session_state.get("username") in users
+
+
+@st.cache_resource(max_entries=4)
+def _dataframe_memory_cached(fingerprint, _df):
+    """Memória do DataFrame por versão dos dados (memory_usage(deep=True) percorre todos os textos)."""
+    return dataframe_memory_bytes(_df)
+
+
+def _note_dataframe_memory(df):
+    """Anota no rerun as linhas e a memória do conjunto de dados em uso."""
+    note(df_linhas=len(df), df_bytes=_dataframe_memory_cached(dataset_fingerprint(df), df) if not df.empty else 0)
+    # Memória antes da compactação dos tipos (só quando a normalização rodou neste processo)
+    before = df.attrs.get("memory_bytes", {}).get("before")
+    if before is not None:
+        note(df_bytes_antes=before)
+
+
+def _format_mb(num_bytes):
+    return f"{num_bytes / 1024 / 1024:.1f} MB" if num_bytes is not None else "—"
+
+
+def _render_perf_panel(trace):
+    """Painel na barra lateral com as etapas deste rerun e os totais dos anteriores."""
+    record = trace.to_record()
+    with st.sidebar.expander(f"⏱️ Desempenho: {_format_ms(record['total_ms'] / 1000)} neste rerun"):
+        memory = f"dados {_format_mb(record.get('df_bytes'))}"
+        if record.get("df_bytes_antes") is not None:
+            memory += f" (antes da compactação {_format_mb(record['df_bytes_antes'])})"
+        st.caption(
+            f"RSS do processo {_format_mb(record['rss_bytes'])} · {memory} "
+            f"· {record.get('df_linhas', 0)} linhas"
+        )
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    "Etapa": "\u2003" * entry["depth"] + entry["name"],
+                    "ms": entry["ms"],
+                    "Detalhes": ", ".join(f"{k}={v}" for k, v in entry["attrs"].items()),
+                }
+                for entry in record["spans"]
+            ]),
+            hide_index=True,
+            use_container_width=True,
+        )
+        history = st.session_state.get("reruns_medidos", [])
+        if history:
+            st.caption(
+                "Reruns anteriores: "
+                + " · ".join(f"{r['ts'][11:]} {_format_ms(r['total_ms'] / 1000)}" for r in reversed(history))
+            )
+
+
+def _finish_rerun_trace():
+    """Fecha a medição do rerun, grava no log e guarda o resumo na sessão."""
+    trace = end_trace()
+    if trace is None:
+        return
+    record = trace.to_record()
+    perf_log = _get_perf_log()
+    if perf_log is not None:
+        perf_log.write(record)
+    history = st.session_state.setdefault("reruns_medidos", [])
+    history.append({"ts": record["ts"], "total_ms": record["total_ms"]})
+    del history[:-_MAX_RERUNS_PAINEL]
+
+
+# ---------- Indicadores de não conformidade ----------
+
+def _ranking_table(ranking, label):
+    return ranking.rename_axis(label).rename(columns={
+        "vistorias": "Vistorias",
+        "nao_conformidades": "Não conformidades",
+        "com_nc": "Vistorias com NC",
+        "media": "Média por vistoria",
+    })
+
+
+def _render_analytics(df, column_mapping, positions, selection):
+    """Não conformidades por área, itens que mais falham e rankings por cidade e por veículo."""
+    filtered = any(part for part in selection)
+    with span("indicadores", filtrado=filtered):
+        summary = get_non_conformity_summary(
+            df, column_mapping, positions if filtered else None, selection if filtered else None
+        )
+    st.header("📈 Não conformidades")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Vistorias com não conformidade", summary["vistorias_com_nc"])
+    with col2:
+        st.metric("Não conformidades", summary["nao_conformidades"])
+    with col3:
+        media = summary["nao_conformidades"] / summary["vistorias"] if summary["vistorias"] else 0
+        st.metric("Média por vistoria", f"{media:.1f}".replace(".", ","))
+
+    tab_area, tab_itens, tab_cidades, tab_veiculos = st.tabs(["Por área", "Itens", "Cidades", "Veículos"])
+    with tab_area:
+        por_area = summary["por_area"].rename(columns={
+            "nao_conformidades": "Não conformidades", "vistorias_com_nc": "Vistorias com NC"
+        })
+        st.bar_chart(por_area["Não conformidades"], horizontal=True)
+        st.dataframe(por_area, use_container_width=True)
+    with tab_itens:
+        st.caption("Itens com mais não conformidades (nomes da planilha de formatação)")
+        st.dataframe(
+            summary["top_itens"].rename(columns={
+                "item": "Item", "area": "Área", "nao_conformidades": "Não conformidades", "percentual": "% das vistorias"
+            }),
+            hide_index=True,
+            use_container_width=True,
+            column_config={"% das vistorias": st.column_config.NumberColumn(format="%.1f%%")},
+        )
+    with tab_cidades:
+        if summary["por_cidade"] is not None:
+            st.dataframe(_ranking_table(summary["por_cidade"], "Cidade"), use_container_width=True)
+    with tab_veiculos:
+        if summary["por_veiculo"] is not None:
+            st.dataframe(_ranking_table(summary["por_veiculo"], "Prefixo"), use_container_width=True)
+
+
+# ---------- Tendências (agregados diários) ----------
+
+@st.cache_resource
+def _get_daily_rollup():
+    """
+    Agregados diários compartilhados entre sessões; cada nova versão dos dados só processa
+    as respostas novas. TRENDS_FULL_REBUILD_SECONDS (padrão 3600) define a reconstrução completa.
+    """
+    try:
+        interval = float(_get_setting("TRENDS_FULL_REBUILD_SECONDS", DEFAULT_FULL_REBUILD_INTERVAL))
+    except (TypeError, ValueError):
+        interval = DEFAULT_FULL_REBUILD_INTERVAL
+    return DailyRollup(full_rebuild_interval=interval)
+
+
+_TREND_PERIODS = {"Dia": "D", "Semana": "W"}
+
+
+def _render_trends(df, column_mapping, cidades=None):
+    """Vistorias por dia/semana, não conformidades por área e vistorias por cidade ao longo do tempo."""
+    schema = get_vistoria_schema(df.columns, column_mapping)
+    rollup = _get_daily_rollup()
+    with span("tendencias"):
+        updates = rollup.full_builds + rollup.incremental_updates
+        table = rollup.update(
+            df, schema, get_non_conformity_matrix(df, column_mapping), version=dataset_fingerprint(df)
+        )
+        if rollup.full_builds + rollup.incremental_updates != updates:
+            note(linhas_processadas=rollup.last_rows_processed)
+    st.header("📉 Tendências")
+    label = st.radio("Agrupar por", list(_TREND_PERIODS), horizontal=True, key="tendencias_periodo")
+    series = trend_series(table, _TREND_PERIODS[label], cidades)
+    if series["vistorias"].empty:
+        st.info("Sem vistorias com data para mostrar a tendência.")
+        return
+    tab_vistorias, tab_areas, tab_cidades = st.tabs(["Vistorias", "Não conformidades por área", "Por cidade"])
+    with tab_vistorias:
+        st.line_chart(series["vistorias"].rename(columns={
+            "vistorias": "Vistorias", "com_nc": "Com não conformidade"
+        }))
+    with tab_areas:
+        st.line_chart(series["areas"])
+    with tab_cidades:
+        st.line_chart(series["cidades"])
+
+
+# ---------- Filtros da lista de registros ----------
+
+# Campos filtráveis por valor (papel no VistoriaSchema, rótulo)
+_FILTER_FIELDS = [("prefixo", "Prefixo"), ("cidade", "Cidade"), ("vistoriador", "Vistoriador")]
+
+
+def _reset_page():
+    """Volta para a primeira página quando um filtro muda."""
+    st.session_state["registros_pagina"] = 1
+
+
+def _render_filters(index):
+    """
+    Filtros da barra lateral (período, prefixo, cidade e vistoriador).
+    Retorna (início, fim, critérios) no formato de VistoriaIndex.query().
+    """
+    st.sidebar.markdown("### 🔎 Filtros")
+    start = end = None
+    first, last = index.date_bounds()
+    if first is not None:
+        period = st.sidebar.date_input(
+            "Período",
+            value=(),
+            min_value=first,
+            max_value=last,
+            format="DD/MM/YYYY",
+            key="filtro_periodo",
+            on_change=_reset_page,
+        )
+        # Enquanto só a data inicial foi escolhida, filtra a partir dela
+        if len(period) >= 1:
+            start = period[0]
+        if len(period) == 2:
+            end = period[1]
+    criteria = {}
+    for role, label in _FILTER_FIELDS:
+        options = index.options(role)
+        if not options:
             continue
-        
-        value = row[col]
-        if has_non_conformity(value):
-            # Usar mapeamento se disponível
-            nome_tratado, area = get_column_info(col, column_mapping)
-            
-            if area and area in areas_order:
-                # Usar nome tratado se disponível, senão usar nome original formatado
-                item_name = nome_tratado if nome_tratado else format_item_name(col)
-                # Armazenar também o nome da coluna original para formatação de datas de extintor
-                non_conformities_by_area[area].append((item_name, value, col))
-            elif not column_mapping:
-                # Fallback para função antiga se não houver mapeamento
-                area_antiga = get_area_from_column(col)
-                if area_antiga:
-                    # Converter nome da área antiga para novo formato
-                    area_map = {
-                        'Externa': 'EXTERNA',
-                        'Cabine': 'CABINE',
-                        'Salão': 'SALÃO',
-                        'Sanitário': 'SANITÁRIO',
-                        'Geladeiras': 'GELADEIRA'
-                    }
-                    area = area_map.get(area_antiga)
-                    if area and area in areas_order:
-                        item_name = format_item_name(col)
-                        non_conformities_by_area[area].append((item_name, value, col))
-    
-    # Coletar observações gerais separadamente (serão exibidas na seção GERAL ao final)
-    obs_geral = None
-    obs_geral_col = None
-    for col in df.columns:
-        if 'observações gerais' in col.lower() or 'observacoes gerais' in col.lower():
-            obs_geral = row.get(col, '')
-            obs_geral_col = col
-            break
-    
-    # Calcular altura total estimada e ajustar espaçamentos
-    # Incluir observações gerais na contagem se houver
-    total_items = sum(len(items) for items in non_conformities_by_area.values())
-    if pd.notna(obs_geral) and str(obs_geral).strip():
-        total_items += 1
-    areas_with_items = sum(1 for items in non_conformities_by_area.values() if items)
-    
-    # Ajustar espaçamentos baseado na quantidade de conteúdo
-    if total_items > 20:
-        item_spacing = 1
-        area_spacing = 3
-        normal_style.spaceAfter = 1
-    elif total_items > 10:
-        item_spacing = 2
-        area_spacing = 4
-        normal_style.spaceAfter = 2
-    else:
-        item_spacing = 3
-        area_spacing = 6
-        normal_style.spaceAfter = 3
-    
-    # Mapear nomes das áreas para exibição
-    area_display_names = {
-        'EXTERNA': 'EXTERNA',
-        'CABINE': 'CABINE',
-        'SALÃO': 'SALÃO',
-        'SANITÁRIO': 'SANITÁRIO',
-        'GELADEIRA': 'GELADEIRAS'
-    }
-    
-    # Adicionar conteúdo por área (apenas áreas com não conformidades)
-    for area in areas_order:
-        if non_conformities_by_area[area]:
-            display_name = area_display_names.get(area, area)
-            story.append(Paragraph(f"<b>{display_name}</b>", heading_style))
-            
-            for item_data in non_conformities_by_area[area]:
-                # Desempacotar dados: (item_name, item_value, col_name_original)
-                if len(item_data) == 3:
-                    item_name, item_value, col_name_original = item_data
-                else:
-                    # Fallback para compatibilidade
-                    item_name, item_value = item_data
-                    col_name_original = None
-                
-                # Formatar valor removendo decimais desnecessários
-                value_str = format_value(item_value, col_name_original)
-                
-                # Verificar se é campo de observações
-                is_observacao = 'observações' in item_name.lower() or 'observacoes' in item_name.lower()
-                
-                if is_observacao:
-                    # Para observações: quebrar linha após o nome e adicionar bullet points em cada linha
-                    # Preservar quebras de linha: substituir \n por <br/> para o ReportLab
-                    value_str = str(value_str).replace('\n', '<br/>')
-                    value_str = value_str.replace('\r\n', '<br/>').replace('\r', '<br/>')
-                    
-                    # Dividir por quebras de linha e adicionar bullet point em cada linha
-                    linhas = value_str.split('<br/>')
-                    linhas_formatadas = []
-                    for linha in linhas:
-                        linha = linha.strip()
-                        if linha:  # Só adicionar se a linha não estiver vazia
-                            linhas_formatadas.append(f"• {linha}")
-                    
-                    # Juntar todas as linhas com quebra de linha
-                    value_str_formatado = '<br/>'.join(linhas_formatadas)
-                    
-                    # Quebrar linha após o nome do item
-                    item_text = f"• <b>{item_name}:</b><br/>{value_str_formatado}"
-                else:
-                    # Para outros campos: apenas preservar quebras de linha
-                    value_str = str(value_str).replace('\n', '<br/>')
-                    value_str = value_str.replace('\r\n', '<br/>').replace('\r', '<br/>')
-                    item_text = f"• <b>{item_name}:</b> {value_str}"
-                
-                story.append(Paragraph(item_text, normal_style))
-                story.append(Spacer(1, item_spacing))
-            
-            story.append(Spacer(1, area_spacing))
-    
-    # Adicionar seção GERAL com observações gerais ao final (se houver)
-    if pd.notna(obs_geral) and str(obs_geral).strip():
-        story.append(Paragraph(f"<b>GERAL</b>", heading_style))
-        
-        # Buscar nome tratado para observações gerais
-        nome_tratado, _ = get_column_info(obs_geral_col, column_mapping) if column_mapping and obs_geral_col else (None, None)
-        nome_obs = nome_tratado if nome_tratado else 'Observações Gerais'
-        
-        # Formatar valor das observações gerais
-        value_str = str(obs_geral)
-        # Preservar quebras de linha: substituir \n por <br/> para o ReportLab
-        value_str = value_str.replace('\n', '<br/>')
-        # Também substituir \r\n (Windows) e \r (Mac)
-        value_str = value_str.replace('\r\n', '<br/>').replace('\r', '<br/>')
-        
-        # Dividir por quebras de linha e adicionar bullet point em cada linha
-        linhas = value_str.split('<br/>')
-        linhas_formatadas = []
-        for linha in linhas:
-            linha = linha.strip()
-            if linha:  # Só adicionar se a linha não estiver vazia
-                linhas_formatadas.append(f"• {linha}")
-        
-        # Juntar todas as linhas com quebra de linha
-        value_str_formatado = '<br/>'.join(linhas_formatadas)
-        
-        # Quebrar linha após o nome do item
-        item_text = f"• <b>{nome_obs}:</b><br/>{value_str_formatado}"
-        story.append(Paragraph(item_text, normal_style))
-        story.append(Spacer(1, item_spacing))
-    
-    # Se não houver nenhuma não conformidade e nenhuma observação geral
-    if not any(non_conformities_by_area.values()) and (pd.isna(obs_geral) or not str(obs_geral).strip()):
-        story.append(Paragraph("<b>Nenhuma não conformidade registrada.</b>", normal_style))
-    
-    # Construir PDF
-    doc.build(story)
-    buffer.seek(0)
-    return buffer
+        chosen = st.sidebar.multiselect(
+            label, options, format_func=str, placeholder="Todos", key=f"filtro_{role}", on_change=_reset_page
+        )
+        if chosen:
+            criteria[role] = chosen
+    return start, end, criteria
+
+
+# Opções de registros por página na lista de vistorias
+_PAGE_SIZE_OPTIONS = [10, 25, 50, 100]
+
+
+def _get_default_page_size():
+    """Tamanho de página padrão (RECORDS_PAGE_SIZE em Secrets/ambiente, padrão 25)."""
+    try:
+        page_size = int(_get_setting("RECORDS_PAGE_SIZE", 25))
+    except (TypeError, ValueError):
+        page_size = 25
+    return max(1, page_size)
+
+
+def _render_pagination(total_rows):
+    """
+    Controles de paginação (tamanho da página e ir para página).
+    Retorna o intervalo (início, fim) de posições do DataFrame a exibir.
+    """
+    default_size = _get_default_page_size()
+    options = sorted(set(_PAGE_SIZE_OPTIONS + [default_size]))
+    pag_col1, pag_col2, pag_col3 = st.columns([2, 2, 6])
+    with pag_col1:
+        page_size = st.selectbox(
+            "Registros por página",
+            options,
+            index=options.index(default_size),
+            key="registros_page_size",
+        )
+    total_pages = max(1, -(-total_rows // page_size))
+    # Manter a página dentro do intervalo quando o tamanho da página ou os dados mudam
+    st.session_state.setdefault("registros_pagina", 1)
+    if st.session_state["registros_pagina"] > total_pages:
+        st.session_state["registros_pagina"] = total_pages
+    with pag_col2:
+        page = st.number_input(
+            "Ir para página",
+            min_value=1,
+            max_value=total_pages,
+            step=1,
+            key="registros_pagina",
+        )
+    start = (int(page) - 1) * page_size
+    end = min(start + page_size, total_rows)
+    with pag_col3:
+        st.caption(f"Página {int(page)} de {total_pages} — registros {start + 1} a {end} de {total_rows}")
+    return start, end
+
 
 # Interface principal
 def main():
@@ -975,58 +1288,82 @@ def main():
     st.markdown("---")
     
     # Carregar dados e mapeamento
-    df = load_data()
-    column_mapping = load_column_mapping()
+    with span("load_data", cache="acerto"):
+        df = load_data()
+        note(fonte=st.session_state.get("data_source"), linhas=len(df))
+    with span("load_column_mapping", cache="acerto"):
+        column_mapping = load_column_mapping()
+    _note_dataframe_memory(df)
 
     # Indicar fonte dos dados (Google Planilhas ou arquivo local)
     _src = st.session_state.get("data_source", "xlsx")
-    st.sidebar.caption("📊 Dados: Google Planilhas" if _src == "google" else "📊 Dados: arquivo local")
+    if _src == "google":
+        st.sidebar.caption("📊 Dados: Google Planilhas")
+    elif _src == "snapshot":
+        _saved_at = st.session_state.get("data_snapshot", {}).get("saved_at")
+        _saved_at = datetime.fromtimestamp(_saved_at).strftime('%d/%m %H:%M') if _saved_at else "?"
+        st.sidebar.caption(f"📊 Dados: cópia local do Google Planilhas (salva em {_saved_at})")
+    else:
+        st.sidebar.caption("📊 Dados: arquivo local")
+    _render_breaker_status()
+    if _src in ("google", "snapshot"):
+        _render_data_refresh_stats()
+    if _src == "google":
+        _render_sheets_client_stats()
+    _cache_stats = _get_report_cache().stats()
+    st.sidebar.caption(
+        f"🗂️ Cache de relatórios: {_cache_stats['hits']} acertos / {_cache_stats['misses']} falhas"
+    )
 
     if df.empty:
         st.warning("Nenhum dado encontrado na planilha.")
         return
     
+    # Colunas do formulário ausentes na planilha de formatação (caem no nome original/sem área)
+    if isinstance(column_mapping, ColumnMapping) and column_mapping:
+        _unmapped = column_mapping.unmapped_columns(df.columns)
+        if _unmapped:
+            with st.sidebar.expander(f"⚠️ Colunas sem mapeamento ({len(_unmapped)})"):
+                st.caption("Colunas do formulário ausentes em formatacao_colunas.xlsx:")
+                for _col in _unmapped:
+                    st.caption(f"• {_col}")
+    
+    # Papéis das colunas (prefixo, cidade, vistoriador, carimbo...) resolvidos uma única vez
+    schema = get_vistoria_schema(df.columns, column_mapping)
+    
+    # Filtros resolvidos pelos índices (montados uma vez por versão dos dados)
+    start, end, criteria = _render_filters(get_vistoria_index(df))
+    with span("filtros", criterios=len(criteria) + (start is not None)):
+        positions = get_vistoria_index(df).query(start, end, **criteria)
+        note(linhas=len(positions))
+    selection = (start, end, tuple((role, tuple(map(str, values))) for role, values in criteria.items()))
+    
     # Dashboard Gerencial
     st.header("📊 Dashboard Gerencial")
     
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        total_vistorias = len(df)
+        total_vistorias = len(positions)
         st.metric("Total de Vistorias", total_vistorias)
     
     with col2:
-        cidade_col = None
-        for col in df.columns:
-            if 'cidade' in col.lower():
-                cidade_col = col
-                break
-        if cidade_col:
-            cidades_unicas = df[cidade_col].nunique()
+        if schema.cidade:
+            cidades_unicas = df[schema.cidade].take(positions).nunique()
             st.metric("Cidades", cidades_unicas)
         else:
             st.metric("Cidades", 0)
     
     with col3:
-        vistoriador_col = None
-        for col in df.columns:
-            if 'vistoriador' in col.lower():
-                vistoriador_col = col
-                break
-        if vistoriador_col:
-            vistoriadores_unicos = df[vistoriador_col].nunique()
+        if schema.vistoriador:
+            vistoriadores_unicos = df[schema.vistoriador].take(positions).nunique()
             st.metric("Vistoriadores", vistoriadores_unicos)
         else:
             st.metric("Vistoriadores", 0)
     
     with col4:
-        carimbo_col = None
-        for col in df.columns:
-            if 'carimbo' in col.lower() and 'data' in col.lower():
-                carimbo_col = col
-                break
-        if carimbo_col:
-            ultima_vistoria = df[carimbo_col].max()
+        if schema.carimbo:
+            ultima_vistoria = df[schema.carimbo].take(positions).max()
             if pd.notna(ultima_vistoria):
                 if isinstance(ultima_vistoria, pd.Timestamp):
                     st.metric("Última Vistoria", ultima_vistoria.strftime('%d/%m/%Y'))
@@ -1039,67 +1376,29 @@ def main():
     
     st.markdown("---")
     
+    if len(positions) > 0:
+        _render_analytics(df, column_mapping, positions, selection)
+        st.markdown("---")
+        # Tendência da base inteira; o filtro de cidade restringe as séries
+        _render_trends(df, column_mapping, criteria.get("cidade"))
+        st.markdown("---")
+    
     # Gerenciador de Arquivos
     st.header("📁 Registros de Vistoria")
     
     # Tabela de registros
-    if len(df) > 0:
+    if len(positions) > 0:
+        with st.expander("📦 Exportar todos os relatórios (ZIP ou PDF consolidado)"):
+            _render_bulk_export(df, column_mapping, positions, selection)
+            st.markdown("---")
+            _render_consolidated_export(df, column_mapping, positions, selection)
+        
+        # Apenas a página visível é montada (linhas, metadados e botões)
+        page_start, page_end = _render_pagination(len(positions))
+        
         # Preparar dados para exibição
-        display_data = []
-        for idx in range(len(df)):
-            row = df.iloc[idx]
-            
-            # Buscar colunas de forma flexível
-            prefixo = 'N/A'
-            cidade = 'N/A'
-            vistoriador = 'N/A'
-            data_vistoria = 'N/A'
-            carimbo = None
-            
-            for col in df.columns:
-                col_lower = col.lower()
-                # Buscar especificamente por "ônibus (prefixo)" primeiro
-                if 'ônibus' in col_lower and 'prefixo' in col_lower:
-                    prefixo = str(row.get(col, 'N/A'))
-                elif 'prefixo' in col_lower:
-                    prefixo = str(row.get(col, 'N/A'))
-                elif 'cidade' in col_lower:
-                    cidade = str(row.get(col, 'N/A'))
-                elif 'vistoriador' in col_lower:
-                    vistoriador = str(row.get(col, 'N/A'))
-                elif 'data da vistoria' in col_lower:
-                    data_vistoria = str(row.get(col, 'N/A'))
-                elif 'carimbo' in col_lower and 'data' in col_lower:
-                    carimbo = row.get(col, None)
-            
-            if pd.notna(carimbo):
-                if isinstance(carimbo, pd.Timestamp):
-                    data_hora = carimbo.strftime('%d-%m-%Y %H:%M')
-                else:
-                    # Tentar converter se for string
-                    try:
-                        data_hora = pd.to_datetime(carimbo).strftime('%d-%m-%Y %H:%M')
-                    except:
-                        data_hora = str(carimbo).replace('/', '-')
-            else:
-                data_hora = 'N/A'
-            
-            # Separar data e hora para exibição
-            if ' ' in data_hora:
-                data_parte = data_hora.split()[0]  # DD-MM-AAAA
-                hora_parte = data_hora.split()[1]  # HH:MM
-            else:
-                data_parte = data_hora
-                hora_parte = 'N/A'
-            
-            display_data.append({
-                'Prefixo': prefixo,
-                'Cidade': cidade,
-                'Vistoriador': vistoriador,
-                'Data': data_parte,
-                'Hora': hora_parte,
-                'Índice': idx
-            })
+        with span("lista_registros", linhas=page_end - page_start):
+            display_data = display_rows(df, schema, positions[page_start:page_end].tolist())
         
         # Cabeçalho da tabela
         header_cols = st.columns([2, 2, 2, 2, 2, 2.5])
@@ -1119,7 +1418,8 @@ def main():
         st.markdown("---")
         
         # Exibir registros
-        for idx, row_data in enumerate(display_data):
+        for pos, row_data in enumerate(display_data):
+            idx = row_data['Índice']
             col1, col2, col3, col4, col5, col6 = st.columns([2, 2, 2, 2, 2, 2.5])
             
             with col1:
@@ -1141,17 +1441,28 @@ def main():
                 # Função para botões
                 _render_buttons(df, row_data, idx, column_mapping, is_mobile=False)
             
-            if idx < len(display_data) - 1:
+            if pos < len(display_data) - 1:
                 st.markdown("---")
+    elif len(df) > 0:
+        st.info("Nenhum registro encontrado para os filtros selecionados.")
     else:
         st.info("Nenhum registro encontrado.")
 
 if __name__ == "__main__":
-    # Verificar autenticação antes de mostrar o conteúdo
-    is_authenticated, authenticator = check_authentication()
-    
-    if is_authenticated:
-        main()
-    else:
-        # Mostrar apenas a tela de login
-        st.stop()
+    # Etapas do rerun medidas até o fim do script (inclusive após st.stop())
+    _rerun_trace = start_trace()
+    try:
+        # Verificar autenticação antes de mostrar o conteúdo
+        with span("autenticacao"):
+            is_authenticated, authenticator = check_authentication()
+        _rerun_trace.note(usuario=st.session_state.get("username"))
+        
+        if is_authenticated:
+            main()
+            if _is_perf_panel_user():
+                _render_perf_panel(_rerun_trace)
+        else:
+            # Mostrar apenas a tela de login
+            st.stop()
+    finally:
+        _finish_rerun_trace()
@@ -0,0 +1,134 @@
+"""
+Atualização em segundo plano (stale-while-revalidate) do conjunto de vistorias.
+
+get() devolve sempre a versão atual sem esperar: quando ela passa da idade
+máxima, uma thread busca a nova versão e a troca de forma atômica ao terminar.
+Só a primeira carga (quando não há nenhuma versão, nem snapshot) é feita na
+hora. Uma falha mantém a versão anterior; nova tentativa após retry_interval.
+Se o loader devolver o mesmo objeto da versão atual (nada mudou na fonte), só a
+validade é renovada.
+
+Não depende do Streamlit.
+"""
+import threading
+import time
+
+
+class BackgroundRefresher:
+    """
+    Mantém a versão atual dos dados como (valor, origem, carregado_em) e a
+    atualiza com loader() em uma thread. Uma instância por fonte, compartilhada
+    entre sessões.
+    """
+
+    def __init__(self, loader, max_age, retry_interval=None, on_refresh=None, name="atualizacao-dados"):
+        self._loader = loader
+        self.max_age = max_age
+        self.retry_interval = max_age if retry_interval is None else retry_interval
+        self._on_refresh = on_refresh
+        self._name = name
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        # Trocado por inteiro (uma atribuição): leitores nunca veem valor e data misturados
+        self._current = (None, None, 0.0)
+        self._thread = None
+        self._last_attempt = 0.0
+        self.refresh_count = 0
+        self.unchanged_count = 0
+        self.failure_count = 0
+        self.last_refresh_seconds = None
+        self.last_error = None
+
+    def seed(self, value, source, loaded_at):
+        """Versão inicial (ex.: snapshot local) servida até a primeira atualização."""
+        with self._lock:
+            if self._current[0] is None and value is not None:
+                self._current = (value, source, loaded_at)
+
+    def _load(self):
+        """
+        Executa loader() e troca a versão atual (o mesmo objeto só renova a data e não
+        chama on_refresh). Exceções são registradas e repassadas.
+        """
+        started = time.perf_counter()
+        try:
+            value = self._loader()
+        except Exception as e:
+            with self._lock:
+                self.failure_count += 1
+                self.last_error = e
+                self.last_refresh_seconds = time.perf_counter() - started
+            raise
+        with self._lock:
+            unchanged = value is self._current[0]
+            self._current = (value, "live", time.time())
+            self.refresh_count += 1
+            if unchanged:
+                self.unchanged_count += 1
+            self.last_error = None
+            self.last_refresh_seconds = time.perf_counter() - started
+        if self._on_refresh is not None and not unchanged:
+            try:
+                self._on_refresh(value)
+            except Exception:
+                pass
+        return value
+
+    def _run(self):
+        try:
+            self._load()
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._thread = None
+
+    def refresh_in_background(self):
+        """Inicia uma atualização em segundo plano (se nenhuma estiver em andamento)."""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._last_attempt = time.time()
+            self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+        return True
+
+    def get(self):
+        """
+        (valor, origem, carregado_em) atuais; origem é "live" ou a passada em seed().
+        Se a versão estiver velha, dispara a atualização e devolve a atual mesmo assim.
+        Sem nenhuma versão, carrega na hora (a exceção do loader é repassada).
+        """
+        value, source, loaded_at = self._current
+        if value is None:
+            with self._load_lock:
+                if self._current[0] is None:
+                    self._last_attempt = time.time()
+                    self._load()
+            return self._current
+        now = time.time()
+        if now - loaded_at >= self.max_age and now - self._last_attempt >= self.retry_interval:
+            self.refresh_in_background()
+        return value, source, loaded_at
+
+    def wait(self, timeout=None):
+        """Aguarda a atualização em andamento (uso em testes/scripts)."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self):
+        """Idade da versão atual, duração da última atualização e contadores."""
+        with self._lock:
+            _, source, loaded_at = self._current
+            return {
+                "source": source,
+                "loaded_at": loaded_at or None,
+                "age_seconds": time.time() - loaded_at if loaded_at else None,
+                "refreshing": self._thread is not None,
+                "last_refresh_seconds": self.last_refresh_seconds,
+                "refresh_count": self.refresh_count,
+                "unchanged_count": self.unchanged_count,
+                "failure_count": self.failure_count,
+                "last_error": str(self.last_error) if self.last_error is not None else None,
+            }
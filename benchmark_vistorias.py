@@ -0,0 +1,295 @@
+"""
+Benchmarks do dashboard com bases sintéticas de vistorias.
+
+Gera tabelas de respostas do formulário com os cabeçalhos reais de
+formatacao_colunas.xlsx, de 1 mil a 500 mil linhas. Os valores e as taxas de
+preenchimento de cada coluna seguem a base_de_dados.xlsx, quando existir. As
+células vêm como texto, com "" nas vazias, igual ao get_all_values() do Google
+Sheets. Mede as etapas caras do app e grava os tempos em JSON, para comparar
+commits.
+
+Exemplos:
+    python benchmark_vistorias.py --tamanhos 1000,10000 --saida bench_novo.json
+    python benchmark_vistorias.py --comparar bench_antigo.json bench_novo.json
+
+Não depende do Streamlit.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from exportacao import render_reports
+from relatorio import (
+    dataset_fingerprint,
+    display_rows,
+    format_series,
+    format_value,
+    generate_pdf,
+    get_vistoria_schema,
+    non_conformity_matrix,
+    non_conformity_summary,
+    normalize_vistoria_df,
+    read_column_mapping,
+)
+
+DEFAULT_SIZES = [1000, 10000, 100000, 500000]
+# Piora acima disso aparece como regressão no --comparar
+REGRESSION_THRESHOLD = 1.10
+
+_CIDADES = [
+    'São Paulo (SP)', 'Rio de Janeiro (RJ)', 'Belo Horizonte (MG)', 'Vitória (ES)', 'Curitiba (PR)',
+    'Campinas (SP)', 'Santos (SP)', 'Juiz de Fora (MG)', 'Cachoeiro de Itapemirim (ES)', 'Niterói (RJ)',
+]
+_VISTORIADORES = [f'Vistoriador {n:02d}' for n in range(1, 41)]
+_PREFIXOS = [str(p) for p in range(20000, 20600, 2)]
+
+
+# ---------- Base sintética ----------
+
+def _cell_text(value):
+    """Valor da base real como o Google Sheets devolve (texto; inteiros sem '.0')."""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.strftime('%d/%m/%Y')
+    return str(value)
+
+
+def column_profiles(base_path='base_de_dados.xlsx', max_values=50):
+    """
+    Perfil de cada coluna da base real: {coluna: (taxa de preenchimento, valores, pesos)}.
+    Vazio se a base não existir.
+    """
+    if not base_path or not os.path.isfile(base_path):
+        return {}
+    raw = pd.read_excel(base_path)
+    profiles = {}
+    for col in raw.columns:
+        filled = raw[col].dropna()
+        if filled.empty:
+            continue
+        counts = filled.map(_cell_text).value_counts().head(max_values)
+        profiles[str(col).strip()] = (len(filled) / len(raw), counts.index.to_list(), counts.to_numpy() / counts.sum())
+    return profiles
+
+
+def synthetic_vistorias(n_rows, columns, profiles=None, seed=0, days=365):
+    """
+    DataFrame de n_rows respostas com as colunas informadas, todas como texto ("" = vazio).
+    Colunas de identificação (carimbo, prefixo, cidade...) recebem valores plausíveis;
+    as demais seguem o perfil da base real ou, sem perfil, 2% de "NÃO CONFORME".
+    """
+    rng = np.random.default_rng(seed)
+    profiles = profiles or {}
+    end = datetime(2026, 1, 1)
+    seconds = np.sort(rng.integers(0, days * 86400, size=n_rows))
+    stamps = pd.to_datetime(end - timedelta(days=days)) + pd.to_timedelta(seconds, unit='s')
+    data = {}
+    for col in columns:
+        lower = col.lower()
+        if 'carimbo' in lower and 'data' in lower:
+            data[col] = stamps.strftime('%d/%m/%Y %H:%M:%S').to_numpy(dtype=object)
+        elif 'data da vistoria' in lower:
+            data[col] = stamps.strftime('%d/%m/%Y').to_numpy(dtype=object)
+        elif 'prefixo' in lower:
+            data[col] = rng.choice(np.array(_PREFIXOS, dtype=object), size=n_rows)
+        elif 'cidade' in lower:
+            data[col] = rng.choice(np.array(_CIDADES, dtype=object), size=n_rows)
+        elif 'vistoriador' in lower:
+            data[col] = rng.choice(np.array(_VISTORIADORES, dtype=object), size=n_rows)
+        elif 'quilometragem' in lower:
+            data[col] = rng.integers(1000, 900000, size=n_rows).astype(str).astype(object)
+        elif 'e-mail' in lower or 'email' in lower:
+            data[col] = np.full(n_rows, 'vistorias@example.com', dtype=object)
+        else:
+            fill_rate, values, weights = profiles.get(col, (0.02, ['NÃO CONFORME'], [1.0]))
+            values_array = np.empty(len(values), dtype=object)
+            values_array[:] = values
+            column = np.full(n_rows, '', dtype=object)
+            mask = rng.random(n_rows) < fill_rate
+            column[mask] = rng.choice(values_array, size=int(mask.sum()), p=weights)
+            data[col] = column
+    return pd.DataFrame(data, columns=list(columns))
+
+
+# ---------- Medição ----------
+
+def _timeit(func, repeat=3):
+    """Melhor tempo (s) de func() em repeat execuções e o resultado da última."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _record(results, name, rows, seconds, items=None, **extra):
+    entry = {'name': name, 'rows': rows, 'seconds': round(seconds, 6)}
+    if items:
+        entry['items'] = items
+        entry['per_item_seconds'] = round(seconds / items, 9)
+    entry.update(extra)
+    results.append(entry)
+    per_item = f" ({entry['per_item_seconds'] * 1000:.3f} ms/item)" if items else ''
+    print(f"  {name:<32} {rows:>8} linhas  {seconds:9.4f} s{per_item}", flush=True)
+
+
+def run_benchmarks(sizes, mapping_path='formatacao_colunas.xlsx', base_path='base_de_dados.xlsx',
+                   pdf_sample=50, pdf_batch=200, display_batch=20000, workers=None, seed=0, repeat=3):
+    """Executa os benchmarks para cada tamanho de base e retorna a lista de resultados."""
+    results = []
+    seconds, column_mapping = _timeit(lambda: read_column_mapping(mapping_path), repeat)
+    _record(results, 'load_column_mapping', 0, seconds)
+    columns = [str(c).strip() for c in pd.read_excel(mapping_path).iloc[:, 0].dropna()]
+    profiles = column_profiles(base_path)
+
+    for n_rows in sizes:
+        print(f"Base sintética com {n_rows} linhas", flush=True)
+        started = time.perf_counter()
+        raw = synthetic_vistorias(n_rows, columns, profiles, seed)
+        _record(results, 'gerar_base_sintetica', n_rows, time.perf_counter() - started)
+        runs = repeat if n_rows <= 100000 else 1
+
+        seconds, df = _timeit(lambda: normalize_vistoria_df(raw), runs)
+        memory = df.attrs.get('memory_bytes', {})
+        _record(results, 'normalize_vistoria_df', n_rows, seconds,
+                memory_bytes=int(df.memory_usage(deep=True).sum()), memory_bytes_before=memory.get('before'))
+        # Cópias feitas fora da medição e sem versão registrada: mede só o hash
+        copies = [df.copy() for _ in range(runs)]
+        for copy in copies:
+            copy.attrs.clear()
+        copies = iter(copies)
+        seconds, _ = _timeit(lambda: dataset_fingerprint(next(copies)), runs)
+        _record(results, 'dataset_fingerprint', n_rows, seconds)
+
+        schema = get_vistoria_schema(df.columns, column_mapping)
+        item_columns = [col for col, _, _ in schema.item_columns]
+        seconds, nc = _timeit(lambda: non_conformity_matrix(df, item_columns), runs)
+        _record(results, 'non_conformity_matrix', n_rows, seconds, items=n_rows * len(item_columns))
+
+        seconds, _ = _timeit(lambda: non_conformity_summary(df, schema, nc), runs)
+        _record(results, 'non_conformity_summary', n_rows, seconds)
+
+        # Lista de registros: uma página (como no app) e um lote grande
+        page = min(25, n_rows)
+        seconds, _ = _timeit(lambda: display_rows(df, schema, range(page)), repeat)
+        _record(results, 'display_rows_pagina', n_rows, seconds, items=page)
+        rows = min(display_batch, n_rows)
+        seconds, _ = _timeit(lambda: display_rows(df, schema, range(rows)), 1)
+        _record(results, 'display_rows_lote', n_rows, seconds, items=rows)
+
+        # format_value célula a célula x format_series por coluna (células com não conformidade)
+        cells = [(df.at[i, col], col) for col in item_columns for i in np.flatnonzero(nc[col].to_numpy())[:200]]
+        seconds, _ = _timeit(lambda: [format_value(v, c) for v, c in cells], repeat)
+        _record(results, 'format_value', n_rows, seconds, items=len(cells))
+        seconds, _ = _timeit(lambda: [format_series(df[col], col) for col in item_columns], runs)
+        _record(results, 'format_series_todas_colunas', n_rows, seconds, items=n_rows * len(item_columns))
+
+        # PDF: por registro (amostra) e em lote no pool de processos
+        sample = min(pdf_sample, n_rows)
+        timings = []
+        for pos in range(sample):
+            started = time.perf_counter()
+            generate_pdf(df, pos, column_mapping, nc)
+            timings.append(time.perf_counter() - started)
+        _record(results, 'generate_pdf', n_rows, sum(timings), items=sample,
+                p50_seconds=round(float(np.percentile(timings, 50)), 6),
+                p95_seconds=round(float(np.percentile(timings, 95)), 6))
+        batch = min(pdf_batch, n_rows)
+        started = time.perf_counter()
+        for _ in render_reports(df, range(batch), column_mapping, workers, nc):
+            pass
+        _record(results, 'generate_pdf_lote', n_rows, time.perf_counter() - started, items=batch,
+                workers=workers or os.cpu_count())
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(old_path, new_path, threshold=REGRESSION_THRESHOLD):
+    """Compara dois arquivos de resultados; retorna a quantidade de regressões."""
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    old_results = {(r['name'], r['rows']): r for r in old['results']}
+    print(f"{old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    regressions = 0
+    for r in new['results']:
+        before = old_results.get((r['name'], r['rows']))
+        if not before or not before['seconds']:
+            continue
+        ratio = r['seconds'] / before['seconds']
+        flag = ''
+        if ratio > threshold:
+            flag = '  <-- regressão'
+            regressions += 1
+        print(f"  {r['name']:<32} {r['rows']:>8}  {before['seconds']:9.4f} s -> {r['seconds']:9.4f} s  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks do dashboard com bases sintéticas de vistorias.")
+    parser.add_argument('--tamanhos', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="Quantidades de linhas separadas por vírgula (padrão: 1000,10000,100000,500000).")
+    parser.add_argument('--saida', default='benchmark_resultados.json', help="Arquivo JSON de resultados.")
+    parser.add_argument('--mapeamento', default='formatacao_colunas.xlsx')
+    parser.add_argument('--base', default='base_de_dados.xlsx',
+                        help="Base real usada para os valores e taxas de preenchimento (opcional).")
+    parser.add_argument('--pdfs', type=int, default=50, help="Registros na medição de generate_pdf por registro.")
+    parser.add_argument('--lote', type=int, default=200, help="Registros na medição de PDFs em lote.")
+    parser.add_argument('--workers', type=int, default=None, help="Processos do lote (padrão: núcleos).")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--comparar', nargs=2, metavar=('ANTES', 'DEPOIS'),
+                        help="Compara dois arquivos de resultados em vez de medir.")
+    args = parser.parse_args(argv)
+
+    if args.comparar:
+        return 1 if compare(*args.comparar) else 0
+
+    sizes = [int(s) for s in args.tamanhos.split(',') if s.strip()]
+    started_at = datetime.now().isoformat(timespec='seconds')
+    results = run_benchmarks(
+        sizes, args.mapeamento, args.base,
+        pdf_sample=args.pdfs, pdf_batch=args.lote, workers=args.workers, seed=args.seed,
+    )
+    payload = {
+        'meta': {
+            'commit': _git_commit(),
+            'started_at': started_at,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'sizes': sizes,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    print(f"Resultados gravados em {args.saida}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
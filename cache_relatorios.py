@@ -0,0 +1,245 @@
+"""
+Cache de relatórios PDF endereçado por conteúdo.
+
+A chave é um hash dos valores do registro + versão do mapeamento de colunas
+(formatacao_colunas.xlsx) + versão do template do relatório. Registros que não
+mudaram nunca são renderizados de novo, em nenhuma sessão.
+
+Dois níveis:
+- memória: LRU limitado em bytes;
+- disco (opcional): diretório com orçamento de bytes, despejo pelo acesso mais antigo
+  (DiskLRU: o diretório só é varrido na criação).
+
+Não depende do Streamlit, para poder ser usado também fora do app.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+# path -> ((mtime_ns, tamanho), versão)
+_FILE_VERSIONS = {}
+
+
+def file_version(path):
+    """Hash (sha256 curto) do conteúdo de um arquivo; recalcula só se mtime/tamanho mudarem."""
+    try:
+        st_ = os.stat(path)
+    except OSError:
+        return "ausente"
+    sig = (st_.st_mtime_ns, st_.st_size)
+    cached = _FILE_VERSIONS.get(path)
+    if cached and cached[0] == sig:
+        return cached[1]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    version = h.hexdigest()[:16]
+    _FILE_VERSIONS[path] = (sig, version)
+    return version
+
+
+def report_cache_key(columns, values, mapping_version, template_version):
+    """Chave do relatório: hash dos pares coluna/valor do registro e das versões."""
+    h = hashlib.sha256()
+    h.update(f"{mapping_version}\x1f{template_version}\x1e".encode("utf-8"))
+    for col, value in zip(columns, values):
+        h.update(f"{col}\x1f{value!s}\x1e".encode("utf-8", "surrogatepass"))
+    return h.hexdigest()
+
+
+class DiskLRU:
+    """
+    Arquivos <chave><suffix> em um diretório, com orçamento de bytes e despejo pelo
+    acesso mais antigo. O diretório é varrido uma vez, na criação; depois a ocupação
+    é mantida em contadores atualizados a cada gravação, acerto e despejo (stats() e
+    put() não listam o diretório).
+    """
+
+    def __init__(self, directory, max_bytes, suffix=".pdf"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        # chave -> tamanho, do acesso mais antigo para o mais recente
+        self._index = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def _scan(self):
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(self.suffix):
+                        try:
+                            st_ = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((st_.st_mtime, entry.name[:-len(self.suffix)], st_.st_size))
+        except OSError:
+            pass
+        with self._lock:
+            for _, key, size in sorted(entries):
+                self._index[key] = size
+                self._bytes += size
+            evicted = self._evict_locked()
+        self._remove(evicted)
+
+    def _track(self, key, size):
+        """Registra a chave como a usada mais recentemente (com o lock)."""
+        old = self._index.pop(key, None)
+        if old is not None:
+            self._bytes -= old
+        self._index[key] = size
+        self._bytes += size
+
+    def _forget(self, key):
+        old = self._index.pop(key, None)
+        if old is not None:
+            self._bytes -= old
+
+    def _evict_locked(self):
+        """Tira do índice as chaves mais antigas até caber no orçamento; devolve as removidas."""
+        evicted = []
+        while self._bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._bytes -= size
+            evicted.append(key)
+        return evicted
+
+    def _remove(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get(self, key):
+        """Bytes do arquivo da chave ou None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # ordem de acesso preservada para a próxima varredura
+        except OSError:
+            with self._lock:
+                self._forget(key)
+            return None
+        with self._lock:
+            # Também adota arquivos gravados por outro processo no mesmo diretório
+            self._track(key, len(data))
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._track(key, len(data))
+            evicted = self._evict_locked()
+        self._remove(evicted)
+
+    def stats(self):
+        """(arquivos, bytes) segundo os contadores."""
+        with self._lock:
+            return len(self._index), self._bytes
+
+
+class ReportCache:
+    """Cache LRU de bytes de PDF em memória, com nível opcional em disco."""
+
+    def __init__(self, max_memory_bytes=64 * 1024 * 1024, disk_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._disk = DiskLRU(disk_dir, max_disk_bytes) if disk_dir else None
+
+    # ---------- nível memória ----------
+
+    def _memory_put(self, key, data):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        if len(data) > self.max_memory_bytes:
+            return
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    # ---------- API ----------
+
+    def get(self, key):
+        """Retorna os bytes do relatório ou None (conta acerto/falha)."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return data
+        data = self._disk.get(key) if self._disk is not None else None
+        with self._lock:
+            if data is not None:
+                self._memory_put(key, data)
+                self.hits += 1
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+        return data
+
+    def put(self, key, data):
+        """Armazena os bytes nos dois níveis."""
+        with self._lock:
+            self._memory_put(key, data)
+        if self._disk is not None:
+            self._disk.put(key, data)
+
+    def get_or_create(self, key, factory):
+        """Retorna do cache ou gera com factory() (que deve devolver bytes) e armazena."""
+        data = self.get(key)
+        if data is None:
+            data = factory()
+            self.put(key, data)
+        return data
+
+    def stats(self):
+        """Contadores de acertos/falhas e ocupação dos níveis."""
+        with self._lock:
+            stats = {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+            }
+        if self._disk is not None:
+            stats["disk_entries"], stats["disk_bytes"] = self._disk.stats()
+        return stats
@@ -0,0 +1,103 @@
+"""
+Disjuntor (circuit breaker) para a fonte Google Sheets.
+
+Fechado: as chamadas passam normalmente. Após failure_threshold falhas
+seguidas ele abre: as chamadas são recusadas na hora (CircuitOpenError), sem
+esperar timeouts e novas tentativas, e o app usa a fonte local. Passado o
+cooldown, fica meio-aberto: uma única chamada de sondagem é liberada; sucesso
+fecha o disjuntor, falha o abre por mais um cooldown.
+
+Não depende do Streamlit.
+"""
+import threading
+import time
+
+
+class CircuitOpenError(RuntimeError):
+    """Chamada recusada porque o disjuntor está aberto (ou já há uma sondagem em andamento)."""
+
+
+class CircuitBreaker:
+    """Disjuntor compartilhado entre sessões (uma instância por fonte)."""
+
+    CLOSED = "fechado"
+    OPEN = "aberto"
+    HALF_OPEN = "meio-aberto"
+
+    def __init__(self, failure_threshold=3, cooldown=120.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._opened_at = None
+        self._probing = False
+        self.consecutive_failures = 0
+        self.open_count = 0
+        self.rejected_count = 0
+        self.last_error = None
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._probing or now - self._opened_at >= self.cooldown:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.time())
+
+    def allow(self):
+        """True se a chamada pode seguir; no estado meio-aberto libera só uma sondagem por vez."""
+        with self._lock:
+            state = self._state(time.time())
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected_count += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._opened_at = None
+            self._probing = False
+            self.consecutive_failures = 0
+            self.last_error = None
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = error
+            if self._probing or self.consecutive_failures >= self.failure_threshold:
+                if self._opened_at is None or self._probing:
+                    self.open_count += 1
+                self._opened_at = time.time()
+                self._probing = False
+
+    def call(self, func, *args, **kwargs):
+        """Executa func pelo disjuntor; recusa com CircuitOpenError se estiver aberto."""
+        if not self.allow():
+            raise CircuitOpenError("Google Sheets indisponível (disjuntor aberto)")
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+    def stats(self):
+        """Estado, falhas seguidas e horário da próxima sondagem (para exibição)."""
+        with self._lock:
+            now = time.time()
+            return {
+                "state": self._state(now),
+                "consecutive_failures": self.consecutive_failures,
+                "opened_at": self._opened_at,
+                "retry_at": self._opened_at + self.cooldown if self._opened_at is not None else None,
+                "open_count": self.open_count,
+                "rejected_count": self.rejected_count,
+                "last_error": str(self.last_error) if self.last_error is not None else None,
+            }
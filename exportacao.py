@@ -0,0 +1,230 @@
+"""
+Exportação em lote dos relatórios PDF (arquivo ZIP ou diretório).
+
+A geração com o ReportLab é CPU-bound e threads ficariam presas no GIL, por
+isso os PDFs são gerados em um pool de processos. Cada processo recebe as
+linhas exportadas uma única vez (initializer) e depois só as posições, em
+lotes. Os PDFs entram no ZIP à medida que ficam prontos. Relatórios já
+presentes no cache não são gerados de novo.
+
+Não depende do Streamlit.
+"""
+import io
+import math
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import context as mp_context
+from multiprocessing import reduction, spawn, util
+
+try:
+    from multiprocessing import forkserver, popen_forkserver
+except ImportError:  # sem forkserver (Windows)
+    forkserver = popen_forkserver = None
+
+from relatorio import (
+    FORMAT_BLOCK_SIZE,
+    format_item_cells,
+    generate_pdf,
+    get_vistoria_schema,
+    non_conformity_matrix,
+    record_filename,
+)
+
+# Abaixo disso o custo de iniciar o pool não compensa: gera no próprio processo
+_MIN_POOL_REPORTS = 8
+# Lotes pequenos o bastante para o progresso andar e para dividir bem a carga
+_MAX_CHUNK_SIZE = 16
+
+# Estado de cada processo do pool (preenchido por _init_worker)
+_worker_state = {}
+
+
+def _item_columns(df, column_mapping):
+    schema = get_vistoria_schema(df.columns, column_mapping)
+    return [col for col, _, _ in schema.item_columns]
+
+
+def _init_worker(df, column_mapping):
+    _worker_state['df'] = df
+    _worker_state['column_mapping'] = column_mapping
+    _worker_state['non_conformities'] = non_conformity_matrix(df, _item_columns(df, column_mapping))
+
+
+def _render_positions(df, positions, column_mapping, non_conformities):
+    """(posição, bytes) dos PDFs; os valores das não conformidades são formatados em bloco."""
+    schema = get_vistoria_schema(df.columns, column_mapping)
+    for start in range(0, len(positions), FORMAT_BLOCK_SIZE):
+        block = positions[start:start + FORMAT_BLOCK_SIZE]
+        formatted = format_item_cells(df, schema, block, non_conformities)
+        for k, pos in enumerate(block):
+            yield pos, generate_pdf(df, pos, column_mapping, non_conformities, formatted=formatted.iloc[k]).getvalue()
+
+
+def _render_chunk(positions):
+    df = _worker_state['df']
+    column_mapping = _worker_state['column_mapping']
+    non_conformities = _worker_state['non_conformities']
+    return list(_render_positions(df, positions, column_mapping, non_conformities))
+
+
+def _worker_preparation_data(name):
+    """
+    Dados de preparação do processo filho sem o __main__. No Streamlit o __main__ é o
+    script do app, e o multiprocessing o reexecutaria em cada processo do pool.
+    """
+    data = spawn.get_preparation_data(name)
+    data.pop('init_main_from_path', None)
+    data.pop('init_main_from_name', None)
+    return data
+
+
+if popen_forkserver is not None:
+    class _WorkerPopen(popen_forkserver.Popen):
+        """Popen do forkserver que não leva o __main__ para o processo filho."""
+
+        def _launch(self, process_obj):
+            prep_data = _worker_preparation_data(process_obj._name)
+            buf = io.BytesIO()
+            mp_context.set_spawning_popen(self)
+            try:
+                reduction.dump(prep_data, buf)
+                reduction.dump(process_obj, buf)
+            finally:
+                mp_context.set_spawning_popen(None)
+
+            self.sentinel, w = forkserver.connect_to_new_process(self._fds)
+            _parent_w = os.dup(w)
+            self.finalizer = util.Finalize(self, util.close_fds, (_parent_w, self.sentinel))
+            with open(w, 'wb', closefd=True) as f:
+                f.write(buf.getbuffer())
+            self.pid = forkserver.read_signed(self.sentinel)
+
+    class _WorkerProcess(mp_context.ForkServerProcess):
+        @staticmethod
+        def _Popen(process_obj):
+            return _WorkerPopen(process_obj)
+
+    class _WorkerContext(mp_context.ForkServerContext):
+        Process = _WorkerProcess
+
+
+def _pool_context():
+    """
+    forkserver (processos limpos, sem as threads do servidor) com os módulos do
+    relatório já importados e sem reexecutar o __main__; senão spawn, que reexecuta
+    o script do app (protegido por if __name__ == "__main__").
+    """
+    if popen_forkserver is not None and 'forkserver' in multiprocessing.get_all_start_methods():
+        context = _WorkerContext()
+        context.set_forkserver_preload(['relatorio', 'exportacao'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def render_reports(df, positions, column_mapping=None, workers=None, non_conformities=None):
+    """
+    Gera os PDFs das posições informadas; produz (posição, bytes) na ordem em que ficam prontos.
+    workers: número de processos (padrão: núcleos da máquina); 1 gera no próprio processo.
+    non_conformities: matriz de non_conformity_matrix() para df (usada só sem o pool).
+    """
+    positions = list(positions)
+    if not positions:
+        return
+    workers = min(workers or os.cpu_count() or 1, len(positions))
+    if workers <= 1 or len(positions) < _MIN_POOL_REPORTS:
+        if non_conformities is None:
+            non_conformities = non_conformity_matrix(df, _item_columns(df, column_mapping))
+        yield from _render_positions(df, positions, column_mapping, non_conformities)
+        return
+
+    # Só as linhas exportadas vão para os processos; posições locais 0..n-1
+    subset = df.iloc[positions].reset_index(drop=True)
+    chunk_size = max(1, min(_MAX_CHUNK_SIZE, math.ceil(len(positions) / (workers * 4))))
+    chunks = [range(start, min(start + chunk_size, len(positions))) for start in range(0, len(positions), chunk_size)]
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=_pool_context(),
+        initializer=_init_worker,
+        initargs=(subset, column_mapping),
+    ) as pool:
+        futures = [pool.submit(_render_chunk, list(chunk)) for chunk in chunks]
+        for future in as_completed(futures):
+            for local_pos, data in future.result():
+                yield positions[local_pos], data
+
+
+def _unique_name(name, used):
+    """Evita nomes repetidos no ZIP (mesmo prefixo e data): acrescenta _2, _3..."""
+    if name not in used:
+        used.add(name)
+        return name
+    base, ext = os.path.splitext(name)
+    n = 2
+    while f"{base}_{n}{ext}" in used:
+        n += 1
+    name = f"{base}_{n}{ext}"
+    used.add(name)
+    return name
+
+
+def export_zip(df, positions, output, column_mapping=None, workers=None, cache=None, cache_key=None,
+               progress=None, non_conformities=None):
+    """
+    Grava no ZIP output (caminho ou arquivo binário) um PDF por posição, com o nome
+    Relatorio_Vistoria_{prefixo}_{data}.pdf. cache (ReportCache) + cache_key(posição)
+    reaproveitam relatórios já gerados e guardam os novos. progress(feitos, total) é
+    chamado a cada PDF. Retorna a lista de nomes gravados.
+    """
+    positions = list(positions)
+    schema = get_vistoria_schema(df.columns, column_mapping)
+    used = set()
+    names = {pos: _unique_name(record_filename(schema, df.iloc[pos]), used) for pos in positions}
+    total = len(positions)
+    done = 0
+    keys = {}
+    missing = []
+    # PDFs do ReportLab já são comprimidos: ZIP sem compressão
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for pos in positions:
+            data = None
+            if cache is not None and cache_key is not None:
+                keys[pos] = cache_key(pos)
+                data = cache.get(keys[pos])
+            if data is None:
+                missing.append(pos)
+                continue
+            zf.writestr(names[pos], data)
+            done += 1
+            if progress:
+                progress(done, total)
+        for pos, data in render_reports(df, missing, column_mapping, workers, non_conformities):
+            if pos in keys:
+                cache.put(keys[pos], data)
+            zf.writestr(names[pos], data)
+            done += 1
+            if progress:
+                progress(done, total)
+    return [names[pos] for pos in positions]
+
+
+def export_directory(df, positions, directory, column_mapping=None, workers=None, progress=None):
+    """
+    Grava um PDF por posição no diretório, com os mesmos nomes do ZIP (cada arquivo de
+    forma atômica). progress(feitos, total) é chamado a cada PDF. Retorna os nomes gravados.
+    """
+    positions = list(positions)
+    os.makedirs(directory, exist_ok=True)
+    schema = get_vistoria_schema(df.columns, column_mapping)
+    used = set()
+    names = {pos: _unique_name(record_filename(schema, df.iloc[pos]), used) for pos in positions}
+    for done, (pos, data) in enumerate(render_reports(df, positions, column_mapping, workers), start=1):
+        path = os.path.join(directory, names[pos])
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        if progress:
+            progress(done, len(positions))
+    return [names[pos] for pos in positions]
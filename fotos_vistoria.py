@@ -0,0 +1,199 @@
+"""
+Fotos das vistorias para os relatórios.
+
+As colunas de fotografia do formulário trazem links do Drive (um ou mais por
+célula, separados por vírgula). PhotoStore baixa as imagens em um pool de
+threads limitado (o download é I/O, não fica preso no GIL), reduz cada uma uma
+única vez para a resolução do relatório (JPEG) e guarda a miniatura em disco
+pelo ID do arquivo, com orçamento de bytes (DiskLRU): gerar o relatório de novo
+não baixa nem redimensiona nada. O mesmo arquivo pedido por várias sessões ao
+mesmo tempo é baixado uma vez só, e uma foto que falhou não é pedida de novo
+antes de failure_ttl segundos.
+
+O download é feito por fetch(file_id) -> bytes: DriveFileFetcher (API do Drive
+ou um servidor local que a imita, em testes) ou qualquer outra função.
+
+Não depende do Streamlit.
+"""
+import io
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache_relatorios import DiskLRU
+
+# Endereço padrão da API do Drive (pode ser trocado por um servidor local em testes)
+DRIVE_API_BASE_URL = "https://www.googleapis.com"
+# Escopo para baixar os arquivos enviados pelo formulário
+DRIVE_READONLY_SCOPE = "https://www.googleapis.com/auth/drive.readonly"
+
+# Maior lado da miniatura (px): ~200 dpi no tamanho em que a foto aparece no PDF
+DEFAULT_MAX_PIXELS = 640
+DEFAULT_JPEG_QUALITY = 75
+DEFAULT_FETCH_WORKERS = 4
+# Orçamento do diretório de miniaturas (~3000 fotos de 80 KB)
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+# Tempo (s) em que uma foto que falhou é dada como indisponível sem nova tentativa
+DEFAULT_FAILURE_TTL = 300
+
+# ID do arquivo em links como .../open?id=<ID> ou .../file/d/<ID>/view
+_FILE_ID_PATTERN = re.compile(r'(?:[?&]id=|/d/)([\w-]{10,})')
+_VALID_FILE_ID = re.compile(r'[\w-]+')
+
+
+def drive_file_ids(value):
+    """IDs dos arquivos do Drive citados no valor da célula (na ordem, sem repetição)."""
+    if not isinstance(value, str):
+        return []
+    return list(dict.fromkeys(_FILE_ID_PATTERN.findall(value)))
+
+
+class DriveFileFetcher:
+    """
+    Baixa o conteúdo de um arquivo pela API do Drive (files.get com alt=media).
+    session: sessão HTTP (requests), autorizada com DRIVE_READONLY_SCOPE para a API real.
+    base_url permite usar um servidor local que imita a API (testes).
+    """
+
+    def __init__(self, session, base_url=None, timeout=30):
+        self.session = session
+        self.base_url = (base_url or DRIVE_API_BASE_URL).rstrip("/")
+        self.timeout = timeout
+
+    def __call__(self, file_id):
+        response = self.session.get(
+            f"{self.base_url}/drive/v3/files/{file_id}",
+            params={"alt": "media", "supportsAllDrives": "true"},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.content
+
+
+def make_thumbnail(data, max_pixels=DEFAULT_MAX_PIXELS, quality=DEFAULT_JPEG_QUALITY):
+    """Miniatura JPEG (maior lado <= max_pixels), já na orientação da câmera (EXIF)."""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEG: decodifica já reduzido (bem mais rápido para fotos de celular)
+        image.draft("RGB", (max_pixels, max_pixels))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((max_pixels, max_pixels))
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+    return output.getvalue()
+
+
+class PhotoStore:
+    """
+    Miniaturas das fotos por ID de arquivo, com cache em disco (até max_cache_bytes) e
+    downloads em um pool de threads limitado a max_workers. Falhas são lembradas por
+    failure_ttl segundos. Uma instância por processo, compartilhada entre sessões.
+    """
+
+    def __init__(self, fetch, cache_dir, max_workers=DEFAULT_FETCH_WORKERS,
+                 max_pixels=DEFAULT_MAX_PIXELS, quality=DEFAULT_JPEG_QUALITY,
+                 max_cache_bytes=DEFAULT_CACHE_BYTES, failure_ttl=DEFAULT_FAILURE_TTL):
+        self._fetch = fetch
+        self.cache_dir = cache_dir
+        self.max_pixels = max_pixels
+        self.quality = quality
+        self.failure_ttl = failure_ttl
+        self._disk = DiskLRU(cache_dir, max_cache_bytes, suffix=".jpg")
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fotos")
+        # Downloads em andamento: file_id -> Future (pedidos repetidos esperam o mesmo)
+        self._pending = {}
+        # Falhas recentes: file_id -> momento (time.monotonic) da próxima tentativa
+        self._failed = {}
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.downloads = 0
+        self.failures = 0
+        self.failure_hits = 0
+        self.last_error = None
+
+    def _download(self, file_id):
+        """Roda no pool: baixa, reduz e grava a miniatura (uma vez por arquivo)."""
+        try:
+            thumbnail = make_thumbnail(self._fetch(file_id), self.max_pixels, self.quality)
+            self._disk.put(file_id, thumbnail)
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+                self.last_error = e
+                self._failed[file_id] = time.monotonic() + self.failure_ttl
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(file_id, None)
+        with self._lock:
+            self.downloads += 1
+        return thumbnail
+
+    def _recently_failed(self, file_id):
+        """True se a última tentativa falhou há menos de failure_ttl (com o lock)."""
+        retry_at = self._failed.get(file_id)
+        if retry_at is None:
+            return False
+        if time.monotonic() < retry_at:
+            return True
+        del self._failed[file_id]
+        return False
+
+    def thumbnails(self, file_ids):
+        """
+        {file_id: bytes JPEG ou None} para os arquivos pedidos. Os que não estão no cache
+        são baixados em paralelo; None quando o download ou a imagem falham (agora ou há
+        menos de failure_ttl segundos).
+        """
+        result = {}
+        futures = {}
+        for file_id in dict.fromkeys(file_ids):
+            if not _VALID_FILE_ID.fullmatch(file_id):
+                result[file_id] = None
+                continue
+            data = self._disk.get(file_id)
+            if data is not None:
+                with self._lock:
+                    self.cache_hits += 1
+                result[file_id] = data
+                continue
+            with self._lock:
+                if self._recently_failed(file_id):
+                    self.failure_hits += 1
+                    result[file_id] = None
+                    continue
+                future = self._pending.get(file_id)
+                if future is None:
+                    # Outro pedido pode ter concluído o download depois da leitura acima
+                    # (e já saído de _pending): conferir o disco antes de baixar de novo
+                    data = self._disk.get(file_id)
+                    if data is not None:
+                        self.cache_hits += 1
+                        result[file_id] = data
+                        continue
+                    future = self._pool.submit(self._download, file_id)
+                    self._pending[file_id] = future
+            futures[file_id] = future
+        for file_id, future in futures.items():
+            try:
+                result[file_id] = future.result()
+            except Exception:
+                result[file_id] = None
+        return result
+
+    def stats(self):
+        entries, size = self._disk.stats()
+        with self._lock:
+            return {
+                "cache_hits": self.cache_hits,
+                "downloads": self.downloads,
+                "failures": self.failures,
+                "failure_hits": self.failure_hits,
+                "failed_files": len(self._failed),
+                "pending": len(self._pending),
+                "cache_entries": entries,
+                "cache_bytes": size,
+                "last_error": str(self.last_error) if self.last_error is not None else None,
+            }
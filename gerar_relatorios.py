@@ -0,0 +1,148 @@
+"""
+Geração de relatórios de vistoria pela linha de comando (sem navegador e sem Streamlit).
+
+Lê a base do snapshot local (Parquet) ou de um xlsx, seleciona as vistorias por
+período, prefixo e cidade e grava um PDF por vistoria (em paralelo), um ZIP ou um
+PDF consolidado. Pensado para jobs agendados (cron).
+
+Exemplos:
+    python gerar_relatorios.py --de 2026-01-01 --ate 2026-01-31 --saida relatorios/janeiro
+    python gerar_relatorios.py --cidade "São Paulo" --zip relatorios/sp.zip --workers 4
+    python gerar_relatorios.py --prefixo 41206 --consolidado relatorios/41206.pdf
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+from exportacao import export_directory, export_zip
+from relatorio import (
+    generate_consolidated_pdf,
+    get_vistoria_schema,
+    non_conformity_matrix,
+    read_column_mapping,
+    read_vistorias_xlsx,
+    select_positions,
+)
+from snapshot_dados import read_snapshot
+
+# Mesmos padrões do app
+DEFAULT_SNAPSHOT_PATH = os.path.join(".cache", "vistorias.parquet")
+DEFAULT_XLSX_PATH = "base_de_dados.xlsx"
+
+
+def _parse_date(text):
+    try:
+        return date.fromisoformat(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"data inválida: {text!r} (use AAAA-MM-DD)")
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Gera relatórios PDF de vistoria sem o app (para jobs agendados)."
+    )
+    parser.add_argument(
+        "--dados",
+        help="Arquivo da base: snapshot .parquet ou .xlsx. Padrão: snapshot local "
+             f"(VISTORIAS_SNAPSHOT_PATH ou {DEFAULT_SNAPSHOT_PATH}) se existir, senão {DEFAULT_XLSX_PATH}.",
+    )
+    parser.add_argument("--mapeamento", default="formatacao_colunas.xlsx",
+                        help="Planilha de formatação das colunas (padrão: formatacao_colunas.xlsx).")
+    parser.add_argument("--de", type=_parse_date, help="Data inicial do carimbo (AAAA-MM-DD, inclusive).")
+    parser.add_argument("--ate", type=_parse_date, help="Data final do carimbo (AAAA-MM-DD, inclusive).")
+    parser.add_argument("--prefixo", action="append", default=[],
+                        help="Prefixo do ônibus (pode repetir).")
+    parser.add_argument("--cidade", action="append", default=[],
+                        help="Cidade (trecho do nome, sem diferenciar acentos/maiúsculas; pode repetir).")
+    parser.add_argument("--saida", default="relatorios",
+                        help="Diretório dos PDFs individuais (padrão: relatorios).")
+    parser.add_argument("--zip", metavar="ARQUIVO",
+                        help="Grava os PDFs em um ZIP em vez de arquivos soltos.")
+    parser.add_argument("--consolidado", metavar="ARQUIVO",
+                        help="Gera um único PDF consolidado em vez de um PDF por vistoria.")
+    parser.add_argument("--layout", choices=["pagina", "compacto"], default="pagina",
+                        help="Layout do PDF consolidado (padrão: pagina).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processos em paralelo (padrão: REPORT_EXPORT_WORKERS ou núcleos da máquina).")
+    args = parser.parse_args(argv)
+    if args.zip and args.consolidado:
+        parser.error("use --zip ou --consolidado, não os dois")
+    if args.de and args.ate and args.de > args.ate:
+        parser.error("--de posterior a --ate")
+    return args
+
+
+def _default_data_path():
+    snapshot_path = os.environ.get("VISTORIAS_SNAPSHOT_PATH", DEFAULT_SNAPSHOT_PATH)
+    if snapshot_path and os.path.isfile(snapshot_path):
+        return snapshot_path
+    return DEFAULT_XLSX_PATH
+
+
+def load_vistorias(path):
+    """Base normalizada a partir de um snapshot .parquet ou de um xlsx."""
+    if path.endswith(".parquet"):
+        df, _ = read_snapshot(path)
+        if df is None:
+            raise ValueError(f"snapshot inválido ou de outra versão: {path}")
+        return df
+    return read_vistorias_xlsx(path)
+
+
+def _default_workers():
+    try:
+        return max(1, int(os.environ.get("REPORT_EXPORT_WORKERS", os.cpu_count() or 1)))
+    except ValueError:
+        return os.cpu_count() or 1
+
+
+def _print_progress(done, total):
+    if done % 50 == 0 or done == total:
+        print(f"  {done}/{total}", flush=True)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    data_path = args.dados or _default_data_path()
+    try:
+        df = load_vistorias(data_path)
+        column_mapping = read_column_mapping(args.mapeamento)
+    except Exception as e:
+        print(f"Erro ao carregar os dados: {e}", file=sys.stderr)
+        return 1
+    if df is None or df.empty:
+        print(f"Nenhum dado encontrado em {data_path}.", file=sys.stderr)
+        return 1
+
+    schema = get_vistoria_schema(df.columns, column_mapping)
+    positions = select_positions(df, schema, args.de, args.ate, args.prefixo, args.cidade)
+    print(f"{len(positions)} de {len(df)} vistorias selecionadas ({data_path}).")
+    if not positions:
+        return 0
+
+    workers = args.workers or _default_workers()
+    for path in (args.consolidado, args.zip):
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    started = time.perf_counter()
+    if args.consolidado:
+        non_conformities = non_conformity_matrix(df, [col for col, _, _ in schema.item_columns])
+        generate_consolidated_pdf(
+            df, positions, args.consolidado, column_mapping, non_conformities,
+            layout=args.layout, progress=_print_progress,
+        )
+        destino = args.consolidado
+    elif args.zip:
+        export_zip(df, positions, args.zip, column_mapping, workers=workers, progress=_print_progress)
+        destino = args.zip
+    else:
+        export_directory(df, positions, args.saida, column_mapping, workers=workers, progress=_print_progress)
+        destino = args.saida
+    print(f"Relatórios gravados em {destino} ({time.perf_counter() - started:.1f} s).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
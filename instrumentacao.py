@@ -0,0 +1,172 @@
+"""
+Medição das etapas de cada rerun do dashboard.
+
+Cada rerun abre um RerunTrace (start_trace) e as etapas caras são envolvidas
+em span("nome"). Os spans podem ser aninhados e guardam a duração e detalhes
+anotados com note() (ex.: acerto ou falha de cache, fonte, tentativas). Ao
+final, o rerun vira um registro com a memória do processo (RSS), que é
+gravado em um log JSON lines com rotação.
+
+span() e note() não fazem nada fora de um rerun medido (ex.: na thread de
+atualização dos dados ou na linha de comando). O trace atual fica em um
+threading.local porque cada sessão do Streamlit roda em uma thread própria.
+
+Não depende do Streamlit.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+_local = threading.local()
+
+
+def process_rss_bytes():
+    """Memória residente (RSS) atual do processo, em bytes; None se não houver como medir."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Fora do Linux: pico de RSS (KB no Linux, bytes no macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def dataframe_memory_bytes(df):
+    """Memória ocupada pelo DataFrame, incluindo o conteúdo dos textos."""
+    return int(df.memory_usage(deep=True).sum())
+
+
+class RerunTrace:
+    """Spans de um rerun: nome, início e duração em ms, profundidade e detalhes."""
+
+    def __init__(self, **attrs):
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.attrs = dict(attrs)
+        self.spans = []
+        self._stack = []
+        self.total_ms = None
+        self.rss_bytes = None
+
+    def _elapsed_ms(self):
+        return (time.perf_counter() - self._started) * 1000
+
+    @contextmanager
+    def span(self, name, **attrs):
+        entry = {
+            "name": name,
+            "depth": len(self._stack),
+            "start_ms": round(self._elapsed_ms(), 3),
+            "ms": None,
+            "attrs": dict(attrs),
+        }
+        self.spans.append(entry)
+        self._stack.append(entry)
+        started = time.perf_counter()
+        try:
+            yield entry
+        except BaseException as e:
+            # Inclui st.stop()/st.rerun(), que interrompem o script com exceções de controle
+            entry["attrs"]["interrompido"] = type(e).__name__
+            raise
+        finally:
+            entry["ms"] = round((time.perf_counter() - started) * 1000, 3)
+            self._stack.pop()
+
+    def note(self, **attrs):
+        """Anota detalhes no span aberto mais interno (ou no próprio rerun, fora de spans)."""
+        target = self._stack[-1]["attrs"] if self._stack else self.attrs
+        target.update(attrs)
+
+    def finish(self):
+        """Fecha o rerun: duração total e RSS do processo."""
+        if self.total_ms is None:
+            self.total_ms = round(self._elapsed_ms(), 3)
+            self.rss_bytes = process_rss_bytes()
+        return self
+
+    def elapsed_ms(self):
+        """Duração até agora (ou total, se já fechado)."""
+        return self.total_ms if self.total_ms is not None else round(self._elapsed_ms(), 3)
+
+    def to_record(self):
+        return {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "total_ms": self.elapsed_ms(),
+            "rss_bytes": self.rss_bytes if self.rss_bytes is not None else process_rss_bytes(),
+            **self.attrs,
+            "spans": self.spans,
+        }
+
+
+def start_trace(**attrs):
+    """Abre o trace do rerun na thread atual (substitui o anterior)."""
+    trace = RerunTrace(**attrs)
+    _local.trace = trace
+    return trace
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+def end_trace():
+    """Fecha e desassocia o trace da thread atual; retorna o trace (ou None)."""
+    trace = current_trace()
+    _local.trace = None
+    return trace.finish() if trace is not None else None
+
+
+def span(name, **attrs):
+    """Span no trace da thread atual; sem trace, não mede nada."""
+    trace = current_trace()
+    if trace is None:
+        return nullcontext()
+    return trace.span(name, **attrs)
+
+
+def note(**attrs):
+    """Anota detalhes no span atual; sem trace, não faz nada."""
+    trace = current_trace()
+    if trace is not None:
+        trace.note(**attrs)
+
+
+class JsonLinesLog:
+    """
+    Log JSON lines com rotação por tamanho (RotatingFileHandler): um objeto por linha.
+    Seguro para várias threads; falhas de gravação não interrompem o app.
+    """
+
+    def __init__(self, path, max_bytes=5 * 1024 * 1024, backup_count=3):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        # Logger próprio, fora da hierarquia do logging (não propaga para o root do Streamlit)
+        self._logger = logging.Logger(f"jsonl:{path}", logging.INFO)
+        self._logger.addHandler(handler)
+        self._handler = handler
+
+    def write(self, record):
+        try:
+            self._logger.info(json.dumps(record, ensure_ascii=False, default=str))
+        except Exception:
+            pass
+
+    def close(self):
+        self._handler.close()
@@ -0,0 +1,351 @@
+"""
+Leitura da planilha Google vinculada ao formulário.
+
+As respostas do Forms só são acrescentadas ao final da aba; por isso a
+sincronização guarda o cabeçalho e as linhas já lidas e, nas atualizações
+seguintes, busca apenas o intervalo novo. Uma leitura completa só acontece na
+primeira vez, quando o cabeçalho muda, quando a verificação de consistência
+falha (última linha conhecida diferente) ou periodicamente, para recolher
+respostas antigas editadas. A conferência periódica só roda quando a leitura
+incremental mostra que a aba mudou; sem mudanças ela fica adiada e nada além
+do cabeçalho e da última linha é baixado.
+
+Antes de ler, uma sonda de alterações (opcional e desligada no app por padrão,
+pois pede o escopo do Drive e uma requisição a mais; ex.: DriveRevisionProbe)
+consulta um identificador barato da versão da planilha; se for o mesmo da
+última leitura, nada é buscado. Se mudou sem linhas novas no fim, uma resposta
+antiga foi editada e a leitura completa é feita na hora.
+
+SheetsClient mantém a sessão autorizada (pool de conexões HTTP), o token e a
+aba já resolvida entre reruns e sessões; o token só é renovado quando expira.
+
+Não depende do Streamlit.
+"""
+import threading
+import time
+
+import gspread
+from google.auth.transport.requests import Request as _AuthRequest
+from gspread.http_client import HTTPClient
+from gspread.urls import DRIVE_FILES_API_V3_URL
+from gspread.utils import rowcol_to_a1
+
+# Endereços padrão das APIs do Google Sheets e do Drive (podem ser trocados por um servidor local em testes)
+SHEETS_API_BASE_URL = "https://sheets.googleapis.com"
+DRIVE_API_BASE_URL = "https://www.googleapis.com"
+SHEETS_SCOPES = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
+# Escopo extra da sonda DriveRevisionProbe (só metadados do arquivo)
+DRIVE_METADATA_SCOPE = "https://www.googleapis.com/auth/drive.metadata.readonly"
+
+# Intervalo padrão entre leituras completas de conferência (segundos)
+DEFAULT_FULL_SYNC_INTERVAL = 3600
+# Falhas seguidas da sonda até ela ser desligada (API do Drive desativada, escopo ausente...)
+DEFAULT_PROBE_MAX_ERRORS = 3
+
+
+class _TimedHTTPClient(HTTPClient):
+    """
+    HTTPClient do gspread que renova o token apenas quando expirado, mede o tempo
+    de autenticação e das requisições e permite apontar para outro endereço da API.
+    """
+
+    def __init__(self, auth, session=None):
+        super().__init__(auth, session)
+        self.base_url = None
+        self.auth_count = 0
+        self.last_auth_seconds = None
+        self.request_count = 0
+        self.last_request_seconds = None
+        self.total_request_seconds = 0.0
+
+    def _ensure_token(self):
+        credentials = getattr(self, "auth", None)
+        if credentials is None or credentials.valid:
+            return
+        started = time.perf_counter()
+        # Transporte sem autorização: pela própria sessão autorizada, o before_request
+        # renovaria o token de novo e mandaria o pedido do token com o Bearer vencido
+        auth_request = getattr(self.session, "_auth_request", None) or _AuthRequest()
+        credentials.refresh(auth_request)
+        self.last_auth_seconds = time.perf_counter() - started
+        self.auth_count += 1
+
+    def request(self, method, endpoint, *args, **kwargs):
+        if self.base_url:
+            for api_base_url in (SHEETS_API_BASE_URL, DRIVE_API_BASE_URL):
+                if endpoint.startswith(api_base_url):
+                    endpoint = self.base_url.rstrip("/") + endpoint[len(api_base_url):]
+                    break
+        self._ensure_token()
+        started = time.perf_counter()
+        try:
+            return super().request(method, endpoint, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.request_count += 1
+            self.last_request_seconds = elapsed
+            self.total_request_seconds += elapsed
+
+
+class SheetsClient:
+    """
+    Cliente da planilha reaproveitado entre reruns e sessões: credenciais já
+    carregadas, sessão autorizada com pool de conexões e handle da primeira aba.
+    base_url permite usar um servidor local que imita a API (testes).
+    """
+
+    def __init__(self, credentials, spreadsheet_id, base_url=None, timeout=30):
+        self.spreadsheet_id = spreadsheet_id
+        self._credentials = credentials
+        self._base_url = base_url
+        self._timeout = timeout
+        self._client = None
+        self._worksheet = None
+        self._lock = threading.Lock()
+        self.connect_count = 0
+        self.last_connect_seconds = None
+
+    def _http(self):
+        if self._client is None:
+            self._client = gspread.authorize(self._credentials, http_client=_TimedHTTPClient)
+            self._client.http_client.base_url = self._base_url
+            self._client.http_client.set_timeout(self._timeout)
+        return self._client
+
+    def worksheet(self):
+        """Primeira aba da planilha; a conexão (open_by_key) é feita só na primeira vez."""
+        with self._lock:
+            if self._worksheet is None:
+                started = time.perf_counter()
+                spreadsheet = self._http().open_by_key(self.spreadsheet_id)
+                self._worksheet = spreadsheet.sheet1
+                self.last_connect_seconds = time.perf_counter() - started
+                self.connect_count += 1
+            return self._worksheet
+
+    def reset(self):
+        """Descarta a aba resolvida (após erro); a sessão autorizada é mantida."""
+        with self._lock:
+            self._worksheet = None
+
+    def stats(self):
+        """Tempos de conexão, autenticação e requisições."""
+        http = self._client.http_client if self._client is not None else None
+        return {
+            "connect_count": self.connect_count,
+            "last_connect_seconds": self.last_connect_seconds,
+            "auth_count": http.auth_count if http else 0,
+            "last_auth_seconds": http.last_auth_seconds if http else None,
+            "request_count": http.request_count if http else 0,
+            "last_request_seconds": http.last_request_seconds if http else None,
+            "total_request_seconds": http.total_request_seconds if http else 0.0,
+        }
+
+
+def _column_letter(n_cols):
+    """Letra da última coluna em notação A1 (ex.: 192 -> 'GJ')."""
+    return rowcol_to_a1(1, max(1, n_cols)).rstrip("0123456789")
+
+
+def _pad_row(row, width):
+    """Completa (ou corta) a linha para a largura do cabeçalho; a API omite células vazias no fim."""
+    row = list(row)
+    if len(row) < width:
+        row.extend([""] * (width - len(row)))
+    return row[:width]
+
+
+class DriveRevisionProbe:
+    """
+    Sonda de alterações pela versão do arquivo no Drive (files.get, campo version):
+    uma resposta de poucos bytes, que muda a cada edição em qualquer célula da planilha.
+    Requer o escopo DRIVE_METADATA_SCOPE e a API do Drive ativada no projeto.
+
+    Qualquer objeto com token(worksheet) serve de sonda para IncrementalSheetSync:
+    token() devolve um valor comparável que só se repete se a planilha não mudou
+    (ou None quando não dá para saber).
+    """
+
+    def token(self, worksheet):
+        response = worksheet.client.request(
+            "get",
+            f"{DRIVE_FILES_API_V3_URL}/{worksheet.spreadsheet_id}",
+            params={"fields": "version", "supportsAllDrives": True},
+        )
+        return response.json().get("version")
+
+
+class IncrementalSheetSync:
+    """
+    Estado da sincronização incremental de uma aba: cabeçalho, linhas já lidas e
+    contadores. Uma instância por planilha, compartilhada entre sessões.
+    probe (opcional): sonda de alterações consultada antes de cada leitura (ver DriveRevisionProbe).
+    Após probe_max_errors falhas seguidas a sonda é desligada e as leituras seguem sem ela.
+    """
+
+    def __init__(self, full_sync_interval=DEFAULT_FULL_SYNC_INTERVAL, probe=None,
+                 probe_max_errors=DEFAULT_PROBE_MAX_ERRORS):
+        self.full_sync_interval = full_sync_interval
+        self.probe = probe
+        self.probe_max_errors = probe_max_errors
+        self._probe_token = None
+        self._probe_consecutive_errors = 0
+        self.probe_disabled = False
+        self.header = None
+        self.rows = []
+        self.version = 0
+        # Última versão vinda de uma leitura completa com mudanças (as seguintes só acrescentaram linhas)
+        self.rebuild_version = 0
+        self.last_full_sync = 0.0
+        self.last_sync = 0.0
+        self.full_syncs = 0
+        self.incremental_syncs = 0
+        self.rows_fetched = 0
+        self.last_mode = None
+        self.last_new_rows = 0
+        self.probe_skips = 0
+        self.full_syncs_deferred = 0
+        self.probe_errors = 0
+        self.last_probe_error = None
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """(cabeçalho, linhas, versão) atuais. As linhas não devem ser alteradas pelo chamador."""
+        with self._lock:
+            return self.header, self.rows, self.version
+
+    def _full_sync(self, worksheet):
+        values = worksheet.get_all_values()
+        self.last_mode = "full"
+        self.full_syncs += 1
+        self.last_full_sync = time.time()
+        self.rows_fetched += len(values)
+        if not values:
+            changed = self.header is not None or bool(self.rows)
+            self.header, self.rows = None, []
+        else:
+            header, rows = list(values[0]), [list(r) for r in values[1:]]
+            changed = header != self.header or rows != self.rows
+            self.header, self.rows = header, rows
+        self.last_new_rows = len(self.rows)
+        return changed
+
+    def _incremental_sync(self, worksheet):
+        """
+        Uma única chamada (batch_get) traz o cabeçalho, a última linha conhecida
+        (verificação de consistência) e as linhas novas. Retorna None se for
+        preciso refazer a leitura completa.
+        """
+        width = len(self.header)
+        last_col = _column_letter(width)
+        known = len(self.rows)
+        # Linha 1 = cabeçalho; linha known+1 = última linha de dados já conhecida
+        first_row = known + 1 if known else 2
+        header_range, tail_range = worksheet.batch_get(["1:1", f"A{first_row}:{last_col}"])
+        header = header_range[0] if header_range else []
+        # Coluna nova (mais larga que o cabeçalho conhecido) ou nome alterado
+        if len(header) > width or _pad_row(header, width) != self.header:
+            return None
+        tail = [_pad_row(r, width) for r in tail_range]
+        if known:
+            if not tail or tail[0] != self.rows[-1]:
+                return None
+            tail = tail[1:]
+        self.last_mode = "incremental"
+        self.incremental_syncs += 1
+        self.rows_fetched += len(tail) + 2
+        self.last_new_rows = len(tail)
+        if tail:
+            # Nova lista: quem recebeu um snapshot anterior não vê a alteração
+            self.rows = self.rows + tail
+            return True
+        return False
+
+    def _probe(self, worksheet):
+        """
+        Token da sonda; uma falha da sonda não impede a leitura (retorna None).
+        Falhas seguidas demais desligam a sonda: cada tentativa custaria uma requisição a mais.
+        """
+        if self.probe is None or self.probe_disabled:
+            return None
+        try:
+            token = self.probe.token(worksheet)
+        except Exception as e:
+            self.probe_errors += 1
+            self.last_probe_error = e
+            self._probe_consecutive_errors += 1
+            if self._probe_consecutive_errors >= self.probe_max_errors:
+                self.probe_disabled = True
+            return None
+        self._probe_consecutive_errors = 0
+        return token
+
+    def sync(self, worksheet):
+        """
+        Atualiza o estado a partir da aba (gspread Worksheet). Retorna True se os
+        dados mudaram desde a última sincronização.
+        """
+        with self._lock:
+            now = time.time()
+            token = self._probe(worksheet)
+            if token is not None and token == self._probe_token and self.header is not None:
+                # Mesma versão da última leitura: nada a buscar, nem a conferência completa
+                self.last_mode = "probe"
+                self.probe_skips += 1
+                self.last_new_rows = 0
+                self.last_sync = now
+                return False
+            due = now - self.last_full_sync >= self.full_sync_interval
+            changed = None
+            appended = False
+            if self.header:
+                changed = self._incremental_sync(worksheet)
+                if changed is False and token is not None:
+                    # A sonda viu uma alteração que não está no fim da aba: resposta antiga editada
+                    changed = None
+                elif changed is False and due:
+                    # Conferência vencida, mas nada novo no fim da aba: adiada até a próxima mudança
+                    self.full_syncs_deferred += 1
+                elif changed and due:
+                    # Já acrescentadas; a leitura completa ainda recolhe edições antigas
+                    appended, changed = True, None
+            rebuilt = False
+            if changed is None:
+                rebuilt = self._full_sync(worksheet)
+                changed = rebuilt or appended
+            # Versão vista antes da leitura: se a planilha mudou durante a leitura, a próxima sonda difere
+            self._probe_token = token
+            self.last_sync = now
+            if changed:
+                self.version += 1
+                if rebuilt:
+                    self.rebuild_version = self.version
+            return changed
+
+    def appended_since(self, version):
+        """
+        True se, da versão dada até a atual, a aba só ganhou linhas no final (cabeçalho e
+        linhas já lidas iguais): quem montou algo a partir daquela versão pode processar só
+        as linhas a partir de len(linhas daquela versão).
+        """
+        with self._lock:
+            return self.rebuild_version <= version <= self.version
+
+    def stats(self):
+        """Contadores da sincronização (para exibição/diagnóstico)."""
+        with self._lock:
+            return {
+                "rows": len(self.rows),
+                "version": self.version,
+                "full_syncs": self.full_syncs,
+                "incremental_syncs": self.incremental_syncs,
+                "rows_fetched": self.rows_fetched,
+                "last_mode": self.last_mode,
+                "last_new_rows": self.last_new_rows,
+                "last_sync": self.last_sync,
+                "probe_skips": self.probe_skips,
+                "full_syncs_deferred": self.full_syncs_deferred,
+                "probe_errors": self.probe_errors,
+                "probe_disabled": self.probe_disabled,
+                "last_probe_error": str(self.last_probe_error) if self.last_probe_error is not None else None,
+            }
@@ -0,0 +1,1467 @@
+"""
+Núcleo do relatório de vistoria, sem dependência do Streamlit.
+
+Mapeamento de colunas, leitura e normalização dos dados, esquema do formulário,
+detecção de não conformidades, formatação de valores e geração do PDF. Usado pelo
+app, pelos processos da exportação em lote e pela linha de comando
+(gerar_relatorios.py), que não podem importar o app.py.
+"""
+import hashlib
+import io
+import re
+import unicodedata
+import weakref
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import Image, PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from fotos_vistoria import drive_file_ids
+
+
+def normalize_column_name(name):
+    """Forma canônica do nome da coluna: sem acentos, minúsculas e espaços colapsados."""
+    text = unicodedata.normalize('NFKD', str(name))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.casefold().split())
+
+
+class ColumnMapping(dict):
+    """
+    Mapeamento coluna_original -> {'nome_tratado', 'area'} com índice normalizado
+    (ignora acentos, maiúsculas e espaços) para consultas O(1), memo dos nomes não
+    resolvidos e a lista de todas as colunas conhecidas na planilha de formatação
+    (inclusive IDENTIFICAÇÃO/GERAL, que não entram no mapeamento).
+    """
+
+    def __init__(self, mapping=None, known_columns=None):
+        super().__init__(mapping or {})
+        self._index = {}
+        for orig in self:
+            self._index.setdefault(normalize_column_name(orig), orig)
+        self._known = {normalize_column_name(col) for col in (known_columns or [])} | set(self._index)
+        self._unresolved = set()
+        self._items_key = tuple((orig, info['nome_tratado'], info['area']) for orig, info in self.items())
+
+    def lookup(self, col_name):
+        """Informações da coluna (match exato ou normalizado) ou None."""
+        info = self.get(col_name)
+        if info is not None:
+            return info
+        if col_name in self._unresolved:
+            return None
+        orig = self._index.get(normalize_column_name(col_name))
+        if orig is None:
+            self._unresolved.add(col_name)
+            return None
+        return self[orig]
+
+    def items_key(self):
+        """Tupla (original, nome_tratado, area) usada como chave de cache."""
+        return self._items_key
+
+    def unmapped_columns(self, columns):
+        """Colunas do formulário que não aparecem em formatacao_colunas.xlsx."""
+        return [col for col in columns if normalize_column_name(col) not in self._known]
+
+
+def read_column_mapping(path='formatacao_colunas.xlsx'):
+    """
+    Lê o mapeamento de colunas originais para tratadas e áreas (formatacao_colunas.xlsx).
+    Erros de leitura são repassados ao chamador (o app mostra um aviso; a linha de comando aborta).
+    """
+    df_map = pd.read_excel(path, engine='openpyxl')
+    
+    # Criar dicionário de mapeamento: coluna_original -> (coluna_tratada, area)
+    mapping = {}
+    known_columns = []
+    for idx, row in df_map.iterrows():
+        col_original = str(row.iloc[0]).strip()
+        col_tratada = str(row.iloc[1]).strip()
+        area = str(row.iloc[2]).strip()
+        if col_original != 'nan':
+            known_columns.append(col_original)
+        
+        # Ignorar se área for NaN ou vazia, ou se for IDENTIFICAÇÃO/GERAL
+        if pd.notna(row.iloc[2]) and area not in ['nan', 'IDENTIFICAÇÃO', 'GERAL', '']:
+            mapping[col_original] = {
+                'nome_tratado': col_tratada if col_tratada != 'nan' else col_original,
+                'area': area
+            }
+    
+    return ColumnMapping(mapping, known_columns)
+
+
+# ---------- Dados das vistorias ----------
+
+def normalize_vistoria_df(df):
+    """
+    Normaliza o DataFrame: coluna carimbo como datetime, ordenação estável por data (mais
+    recente primeiro) e tipos compactos (compact_vistoria_df). A memória antes e depois da
+    compactação fica em df.attrs["memory_bytes"].
+    """
+    if df is None or df.empty:
+        return df
+    df = df.copy()
+    for col in df.columns:
+        if "carimbo" in str(col).lower() and "data" in str(col).lower():
+            df[col] = _parse_carimbo(df[col])
+            # mergesort é estável: empates mantêm a ordem da planilha (paginação previsível)
+            df = df.sort_values(col, ascending=False, kind="mergesort").reset_index(drop=True)
+            break
+    before = int(df.memory_usage(deep=True).sum())
+    df = compact_vistoria_df(df)
+    df.attrs["memory_bytes"] = {"before": before, "after": int(df.memory_usage(deep=True).sum())}
+    # Calcular a versão dos dados uma única vez, junto com a carga
+    dataset_fingerprint(df)
+    return df
+
+
+# Carimbo de data/hora do Google Forms em pt-BR
+_CARIMBO_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+
+def _parse_carimbo(series):
+    """
+    Carimbo como datetime, no formato do Forms (DD/MM/AAAA HH:MM:SS). Só as linhas fora
+    desse formato (datas do xlsx, edições à mão em ISO 8601) são lidas como ISO; o resto
+    vira NaT. O formato não é inferido da primeira linha: datas misturadas não se perdem.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return series
+    text = series.astype("string").str.strip()
+    stamps = pd.to_datetime(text, format=_CARIMBO_FORMAT, errors="coerce")
+    retry = stamps.isna() & text.fillna("").ne("")
+    if retry.any():
+        stamps[retry] = pd.to_datetime(text[retry], format="ISO8601", errors="coerce")
+    return stamps
+
+
+# Colunas de texto com até esta fração de valores distintos viram categóricas
+_CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+
+def _is_text_series(series):
+    if not (series.dtype == object or pd.api.types.is_string_dtype(series.dtype)):
+        return False
+    return pd.api.types.infer_dtype(series, skipna=True) in ("string", "empty")
+
+
+def _blank_to_na(series):
+    """
+    Textos vazios (como o Google Sheets devolve as células em branco) viram NA. Em colunas
+    categóricas (compact_vistoria_df), as categorias em branco são removidas.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        blank = [c for c in series.cat.categories if isinstance(c, str) and not c.strip()]
+        return series.cat.remove_categories(blank) if blank else series
+    if _is_text_series(series):
+        return series.where(series.astype(str).str.strip() != "")
+    return series
+
+
+def _to_nullable_int(series):
+    """Int64 (com NA) se todos os valores preenchidos forem inteiros; senão None."""
+    values = _blank_to_na(series)
+    filled = values.notna()
+    numbers = pd.to_numeric(values, errors="coerce")
+    if numbers[filled].isna().any() or not (numbers[filled] == numbers[filled].round()).all():
+        return None
+    if filled.any() and numbers[filled].abs().max() >= 2 ** 53:
+        return None
+    return numbers.astype("Int64")
+
+
+def _to_date(series, date_format="%d/%m/%Y"):
+    """datetime64 se todos os textos preenchidos forem datas DD/MM/AAAA; senão None."""
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return None
+    if not _is_text_series(series):
+        return None
+    values = _blank_to_na(series)
+    dates = pd.to_datetime(values.str.strip(), format=date_format, errors="coerce")
+    if dates[values.notna()].isna().any():
+        return None
+    return dates
+
+
+def compact_vistoria_df(df):
+    """
+    Troca os tipos genéricos (textos em object, como o get_all_values() devolve) por tipos
+    compactos, sem mudar os valores exibidos:
+    - colunas de texto com poucos valores distintos (respostas, cidade, vistoriador,
+      prefixo...) viram categóricas;
+    - quilometragem vira inteiro com NA (Int64) se todos os valores forem inteiros;
+    - data da vistoria (DD/MM/AAAA) vira datetime.
+    Colunas com tipos misturados (ex.: texto e números vindos do xlsx) ficam como estão.
+    """
+    if df is None or df.empty:
+        return df
+    df = df.copy()
+    max_unique = max(1, int(len(df) * _CATEGORY_MAX_UNIQUE_RATIO))
+    for i, col in enumerate(df.columns):
+        series = df.iloc[:, i]
+        col_lower = str(col).lower()
+        converted = None
+        if 'quilometragem' in col_lower:
+            converted = _to_nullable_int(series)
+        elif 'data da vistoria' in col_lower:
+            converted = _to_date(series)
+        if converted is None and _is_text_series(series) and series.nunique(dropna=False) <= max_unique:
+            converted = series.astype("category")
+        if converted is not None:
+            df.isetitem(i, converted)
+    return df
+
+
+def _carimbo_column(columns):
+    return next((col for col in columns if "carimbo" in str(col).lower() and "data" in str(col).lower()), None)
+
+
+def _append_column(old, new, col, carimbo):
+    """
+    Coluna com as linhas novas (texto cru) no tipo compacto já escolhido: antes das antigas
+    se há carimbo (mais recentes primeiro), senão depois (ordem da planilha). None se não couber.
+    """
+    if isinstance(old.dtype, pd.CategoricalDtype):
+        if not _is_text_series(new):
+            return None
+        # Códigos das linhas novas nas categorias existentes (as antigas não são recodificadas)
+        categories = old.cat.categories
+        codes = categories.get_indexer(new)
+        unknown = (codes < 0) & new.notna().to_numpy()
+        if unknown.any():
+            categories = categories.append(pd.Index(new[unknown].unique(), dtype=categories.dtype))
+            codes = categories.get_indexer(new)
+        parts = (codes, old.cat.codes.to_numpy())
+        codes = np.concatenate(parts if carimbo is not None else parts[::-1])
+        return pd.Series(pd.Categorical.from_codes(codes, categories=categories))
+    if col == carimbo:
+        converted = new
+    elif isinstance(old.dtype, pd.Int64Dtype):
+        converted = _to_nullable_int(new)
+    elif pd.api.types.is_datetime64_any_dtype(old.dtype):
+        converted = _to_date(new)
+    elif _is_text_series(old) and _is_text_series(new):
+        converted = new
+    else:
+        converted = None
+    if converted is None:
+        return None
+    return pd.concat([converted, old] if carimbo is not None else [old, converted], ignore_index=True)
+
+
+def append_vistorias(df, new_rows):
+    """
+    Acrescenta respostas novas a um DataFrame já normalizado (normalize_vistoria_df),
+    normalizando só as linhas novas. new_rows: DataFrame cru (texto, como o
+    get_all_values() devolve) com as mesmas colunas.
+    Retorna None quando o resultado não seria equivalente a normalizar tudo de novo:
+    colunas diferentes, linhas novas sem carimbo ou não mais recentes que as existentes
+    (a ordenação mudaria) ou valores que não cabem nos tipos compactos já escolhidos.
+    A versão dos dados (dataset_fingerprint) é encadeada à do DataFrame anterior, sem
+    recalcular o hash das linhas antigas.
+    """
+    if df is None or df.empty or new_rows is None or list(new_rows.columns) != list(df.columns):
+        return None
+    if new_rows.empty:
+        return df
+    tail = new_rows.reset_index(drop=True)
+    carimbo = _carimbo_column(df.columns)
+    if carimbo is not None:
+        stamps = _parse_carimbo(tail[carimbo])
+        newest_known = df[carimbo].max()
+        if stamps.isna().any() or (pd.notna(newest_known) and stamps.min() <= newest_known):
+            return None
+        tail[carimbo] = stamps
+        tail = tail.sort_values(carimbo, ascending=False, kind="mergesort").reset_index(drop=True)
+    columns = []
+    for i, col in enumerate(df.columns):
+        combined = _append_column(df.iloc[:, i], tail.iloc[:, i], col, carimbo)
+        if combined is None:
+            return None
+        columns.append(combined)
+    result = pd.concat(columns, axis=1, ignore_index=True)
+    result.columns = df.columns
+    memory = df.attrs.get("memory_bytes", {})
+    result.attrs["memory_bytes"] = {
+        "before": memory.get("before", 0) + int(new_rows.memory_usage(deep=True).sum()),
+        "after": int(result.memory_usage(deep=True).sum()),
+    }
+    h = hashlib.sha256(dataset_fingerprint(df).encode("utf-8"))
+    appended = result.iloc[:len(tail)] if carimbo is not None else result.iloc[len(df):]
+    h.update(pd.util.hash_pandas_object(appended, index=False).to_numpy().tobytes())
+    set_dataset_fingerprint(result, h.hexdigest()[:16])
+    return result
+
+
+# Versão já calculada de cada DataFrame vivo: id(df) -> (weakref do df, versão).
+# Pela identidade do objeto (não por df.attrs, que cópias e recortes herdam): uma
+# cópia editada nunca reaproveita a versão do original.
+_fingerprints = {}
+
+
+def _forget_fingerprint(key, ref):
+    if _fingerprints.get(key, (None,))[0] is ref:
+        _fingerprints.pop(key, None)
+
+
+def set_dataset_fingerprint(df, fingerprint):
+    """
+    Registra a versão já conhecida dos dados deste DataFrame (p. ex. a gravada no snapshot).
+    Vale só para este objeto, que não deve ser alterado depois (os dados carregados são
+    compartilhados entre sessões e tratados como imutáveis).
+    """
+    key = id(df)
+    ref = weakref.ref(df, lambda ref, key=key: _forget_fingerprint(key, ref))
+    _fingerprints[key] = (ref, fingerprint)
+    return fingerprint
+
+
+def dataset_fingerprint(df):
+    """
+    Identificador da versão dos dados (hash do conteúdo). Calculado uma vez por objeto
+    (normalmente na carga) e lembrado enquanto ele existir; cópias e DataFrames derivados
+    calculam o seu.
+    """
+    if df is None:
+        return "vazio"
+    cached = _fingerprints.get(id(df))
+    if cached is not None and cached[0]() is df:
+        return cached[1]
+    h = hashlib.sha256()
+    h.update("\x1f".join(map(str, df.columns)).encode("utf-8"))
+    if not df.empty:
+        h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return set_dataset_fingerprint(df, h.hexdigest()[:16])
+
+
+def read_vistorias_xlsx(path='base_de_dados.xlsx'):
+    """Lê e normaliza a base de vistorias de um arquivo xlsx (erros de leitura são repassados)."""
+    try:
+        df = pd.read_excel(path, engine="openpyxl")
+    except Exception:
+        df = pd.read_excel(path)
+    return normalize_vistoria_df(df)
+
+
+class VistoriaIndex:
+    """
+    Índices para filtrar as vistorias sem percorrer a base a cada consulta, montados uma
+    vez por versão dos dados:
+    - carimbos ordenados (e suas posições) para consultas por período com busca binária;
+    - valor -> posições (iloc) para prefixo, cidade e vistoriador.
+    """
+
+    ROLES = ('prefixo', 'cidade', 'vistoriador')
+
+    def __init__(self, df, schema):
+        self.size = len(df)
+        self.has_dates = schema.carimbo is not None
+        if self.has_dates:
+            stamps = pd.to_datetime(df[schema.carimbo], errors='coerce').to_numpy(dtype='datetime64[ns]')
+            valid = ~np.isnat(stamps)
+            positions = np.flatnonzero(valid)
+            order = np.argsort(stamps[valid], kind='stable')
+            self._stamps = stamps[valid][order]
+            self._stamp_positions = positions[order]
+        else:
+            self._stamps = np.array([], dtype='datetime64[ns]')
+            self._stamp_positions = np.array([], dtype=np.intp)
+        self._values = {}
+        for role in self.ROLES:
+            col = getattr(schema, role)
+            if col is None:
+                continue
+            series = df[col].reset_index(drop=True)
+            # Textos vazios (células em branco do Google) não são opções de filtro
+            series = _blank_to_na(series)
+            self._values[role] = series.groupby(series, observed=True, sort=False).indices
+
+    def date_bounds(self):
+        """(primeira, última) data dos carimbos, ou (None, None)."""
+        if not len(self._stamps):
+            return None, None
+        return pd.Timestamp(self._stamps[0]).date(), pd.Timestamp(self._stamps[-1]).date()
+
+    def options(self, role):
+        """Valores distintos do campo, em ordem alfabética (para listas de seleção)."""
+        return sorted(self._values.get(role, {}), key=lambda value: normalize_column_name(str(value)))
+
+    def between(self, start=None, end=None):
+        """Posições com carimbo entre as datas start e end (inclusive)."""
+        lo = 0 if start is None else np.searchsorted(self._stamps, np.datetime64(pd.Timestamp(start), 'ns'), 'left')
+        if end is None:
+            hi = len(self._stamps)
+        else:
+            next_day = pd.Timestamp(end).normalize() + pd.Timedelta(days=1)
+            hi = np.searchsorted(self._stamps, np.datetime64(next_day, 'ns'), 'left')
+        return self._stamp_positions[lo:hi]
+
+    def matching(self, role, predicate):
+        """Valores do campo para os quais predicate(valor) é verdadeiro."""
+        return [value for value in self._values.get(role, {}) if predicate(value)]
+
+    def positions(self, role, values):
+        """Posições com algum dos valores informados no campo."""
+        index = self._values.get(role, {})
+        arrays = [index[value] for value in values if value in index]
+        if not arrays:
+            return np.array([], dtype=np.intp)
+        return np.concatenate(arrays)
+
+    def query(self, start=None, end=None, **criteria):
+        """
+        Posições (ordenadas) que atendem a todos os critérios. criteria: papel -> valores
+        aceitos (ex.: cidade=['Vitória (ES)']); critérios None não filtram. Um período sem
+        carimbo ou um papel ausente na base não encontra nada.
+        """
+        selected = []
+        if start is not None or end is not None:
+            if not self.has_dates:
+                return np.array([], dtype=np.intp)
+            selected.append(self.between(start, end))
+        for role, values in criteria.items():
+            if values is None:
+                continue
+            if role not in self._values:
+                return np.array([], dtype=np.intp)
+            selected.append(self.positions(role, values))
+        if not selected:
+            return np.arange(self.size)
+        # Interseção começando pelo menor conjunto
+        selected.sort(key=len)
+        result = np.unique(selected[0])
+        for positions in selected[1:]:
+            result = np.intersect1d(result, positions, assume_unique=False)
+        return result
+
+
+def select_positions(df, schema, start=None, end=None, prefixos=None, cidades=None):
+    """
+    Posições (iloc) das vistorias com carimbo entre start e end (datas, inclusive), do
+    prefixo informado (igual) e da cidade informada (trecho do nome). A comparação
+    ignora acentos e maiúsculas. Critérios vazios não filtram.
+    """
+    index = VistoriaIndex(df, schema)
+    criteria = {}
+    if prefixos:
+        wanted = {normalize_column_name(p) for p in prefixos}
+        criteria['prefixo'] = index.matching('prefixo', lambda value: normalize_column_name(str(value)) in wanted)
+    if cidades:
+        wanted = [normalize_column_name(c) for c in cidades]
+        criteria['cidade'] = index.matching(
+            'cidade', lambda value: any(w in normalize_column_name(str(value)) for w in wanted)
+        )
+    return index.query(start, end, **criteria).tolist()
+
+
+# Função para obter informações da coluna do mapeamento
+def get_column_info(col_name, column_mapping):
+    """Retorna nome tratado e área da coluna baseado no mapeamento"""
+    if not column_mapping:
+        return None, None
+    
+    # Índice normalizado (O(1)) quando o mapeamento vem de load_column_mapping()
+    if isinstance(column_mapping, ColumnMapping):
+        info = column_mapping.lookup(col_name)
+        if info is None:
+            return None, None
+        return info['nome_tratado'], info['area']
+    
+    # Tentar match exato primeiro
+    if col_name in column_mapping:
+        return column_mapping[col_name]['nome_tratado'], column_mapping[col_name]['area']
+    
+    # Tentar match case-insensitive
+    col_name_lower = col_name.lower().strip()
+    for orig_col, info in column_mapping.items():
+        if orig_col.lower().strip() == col_name_lower:
+            return info['nome_tratado'], info['area']
+    
+    return None, None
+
+# Função para identificar área da coluna (fallback)
+def get_area_from_column(col_name):
+    col_upper = col_name.upper()
+    col_lower = col_name.lower()
+    
+    # Verificar por ordem de especificidade (mais específico primeiro)
+    
+    # Geladeiras
+    if 'GELADEIRA' in col_upper:
+        return 'Geladeiras'
+    
+    # Sanitário
+    if 'SANITÁRIO' in col_upper or 'SANITARIO' in col_upper:
+        return 'Sanitário'
+    
+    # Salão - verificar padrões específicos
+    if 'SALÃO' in col_upper or 'SALAO' in col_upper:
+        return 'Salão'
+    # Poltronas geralmente são do salão
+    if 'POLTRONAS' in col_upper or col_upper.startswith('POLTRONAS'):
+        return 'Salão'
+    # Verificar se contém [POLTRONAS]
+    if '[POLTRONAS]' in col_upper:
+        return 'Salão'
+    
+    # Cabine - verificar padrões específicos
+    if col_upper.startswith('CABINE') or '[CABINE' in col_upper:
+        return 'Cabine'
+    if 'CABINE' in col_upper and ('MOTORISTA' in col_upper or 'DO MOTORISTA' in col_upper):
+        return 'Cabine'
+    
+    # Externa - verificar padrões específicos
+    if 'AVALIAÇÃO EXTERNA' in col_upper or 'AVALIACAO EXTERNA' in col_upper:
+        return 'Externa'
+    if 'EXTERNA' in col_upper or 'EXTERNO' in col_upper:
+        return 'Externa'
+    
+    # Verificar por palavras-chave comuns de área externa
+    if any(x in col_lower for x in ['avaria', 'higienização', 'estado', 'pintura', 
+                                     'adesivo', 'extintor', 'bagageiro', 
+                                     'placa', 'pneu', 'retrovisor', 'vidro', 'carroceria',
+                                     'porta de entrada']):
+        # Verificar se não é de outra área
+        if 'CABINE' not in col_upper and 'SANITÁRIO' not in col_upper and 'SANITARIO' not in col_upper:
+            if 'POLTRONAS' not in col_upper and 'SALÃO' not in col_upper and 'SALAO' not in col_upper:
+                if 'GELADEIRA' not in col_upper:
+                    return 'Externa'
+    
+    return None
+
+# Função para verificar se há não conformidade
+def has_non_conformity(value):
+    if pd.isna(value):
+        return False
+    value_str = str(value).upper().strip()
+    # Verifica se é "NÃO CONFORME" ou se tem algum valor preenchido (indicando não conformidade)
+    if 'NÃO CONFORME' in value_str or 'NAO CONFORME' in value_str:
+        return True
+    # Se não for NaN e tiver algum conteúdo, considera não conformidade
+    if value_str and value_str not in ['NAN', 'NONE', '']:
+        return True
+    return False
+
+def non_conformity_matrix(df, columns=None):
+    """
+    Versão vetorizada de has_non_conformity() para o DataFrame inteiro.
+    Retorna DataFrame booleano (mesmo índice de df) com uma coluna por coluna avaliada.
+    """
+    columns = list(df.columns) if columns is None else list(columns)
+    result = {}
+    for col in columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Avaliar cada categoria uma única vez e expandir pelos códigos (-1 = vazio)
+            categories = pd.Series(series.cat.categories.astype(object))
+            hits = non_conformity_matrix(categories.to_frame('valor'))['valor'].to_numpy()
+            codes = series.cat.codes.to_numpy()
+            result[col] = (codes >= 0) & hits.take(codes, mode='clip') if len(hits) else codes >= 0
+            continue
+        mask = series.notna().to_numpy(copy=True)
+        # Números, datas e booleanos preenchidos sempre contam; textos só se não forem vazios/"nan"/"none"
+        if not (pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series)):
+            text = series[mask].astype(str).str.strip().str.upper()
+            mask[mask] = ~text.isin(['NAN', 'NONE', '']).to_numpy()
+        result[col] = mask
+    return pd.DataFrame(result, index=df.index, columns=columns)
+
+
+# Função para formatar o nome do item
+def format_item_name(col_name):
+    # Remove prefixos comuns
+    name = col_name
+    prefixes = ['Campo para observações pontuais sobre', 'Campo para fotografias pontuais sobre']
+    for prefix in prefixes:
+        if name.startswith(prefix):
+            return name.replace(prefix, '').strip()
+    return name
+
+# ---------- Esquema das colunas (resolvido uma vez por conjunto de colunas) ----------
+
+# Ordem das áreas conforme a planilha de formatação
+AREAS_ORDER = ['EXTERNA', 'CABINE', 'SALÃO', 'SANITÁRIO', 'GELADEIRA']
+
+# Nomes das áreas para exibição
+AREA_DISPLAY_NAMES = {
+    'EXTERNA': 'EXTERNA',
+    'CABINE': 'CABINE',
+    'SALÃO': 'SALÃO',
+    'SANITÁRIO': 'SANITÁRIO',
+    'GELADEIRA': 'GELADEIRAS'
+}
+
+# Conversão dos nomes de área da função antiga (get_area_from_column) para o formato novo
+_LEGACY_AREA_MAP = {
+    'Externa': 'EXTERNA',
+    'Cabine': 'CABINE',
+    'Salão': 'SALÃO',
+    'Sanitário': 'SANITÁRIO',
+    'Geladeiras': 'GELADEIRA'
+}
+
+# Colunas de metadados (não entram como itens do relatório)
+_METADATA_KEYWORDS = ['carimbo', 'endereço', 'e-mail', 'email', 'prefixo',
+                      'data da vistoria', 'cidade', 'vistoriador', 'wi-fi', 'wifi',
+                      'quilometragem']
+
+
+class VistoriaSchema:
+    """
+    Papéis das colunas do formulário (prefixo, cidade, vistoriador, carimbo, etc.),
+    colunas excluídas (metadados, fotos, observações gerais) e área de cada item.
+    Use get_vistoria_schema() para obter a instância em cache.
+    """
+
+    def __init__(self, columns, column_mapping=None):
+        column_mapping = column_mapping or {}
+        self.columns = tuple(columns)
+        self.prefixo = None
+        self.cidade = None
+        self.vistoriador = None
+        self.data_vistoria = None
+        self.carimbo = None
+        self.quilometragem = None
+        self.wifi = None
+        self.obs_geral = None
+        self.obs_geral_name = 'Observações Gerais'
+        self.photo_columns = []
+        # (coluna de foto, área ou None, nome) na ordem das colunas
+        self.photo_items = []
+        # (coluna original, área, nome do item) na ordem das colunas
+        self.item_columns = []
+
+        for col in self.columns:
+            col_lower = str(col).lower()
+            # Buscar especificamente por "ônibus (prefixo)" primeiro
+            if 'ônibus' in col_lower and 'prefixo' in col_lower:
+                self.prefixo = col
+            elif 'prefixo' in col_lower:
+                self.prefixo = col
+            elif 'cidade' in col_lower:
+                self.cidade = col
+            elif 'vistoriador' in col_lower:
+                self.vistoriador = col
+            elif 'data da vistoria' in col_lower:
+                self.data_vistoria = col
+            elif 'carimbo' in col_lower and 'data' in col_lower:
+                self.carimbo = col
+            elif 'quilometragem' in col_lower:
+                self.quilometragem = col
+            elif 'wi-fi' in col_lower or 'wifi' in col_lower:
+                self.wifi = col
+
+            # Observações gerais (primeira coluna encontrada; exibida na seção GERAL ao final)
+            is_obs_geral = 'observações gerais' in col_lower or 'observacoes gerais' in col_lower
+            if is_obs_geral and self.obs_geral is None:
+                self.obs_geral = col
+                nome_tratado, _ = get_column_info(col, column_mapping)
+                if nome_tratado:
+                    self.obs_geral_name = nome_tratado
+
+            # Ignorar colunas de metadados
+            if any(x in col_lower for x in _METADATA_KEYWORDS):
+                continue
+            # Colunas de fotos
+            if 'fotografia' in col_lower or 'fotografias' in col_lower:
+                self.photo_columns.append(col)
+                nome_tratado, area = get_column_info(col, column_mapping)
+                self.photo_items.append((col, area if area in AREAS_ORDER else None, nome_tratado or str(col).strip()))
+                continue
+            if is_obs_geral:
+                continue
+
+            # Usar mapeamento se disponível
+            nome_tratado, area = get_column_info(col, column_mapping)
+            if area and area in AREAS_ORDER:
+                # Usar nome tratado se disponível, senão usar nome original formatado
+                self.item_columns.append((col, area, nome_tratado if nome_tratado else format_item_name(col)))
+            elif not column_mapping:
+                # Fallback para função antiga se não houver mapeamento
+                area = _LEGACY_AREA_MAP.get(get_area_from_column(col))
+                if area and area in AREAS_ORDER:
+                    self.item_columns.append((col, area, format_item_name(col)))
+
+    def value(self, row, role, default=None):
+        """Valor da coluna com o papel informado ('prefixo', 'cidade', ...) na linha."""
+        col = getattr(self, role)
+        if col is None:
+            return default
+        return row.get(col, default)
+
+
+@lru_cache(maxsize=8)
+def _build_vistoria_schema(columns, mapping_items):
+    mapping = ColumnMapping({orig: {'nome_tratado': nome, 'area': area} for orig, nome, area in mapping_items})
+    return VistoriaSchema(columns, mapping)
+
+
+def get_vistoria_schema(columns, column_mapping=None):
+    """Esquema das colunas em cache, por conjunto de colunas + mapeamento."""
+    if isinstance(column_mapping, ColumnMapping):
+        mapping_items = column_mapping.items_key()
+    else:
+        mapping_items = tuple(
+            (orig, info['nome_tratado'], info['area']) for orig, info in (column_mapping or {}).items()
+        )
+    return _build_vistoria_schema(tuple(columns), mapping_items)
+
+# ---------- Formatação de valores (padrões compilados uma vez; formatação por coluna) ----------
+
+_MESES = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun',
+          'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
+# Padrão para detectar listas de números: "1, 5, 24", "1;5;24", "1 5 24"
+_NUMBER_LIST_PATTERN = re.compile(r'^[\d\s,;]+$')
+_DIGITS_PATTERN = re.compile(r'\d+')
+# Números como "48.0" (mas não "48.5")
+_INTEGER_FLOAT_PATTERN = re.compile(r'\b\d+\.0\b')
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+
+
+def is_extintor_date_column(column_name):
+    """Coluna de validade/data de extintor (exibida como MMM-AAAA)."""
+    if not column_name:
+        return False
+    col_lower = str(column_name).lower()
+    return 'extintor' in col_lower and ('validade' in col_lower or 'data' in col_lower)
+
+
+def _format_month_year(date_value):
+    """Formato MMM-AAAA usado para extintores"""
+    return f"{_MESES[date_value.month - 1]}-{date_value.year}"
+
+
+def _format_text_value(value_str):
+    """Formata um texto já sem espaços nas pontas: listas de números e números sem '.0'."""
+    # Lista de números separados por vírgula/ponto e vírgula/espaço -> "1, 5, 24"
+    if _NUMBER_LIST_PATTERN.match(value_str):
+        numbers = _DIGITS_PATTERN.findall(value_str)
+        if len(numbers) > 1:
+            return ', '.join(numbers)
+        elif len(numbers) == 1:
+            return numbers[0]
+    # Substituir números como "48.0" por "48" (mas manter "48.5" como está)
+    value_str = _INTEGER_FLOAT_PATTERN.sub(lambda m: str(int(float(m.group()))), value_str)
+    try:
+        num_value = float(value_str)
+    except ValueError:
+        # Se não for número, retornar string já formatada (sem .0)
+        return value_str
+    if num_value.is_integer():
+        return str(int(num_value))
+    return value_str
+
+
+# Função para formatar valores numéricos e datas corretamente
+def format_value(value, column_name=None):
+    """
+    Formata valores removendo decimais desnecessários e formatando datas.
+    - vazio: "NÃO CONFORME";
+    - Timestamp: DD-MM-AAAA (MMM-AAAA em colunas de validade de extintor);
+    - número em coluna de extintor entre 1 e 100000: data serial do Excel em MMM-AAAA;
+    - demais números e textos: sem ".0" desnecessário; listas de números como "1, 5, 24".
+    Textos com datas são mantidos como vieram. Para formatar colunas inteiras use format_series().
+    """
+    if pd.isna(value):
+        return "NÃO CONFORME"
+    
+    is_extintor_date = is_extintor_date_column(column_name)
+    
+    # Timestamp do pandas (pandas já converteu corretamente)
+    if isinstance(value, pd.Timestamp):
+        try:
+            if is_extintor_date:
+                return _format_month_year(value)
+            return value.strftime('%d-%m-%Y')
+        except Exception:
+            pass
+    
+    try:
+        if isinstance(value, (int, float)):
+            # Extintor com número: tentar converter como data serial do Excel
+            if is_extintor_date and 1 <= float(value) <= 100000:
+                try:
+                    return _format_month_year(_EXCEL_EPOCH + timedelta(days=int(float(value)) - 2))
+                except Exception:
+                    pass
+            if isinstance(value, float) and value.is_integer():
+                return str(int(value))
+            return str(value)
+        return _format_text_value(str(value).strip())
+    except Exception:
+        # Se houver qualquer erro, retornar como string
+        return str(value)
+
+
+def classify_column(series, column_name=None):
+    """
+    Classifica a coluna uma única vez para escolher o formatador:
+    'extintor_date', 'date', 'extintor_number', 'number', 'text' ou 'mixed'.
+    """
+    name = column_name if column_name is not None else series.name
+    is_extintor_date = is_extintor_date_column(name)
+    dtype = series.dtype
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'extintor_date' if is_extintor_date else 'date'
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'mixed'
+    if pd.api.types.is_integer_dtype(dtype):
+        # Inteiros do DataFrame chegam como numpy.int64 (não int): nunca viram data serial
+        return 'number'
+    if pd.api.types.is_numeric_dtype(dtype):
+        return 'extintor_number' if is_extintor_date else 'number'
+    if pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty'):
+        return 'text'
+    return 'mixed'
+
+
+def format_series(series, column_name=None):
+    """
+    Versão por coluna de format_value(): classifica a coluna uma vez e aplica o
+    formatador vetorizado correspondente. Retorna Series de str com o mesmo índice.
+    """
+    name = column_name if column_name is not None else series.name
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        if len(series.cat.categories) == 0:
+            # Coluna toda vazia (compact_vistoria_df): nenhuma categoria para expandir
+            return pd.Series("NÃO CONFORME", index=series.index, dtype=object)
+        # Formatar cada categoria uma única vez e expandir pelos códigos
+        categories = format_series(pd.Series(series.cat.categories, dtype=series.cat.categories.dtype), name)
+        result = categories.to_numpy(dtype=object).take(series.cat.codes.to_numpy(), mode='clip')
+        result[series.cat.codes.to_numpy() < 0] = "NÃO CONFORME"
+        return pd.Series(result, index=series.index, dtype=object)
+    
+    kind = classify_column(series, name)
+    na = series.isna().to_numpy()
+    result = pd.Series("NÃO CONFORME", index=series.index, dtype=object)
+    filled = series[~na]
+    if filled.empty:
+        return result
+    
+    if kind == 'date':
+        result[~na] = filled.dt.strftime('%d-%m-%Y').to_numpy(dtype=object)
+    elif kind == 'extintor_date':
+        months = pd.Series(_MESES, dtype=object).to_numpy()[filled.dt.month.to_numpy() - 1]
+        result[~na] = months + '-' + filled.dt.year.astype(str).to_numpy(dtype=object)
+    elif kind == 'number' and pd.api.types.is_integer_dtype(series.dtype):
+        result[~na] = filled.astype(str).to_numpy(dtype=object)
+    elif kind in ('number', 'extintor_number'):
+        values = filled.to_numpy(dtype='float64')
+        # Floats inteiros até 2**53 convertidos em bloco; o restante valor a valor
+        bulk = (values == values.round()) & (abs(values) < 2 ** 53)
+        if kind == 'extintor_number':
+            bulk &= ~((values >= 1) & (values <= 100000))
+        formatted = pd.Series(index=filled.index, dtype=object)
+        formatted[bulk] = values[bulk].astype('int64').astype(str).astype(object)
+        formatted[~bulk] = [format_value(v, name) for v in filled[~bulk].astype(object)]
+        result[~na] = formatted.to_numpy(dtype=object)
+    elif kind == 'text':
+        # Respostas se repetem muito: formatar cada valor distinto uma única vez
+        text = filled.astype(object)
+        formatted = {value: _format_text_value(value.strip()) for value in pd.unique(text)}
+        result[~na] = text.map(formatted).to_numpy(dtype=object)
+    else:
+        result[~na] = [format_value(v, name) for v in filled.astype(object)]
+    return result
+
+
+def format_frame(df, columns=None, mask=None):
+    """
+    Formata várias colunas em bloco. Com mask (DataFrame booleano, p. ex. a matriz de
+    non_conformity_matrix()), só as células marcadas são formatadas; as demais ficam None.
+    """
+    columns = list(df.columns) if columns is None else list(columns)
+    result = {}
+    for col in columns:
+        series = df[col]
+        if mask is None:
+            result[col] = format_series(series, col)
+            continue
+        formatted = np.full(len(series), None, dtype=object)
+        selected = mask[col].to_numpy(dtype=bool)
+        if selected.any():
+            formatted[selected] = format_series(series[selected], col).to_numpy(dtype=object)
+        result[col] = pd.Series(formatted, index=df.index, dtype=object)
+    return pd.DataFrame(result, index=df.index, columns=columns, dtype=object)
+
+
+# Versão do layout do relatório: incrementar ao alterar generate_pdf() para invalidar o cache
+REPORT_TEMPLATE_VERSION = "2"
+
+
+# ---------- Carimbo e nome do arquivo ----------
+
+def format_carimbo(carimbo):
+    """Carimbo de data/hora no formato brasileiro DD-MM-AAAA HH:MM ('N/A' se vazio)."""
+    if pd.notna(carimbo):
+        if isinstance(carimbo, pd.Timestamp):
+            return carimbo.strftime('%d-%m-%Y %H:%M')
+        # Tentar converter se for string
+        try:
+            return pd.to_datetime(carimbo).strftime('%d-%m-%Y %H:%M')
+        except:
+            return str(carimbo).replace('/', '-')
+    return 'N/A'
+
+
+def split_data_hora(data_hora):
+    """Separa 'DD-MM-AAAA HH:MM' em (data, hora); sem hora, retorna (texto, 'N/A')."""
+    if ' ' in data_hora:
+        return data_hora.split()[0], data_hora.split()[1]
+    return data_hora, 'N/A'
+
+
+def report_filename(prefixo, data):
+    """Nome do arquivo PDF no padrão Relatorio_Vistoria_{prefixo}_{data}.pdf"""
+    prefixo = prefixo.replace('/', '_').replace('\\', '_').replace('-', '_')
+    data_str = data.replace('-', '_').replace(' ', '_')
+    return f"Relatorio_Vistoria_{prefixo}_{data_str}.pdf"
+
+
+def record_filename(schema, row):
+    """Nome do arquivo PDF de uma linha (mesmo nome do botão de download da lista)."""
+    prefixo = str(schema.value(row, 'prefixo', 'N/A'))
+    data, _ = split_data_hora(format_carimbo(schema.value(row, 'carimbo')))
+    return report_filename(prefixo, data)
+
+
+def display_rows(df, schema, positions):
+    """Linhas da lista de registros (data, hora, prefixo, cidade, vistoriador e chave estável)."""
+    display_data = []
+    # Só as colunas exibidas: montar a linha inteira (~190 colunas, várias categóricas) é o custo maior
+    roles = [schema.prefixo, schema.cidade, schema.vistoriador, schema.carimbo]
+    df = df[list(dict.fromkeys(col for col in roles if col is not None))]
+    for idx in positions:
+        row = df.iloc[idx]
+        
+        prefixo = str(schema.value(row, 'prefixo', 'N/A'))
+        cidade = str(schema.value(row, 'cidade', 'N/A'))
+        vistoriador = str(schema.value(row, 'vistoriador', 'N/A'))
+        carimbo = schema.value(row, 'carimbo')
+        
+        # Separar data (DD-MM-AAAA) e hora (HH:MM) para exibição
+        data_parte, hora_parte = split_data_hora(format_carimbo(carimbo))
+        
+        # Chave estável do registro (não muda quando novas respostas deslocam os índices)
+        chave = f"{carimbo}|{prefixo}" if pd.notna(carimbo) else f"idx{idx}"
+        
+        display_data.append({
+            'Chave': chave,
+            'Prefixo': prefixo,
+            'Cidade': cidade,
+            'Vistoriador': vistoriador,
+            'Data': data_parte,
+            'Hora': hora_parte,
+            'Índice': idx
+        })
+    return display_data
+
+
+# ---------- Indicadores de não conformidade ----------
+
+def _ranking(keys, per_row):
+    """Vistorias e não conformidades por valor de keys (cidade, prefixo...), piores primeiro."""
+    frame = pd.DataFrame({'chave': keys, 'nc': per_row, 'com_nc': per_row > 0})
+    grouped = frame.groupby('chave', observed=True, sort=False).agg(
+        vistorias=('nc', 'size'), nao_conformidades=('nc', 'sum'), com_nc=('com_nc', 'sum')
+    )
+    grouped['media'] = grouped['nao_conformidades'] / grouped['vistorias']
+    grouped.index = grouped.index.map(str)
+    return grouped.sort_values(['nao_conformidades', 'media'], ascending=False, kind='mergesort')
+
+
+def non_conformity_summary(df, schema, non_conformities=None, positions=None, top=15):
+    """
+    Indicadores de não conformidade das vistorias (todas ou só as posições informadas):
+    - 'por_area': não conformidades e vistorias com alguma não conformidade por área (AREAS_ORDER);
+    - 'itens': não conformidades por item (nome tratado do mapeamento), piores primeiro;
+    - 'top_itens': os top itens com alguma não conformidade;
+    - 'por_cidade' e 'por_veiculo': rankings com vistorias, não conformidades e média por vistoria.
+    non_conformities: matriz de non_conformity_matrix() para df (calculada se omitida).
+    """
+    columns = [col for col, _, _ in schema.item_columns]
+    if non_conformities is None:
+        non_conformities = non_conformity_matrix(df, columns)
+    hits = non_conformities[columns].to_numpy(dtype=bool)
+    if positions is not None:
+        hits = hits[positions]
+    total = len(hits)
+    per_item = hits.sum(axis=0)
+    per_row = hits.sum(axis=1)
+    areas = [area for _, area, _ in schema.item_columns]
+
+    items = pd.DataFrame({
+        'item': [name for _, _, name in schema.item_columns],
+        'area': [AREA_DISPLAY_NAMES.get(area, area) for area in areas],
+        'nao_conformidades': per_item,
+        'percentual': per_item / total * 100 if total else 0.0,
+    })
+    items = items.sort_values('nao_conformidades', ascending=False, kind='mergesort').reset_index(drop=True)
+
+    area_of_column = pd.Series(areas)
+    por_area = pd.DataFrame(
+        {
+            'nao_conformidades': [int(per_item[(area_of_column == area).to_numpy()].sum()) for area in AREAS_ORDER],
+            'vistorias_com_nc': [
+                int(hits[:, (area_of_column == area).to_numpy()].any(axis=1).sum()) for area in AREAS_ORDER
+            ],
+        },
+        index=[AREA_DISPLAY_NAMES[area] for area in AREAS_ORDER],
+    )
+
+    summary = {
+        'vistorias': total,
+        'vistorias_com_nc': int((per_row > 0).sum()),
+        'nao_conformidades': int(per_row.sum()),
+        'por_area': por_area,
+        'itens': items,
+        'top_itens': items[items['nao_conformidades'] > 0].head(top),
+    }
+    for key, role in (('por_cidade', 'cidade'), ('por_veiculo', 'prefixo')):
+        col = getattr(schema, role)
+        if col is None:
+            summary[key] = None
+            continue
+        keys = df[col] if positions is None else df[col].take(positions)
+        summary[key] = _ranking(_blank_to_na(keys.reset_index(drop=True)), per_row)
+    return summary
+
+
+# ---------- Geração do PDF ----------
+
+# Quebras de linha do texto das respostas (\r\n, \r ou \n), cada uma vira um <br/>
+_LINE_BREAK_PATTERN = re.compile(r'\r\n|\r|\n')
+
+
+def _line_breaks(value_str):
+    return _LINE_BREAK_PATTERN.sub('<br/>', str(value_str))
+
+
+class _FrozenParagraphStyle(ParagraphStyle):
+    """ParagraphStyle somente leitura (os estilos do template são compartilhados entre threads)."""
+
+    @classmethod
+    def freeze(cls, style):
+        frozen = object.__new__(cls)
+        frozen.__dict__.update(style.__dict__)
+        return frozen
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"O estilo '{self.name}' do relatório é somente leitura")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"O estilo '{self.name}' do relatório é somente leitura")
+
+
+class _SpacingTier:
+    """Faixa de espaçamento: espaço após cada item e após cada área, e o estilo dos itens."""
+    __slots__ = ('min_items', 'item', 'area', 'style')
+
+    def __init__(self, min_items, item, area, style):
+        self.min_items = min_items
+        self.item = item
+        self.area = area
+        self.style = style
+
+
+class ReportTemplate:
+    """
+    Layout do relatório compilado uma vez por processo (report_template()): estilos
+    somente leitura, uma faixa de espaçamento por quantidade de itens, áreas na ordem do
+    relatório com o nome de exibição e fábricas dos flowables. Não guarda nada de um
+    relatório específico, então pode ser usado por várias threads ao mesmo tempo.
+    """
+
+    def __init__(self):
+        styles = getSampleStyleSheet()
+        self.title_style = _FrozenParagraphStyle.freeze(ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=14,
+            textColor=colors.HexColor('#1f4e79'),
+            spaceAfter=8,
+            alignment=TA_CENTER
+        ))
+        self.heading_style = _FrozenParagraphStyle.freeze(ParagraphStyle(
+            'CustomHeading',
+            parent=styles['Heading2'],
+            fontSize=11,
+            textColor=colors.HexColor('#1f4e79'),
+            spaceAfter=4,
+            spaceBefore=8
+        ))
+        self.info_style = _FrozenParagraphStyle.freeze(ParagraphStyle(
+            'InfoStyle',
+            parent=styles['Normal'],
+            fontSize=7,
+            spaceAfter=6,
+            leading=9
+        ))
+        self.caption_style = _FrozenParagraphStyle.freeze(ParagraphStyle(
+            'PhotoCaption',
+            parent=styles['Normal'],
+            fontSize=6,
+            leading=7,
+            alignment=TA_CENTER
+        ))
+        normal_style = ParagraphStyle(
+            'CustomNormal',
+            parent=styles['Normal'],
+            fontSize=8,
+            spaceAfter=2,
+            leading=10
+        )
+        # Quanto mais itens, menos espaço entre eles (da faixa mais cheia para a mais vazia)
+        self.tiers = tuple(
+            _SpacingTier(min_items, item, area, _FrozenParagraphStyle.freeze(
+                ParagraphStyle(f'CustomNormal{item}', parent=normal_style, spaceAfter=item)
+            ))
+            for min_items, item, area in ((21, 1, 3), (11, 2, 4), (0, 3, 6))
+        )
+        self.areas = tuple((area, AREA_DISPLAY_NAMES.get(area, area)) for area in AREAS_ORDER)
+
+    def tier(self, total_items):
+        """Faixa de espaçamento conforme a quantidade de conteúdo."""
+        return next(tier for tier in self.tiers if total_items >= tier.min_items)
+
+    @property
+    def compact_tier(self):
+        return self.tiers[0]
+
+    @property
+    def loose_tier(self):
+        return self.tiers[-1]
+
+    def doc(self, output):
+        # Margens reduzidas para aproveitar melhor o espaço horizontal
+        return SimpleDocTemplate(output, pagesize=A4,
+                                 rightMargin=0.25*inch, leftMargin=0.25*inch,
+                                 topMargin=0.3*inch, bottomMargin=0.3*inch)
+
+    def title(self, text):
+        return Paragraph(text, self.title_style)
+
+    def heading(self, text):
+        return Paragraph(text, self.heading_style)
+
+    def info(self, text):
+        return Paragraph(text, self.info_style)
+
+    def item(self, text, tier):
+        return Paragraph(text, tier.style)
+
+    def caption(self, text):
+        return Paragraph(text, self.caption_style)
+
+    # Fotos: PHOTO_COLUMNS por linha, cada uma dentro de PHOTO_BOX (pontos)
+    PHOTO_COLUMNS = 3
+    PHOTO_BOX = (2.4*inch, 1.8*inch)
+
+    def photo(self, data):
+        """Foto (bytes JPEG/PNG) reduzida proporcionalmente para caber em PHOTO_BOX."""
+        width, height = self.PHOTO_BOX
+        return Image(io.BytesIO(data), width=width, height=height, kind='proportional')
+
+    def photo_grid(self, cells):
+        """Tabela com as fotos (listas de flowables: imagem e legenda), PHOTO_COLUMNS por linha."""
+        columns = self.PHOTO_COLUMNS
+        rows = [cells[i:i + columns] for i in range(0, len(cells), columns)]
+        rows[-1] = rows[-1] + [''] * (columns - len(rows[-1]))
+        table = Table(rows, colWidths=[self.PHOTO_BOX[0] + 0.1*inch] * columns)
+        table.setStyle(TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+        ]))
+        return table
+
+    @staticmethod
+    def spacer(height):
+        return Spacer(1, height)
+
+
+@lru_cache(maxsize=1)
+def report_template():
+    """O ReportTemplate do processo (criado no primeiro uso e compartilhado por todos os PDFs)."""
+    return ReportTemplate()
+
+
+def _has_text(value):
+    return pd.notna(value) and bool(str(value).strip())
+
+
+def _info_text(row, schema):
+    """Cidade, vistoriador, data da vistoria (do carimbo) e, se preenchidos, Km e Wifi."""
+    cidade = str(schema.value(row, 'cidade', 'N/A'))
+    vistoriador = str(schema.value(row, 'vistoriador', 'N/A'))
+    quilometragem = schema.value(row, 'quilometragem')
+    wifi = schema.value(row, 'wifi')
+    # Formatar data_hora no formato brasileiro DD-MM-AAAA
+    data_hora_formatada = format_carimbo(schema.value(row, 'carimbo'))
+    
+    # Usar data_hora_formatada (do carimbo) como "Data da Vistoria"
+    info_text = f"<b>Cidade:</b> {cidade} | <b>Vistoriador:</b> {vistoriador}<br/>"
+    info_text += f"<b>Data da Vistoria:</b> {data_hora_formatada}"
+    
+    # Adicionar Km se estiver preenchido
+    if pd.notna(quilometragem) and str(quilometragem).strip() and str(quilometragem).strip() not in ['N/A', 'nan', 'None', '']:
+        # Formatar quilometragem (remover decimais desnecessários se for número)
+        try:
+            km_value = float(quilometragem)
+            if km_value == int(km_value):
+                km_value = int(km_value)
+            info_text += f" | <b>Km:</b> {km_value}"
+        except (ValueError, TypeError):
+            info_text += f" | <b>Km:</b> {str(quilometragem).strip()}"
+    
+    # Adicionar Wifi se estiver preenchido
+    if pd.notna(wifi) and str(wifi).strip() and str(wifi).strip() not in ['N/A', 'nan', 'None', '']:
+        info_text += f" | <b>Wifi:</b> {str(wifi).strip()}"
+    return info_text
+
+
+def _collect_non_conformities(row, schema, row_hits=None, formatted=None):
+    """
+    Não conformidades do registro por área ({área: [(item, valor formatado)]}) e
+    observações gerais. row_hits: linha da matriz de non_conformity_matrix() (opcional).
+    formatted: linha de format_item_cells() com os valores já formatados (opcional);
+    sem ela, cada valor é formatado com format_value().
+    """
+    non_conformities_by_area = {area: [] for area, _ in report_template().areas}
+    # Processar apenas as colunas de itens (metadados, fotos e observações gerais já excluídos no esquema)
+    for col, area, item_name in schema.item_columns:
+        value = row[col]
+        if row_hits[col] if row_hits is not None else has_non_conformity(value):
+            # A coluna original decide a formatação (ex.: datas de extintor)
+            value_str = formatted[col] if formatted is not None else format_value(value, col)
+            non_conformities_by_area[area].append((item_name, value_str))
+    # Observações gerais separadamente (exibidas na seção GERAL ao final)
+    obs_geral = row.get(schema.obs_geral, '') if schema.obs_geral else None
+    return non_conformities_by_area, obs_geral
+
+
+def _bullet_lines(value_str):
+    """Preserva as quebras de linha (\n, \r\n, \r -> <br/>) e põe um bullet em cada linha não vazia."""
+    linhas = [f"• {linha.strip()}" for linha in _LINE_BREAK_PATTERN.split(str(value_str)) if linha.strip()]
+    return '<br/>'.join(linhas)
+
+
+def _item_text(item_name, value_str):
+    # Observações: quebrar linha após o nome e um bullet point em cada linha
+    if 'observações' in item_name.lower() or 'observacoes' in item_name.lower():
+        return f"• <b>{item_name}:</b><br/>{_bullet_lines(value_str)}"
+    # Para outros campos: apenas preservar quebras de linha
+    return f"• <b>{item_name}:</b> {_line_breaks(value_str)}"
+
+
+def _vistoria_story(row, schema, template, row_hits=None, formatted=None):
+    """Flowables do relatório de uma vistoria (layout de generate_pdf)."""
+    prefixo = str(schema.value(row, 'prefixo', 'N/A'))
+    story = []
+    
+    # Título
+    story.append(template.title(f"<b>RELATÓRIO DE VISTORIA - PREFIXO {prefixo}</b>"))
+    story.append(template.spacer(0.1*inch))
+    
+    # Informações gerais (em formato mais compacto)
+    story.append(template.info(_info_text(row, schema)))
+    story.append(template.spacer(0.1*inch))
+    
+    # Organizar não conformidades por área
+    non_conformities_by_area, obs_geral = _collect_non_conformities(row, schema, row_hits, formatted)
+    
+    # Ajustar espaçamentos baseado na quantidade de conteúdo (observações gerais contam como item)
+    total_items = sum(len(items) for items in non_conformities_by_area.values())
+    if _has_text(obs_geral):
+        total_items += 1
+    tier = template.tier(total_items)
+    
+    # Adicionar conteúdo por área (apenas áreas com não conformidades)
+    for area, display_name in template.areas:
+        if non_conformities_by_area[area]:
+            story.append(template.heading(f"<b>{display_name}</b>"))
+            for item_name, value_str in non_conformities_by_area[area]:
+                story.append(template.item(_item_text(item_name, value_str), tier))
+                story.append(template.spacer(tier.item))
+            story.append(template.spacer(tier.area))
+    
+    # Adicionar seção GERAL com observações gerais ao final (se houver)
+    if _has_text(obs_geral):
+        story.append(template.heading("<b>GERAL</b>"))
+        # Nome tratado para observações gerais (resolvido no esquema); quebra de linha após o nome
+        item_text = f"• <b>{schema.obs_geral_name}:</b><br/>{_bullet_lines(obs_geral)}"
+        story.append(template.item(item_text, tier))
+        story.append(template.spacer(tier.item))
+    
+    # Se não houver nenhuma não conformidade e nenhuma observação geral
+    if not any(non_conformities_by_area.values()) and not _has_text(obs_geral):
+        story.append(template.item("<b>Nenhuma não conformidade registrada.</b>", tier))
+    return story
+
+
+def record_photo_ids(row, schema):
+    """Fotos do registro: [(legenda, ID do arquivo no Drive)] na ordem das colunas de foto."""
+    photos = []
+    for col, area, name in schema.photo_items:
+        file_ids = drive_file_ids(row.get(col))
+        for n, file_id in enumerate(file_ids, start=1):
+            caption = f"{AREA_DISPLAY_NAMES.get(area, area)}: {name}" if area else name
+            if len(file_ids) > 1:
+                caption += f" ({n})"
+            photos.append((caption, file_id))
+    return photos
+
+
+def _photos_story(photos, template):
+    """Seção FOTOS: grade com as fotos e legendas; foto que não pôde ser baixada vira um aviso."""
+    cells = []
+    for caption, data in photos:
+        image = template.photo(data) if data is not None else template.caption("<i>Foto indisponível</i>")
+        cells.append([image, template.caption(caption)])
+    return [template.heading("<b>FOTOS</b>"), template.photo_grid(cells)]
+
+
+def format_item_cells(df, schema, positions, non_conformities=None):
+    """
+    Valores formatados (format_frame) das células com não conformidade das linhas nas
+    posições informadas, uma linha por posição e as demais células None. Para relatórios
+    em lote: formata coluna a coluna em vez de célula a célula.
+    """
+    columns = [col for col, _, _ in schema.item_columns]
+    rows = df.iloc[positions]
+    if non_conformities is not None:
+        mask = non_conformities[columns].iloc[positions]
+    else:
+        mask = non_conformity_matrix(rows, columns)
+    return format_frame(rows, columns, mask=mask)
+
+
+def generate_pdf(df, index, column_mapping=None, non_conformities=None, photos=None, formatted=None):
+    """
+    Gera o PDF do registro na posição index. non_conformities (opcional) é a matriz de
+    non_conformity_matrix() para df; sem ela, cada célula é testada com has_non_conformity().
+    photos (opcional): [(legenda, bytes da imagem ou None)] já baixadas (ver record_photo_ids e
+    fotos_vistoria.PhotoStore), incluídas ao final; sem photos, o relatório não traz fotos.
+    formatted (opcional): linha de format_item_cells() deste registro, calculada com a mesma
+    matriz non_conformities (geração em lote).
+    """
+    buffer = io.BytesIO()
+    template = report_template()
+    # Papéis das colunas resolvidos uma vez por conjunto de colunas
+    schema = get_vistoria_schema(df.columns, column_mapping)
+    row_hits = non_conformities.iloc[index] if non_conformities is not None else None
+    story = _vistoria_story(df.iloc[index], schema, template, row_hits, formatted)
+    if photos:
+        story.extend(_photos_story(photos, template))
+    template.doc(buffer).build(story)
+    buffer.seek(0)
+    return buffer
+
+
+# ---------- PDF consolidado (várias vistorias em um documento) ----------
+
+# Vistorias formatadas de uma vez (format_item_cells) nos relatórios em lote
+FORMAT_BLOCK_SIZE = 256
+
+class _StreamingStory(list):
+    """
+    Story que o ReportLab consome pelo início (build() testa len() a cada flowable).
+    Quando esvazia, é reabastecida com o próximo bloco do gerador: só os flowables de
+    uma vistoria ficam em memória por vez; as páginas já desenhadas ficam comprimidas.
+    """
+
+    def __init__(self, chunks):
+        super().__init__()
+        self._chunks = iter(chunks)
+
+    def __len__(self):
+        while not list.__len__(self):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self.extend(chunk)
+        return list.__len__(self)
+
+
+def _compact_story(row, schema, template, row_hits=None, formatted=None):
+    """Seção curta de uma vistoria: data e informações, e uma linha por área com não conformidades."""
+    tier = template.compact_tier
+    story = [template.info(_info_text(row, schema))]
+    non_conformities_by_area, obs_geral = _collect_non_conformities(row, schema, row_hits, formatted)
+    for area, display_name in template.areas:
+        items = non_conformities_by_area[area]
+        if items:
+            text = '; '.join(f"{item_name}: {value_str}".replace('\n', ' ') for item_name, value_str in items)
+            story.append(template.item(f"<b>{display_name}:</b> {text}", tier))
+    if _has_text(obs_geral):
+        story.append(template.item(f"<b>GERAL:</b> {_bullet_lines(obs_geral)}", tier))
+    if not any(non_conformities_by_area.values()) and not _has_text(obs_geral):
+        story.append(template.item("Nenhuma não conformidade registrada.", tier))
+    story.append(template.spacer(6))
+    return story
+
+
+def generate_consolidated_pdf(df, positions, output, column_mapping=None, non_conformities=None,
+                              layout='pagina', progress=None):
+    """
+    PDF consolidado de várias vistorias, montado em uma única passada: os flowables de
+    cada vistoria só são criados quando o ReportLab chega nela (memória limitada mesmo
+    para um mês inteiro). O esquema é resolvido uma vez para o documento todo.
+    layout 'pagina': cada vistoria em sua própria página, com o conteúdo de generate_pdf();
+    'compacto': uma seção curta por vistoria, agrupadas por veículo (prefixo).
+    output: caminho ou arquivo binário. progress(feitas, total) é chamado a cada vistoria.
+    """
+    positions = list(positions)
+    schema = get_vistoria_schema(df.columns, column_mapping)
+    template = report_template()
+    if non_conformities is None:
+        # A mesma matriz decide as não conformidades e as células formatadas
+        non_conformities = non_conformity_matrix(df, [col for col, _, _ in schema.item_columns])
+    total = len(positions)
+    if layout == 'compacto' and schema.prefixo:
+        # Agrupar por veículo mantendo a ordem original dentro de cada um
+        prefixos = df[schema.prefixo].iloc[positions].astype(str).to_numpy()
+        order = sorted(range(total), key=lambda k: prefixos[k])
+        positions = [positions[k] for k in order]
+
+    def chunks():
+        if layout == 'compacto':
+            title = f"<b>RELATÓRIO CONSOLIDADO DE VISTORIAS</b> ({total})"
+            yield [template.title(title), template.spacer(0.1*inch)]
+        if not positions:
+            yield [template.item("<b>Nenhuma vistoria selecionada.</b>", template.loose_tier)]
+        last_prefixo = None
+        for done, pos in enumerate(positions, start=1):
+            block = (done - 1) % FORMAT_BLOCK_SIZE
+            if block == 0:
+                # Valores formatados em bloco (só o bloco atual fica em memória)
+                formatted = format_item_cells(df, schema, positions[done - 1:done - 1 + FORMAT_BLOCK_SIZE],
+                                              non_conformities)
+            row = df.iloc[pos]
+            row_formatted = formatted.iloc[block]
+            row_hits = non_conformities.iloc[pos]
+            if layout == 'compacto':
+                prefixo = str(schema.value(row, 'prefixo', 'N/A'))
+                chunk = []
+                if prefixo != last_prefixo:
+                    chunk.append(template.heading(f"<b>PREFIXO {prefixo}</b>"))
+                    last_prefixo = prefixo
+                chunk.extend(_compact_story(row, schema, template, row_hits, row_formatted))
+            else:
+                chunk = _vistoria_story(row, schema, template, row_hits, row_formatted)
+                if done < total:
+                    chunk.append(PageBreak())
+            yield chunk
+            if progress:
+                progress(done, total)
+
+    template.doc(output).build(_StreamingStory(chunks()))
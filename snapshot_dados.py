@@ -0,0 +1,190 @@
+"""
+Snapshot local (Parquet) do conjunto de vistorias já normalizado.
+
+Gravado após cada carga bem-sucedida e lido primeiro na inicialização e no
+fallback: um container novo serve o dashboard sem esperar a API do Google nem o
+openpyxl, e uma queda do Google cai em dados recentes em vez do xlsx do repositório.
+
+Colunas de texto, números e datas são gravadas como colunas nativas do Parquet.
+Colunas "object" com tipos misturados (ex.: respostas com texto e inteiros vindas
+do xlsx) são gravadas como texto + uma coluna de tipo, e reconstruídas exatamente.
+
+Não depende do Streamlit; requer pyarrow (já instalado junto com o Streamlit).
+"""
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Incrementar quando a normalização ou a codificação mudar (snapshots antigos são ignorados)
+SNAPSHOT_FORMAT_VERSION = 2
+
+_METADATA_KEY = b"vistorias_snapshot"
+_TYPE_COLUMN_PREFIX = "__tipo__::"
+
+
+def schema_fingerprint(df):
+    """Hash dos nomes das colunas e do tipo básico de cada uma (data, número, texto...)."""
+    h = hashlib.sha256()
+    for col, dtype in zip(df.columns, df.dtypes):
+        h.update(f"{col}\x1f{getattr(dtype, 'kind', 'O')}\x1e".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def _type_tag(value):
+    if value is None:
+        return "z"
+    if isinstance(value, bool):
+        return "b"
+    if isinstance(value, int) or (hasattr(value, "dtype") and getattr(value.dtype, "kind", "") in "iu"):
+        return "i"
+    if isinstance(value, float):
+        return "n" if value != value else "f"
+    if isinstance(value, str):
+        return "s"
+    if value is pd.NaT:
+        return "N"
+    if isinstance(value, pd.Timestamp):
+        return "t"
+    if isinstance(value, datetime):
+        return "d"
+    raise TypeError(f"tipo não suportado no snapshot: {type(value).__name__}")
+
+
+def _encode_value(value, tag):
+    if tag in ("z", "n", "N"):
+        return None
+    if tag == "f":
+        return repr(float(value))
+    if tag in ("t", "d"):
+        return value.isoformat()
+    return str(value)
+
+
+def _decode_value(text, tag):
+    if tag == "s":
+        return text
+    if tag == "i":
+        return int(text)
+    if tag == "f":
+        return float(text)
+    if tag == "t":
+        return pd.Timestamp(text)
+    if tag == "d":
+        return datetime.fromisoformat(text)
+    if tag == "b":
+        return text == "True"
+    if tag == "n":
+        return float("nan")
+    if tag == "N":
+        return pd.NaT
+    return None
+
+
+def _is_mixed(series):
+    return series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) not in ("string", "empty")
+
+
+def write_snapshot(df, path, source, source_version=None, data_fingerprint=None):
+    """
+    Grava o snapshot de forma atômica (arquivo temporário + os.replace).
+    Retorna True se gravou; False se o Parquet não estiver disponível ou os dados não forem suportados.
+    """
+    if not PARQUET_AVAILABLE or df is None or not path:
+        return False
+    encoded = {}
+    mixed_columns = []
+    try:
+        for col in df.columns:
+            series = df[col]
+            if _is_mixed(series):
+                tags = [_type_tag(v) for v in series]
+                encoded[str(col)] = pd.array([_encode_value(v, t) for v, t in zip(series, tags)], dtype="string")
+                encoded[_TYPE_COLUMN_PREFIX + str(col)] = pd.Categorical(tags)
+                mixed_columns.append(str(col))
+            else:
+                encoded[str(col)] = series.reset_index(drop=True)
+        table = pa.Table.from_pandas(pd.DataFrame(encoded), preserve_index=False)
+    except (TypeError, ValueError, pa.ArrowException):
+        return False
+    metadata = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "schema_fingerprint": schema_fingerprint(df),
+        "data_fingerprint": data_fingerprint,
+        "source": source,
+        "source_version": source_version,
+        "saved_at": time.time(),
+        "columns": [str(c) for c in df.columns],
+        "mixed_columns": mixed_columns,
+        "rows": len(df),
+    }
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[_METADATA_KEY] = json.dumps(metadata).encode("utf-8")
+    table = table.replace_schema_metadata(schema_metadata)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def read_snapshot_metadata(path):
+    """Metadados do snapshot (sem ler os dados) ou None se ausente/inválido."""
+    if not PARQUET_AVAILABLE or not path or not os.path.isfile(path):
+        return None
+    try:
+        raw = (pq.read_schema(path).metadata or {}).get(_METADATA_KEY)
+        metadata = json.loads(raw) if raw else None
+    except Exception:
+        return None
+    if not metadata or metadata.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        return None
+    return metadata
+
+
+def read_snapshot(path):
+    """
+    Lê o snapshot. Retorna (DataFrame, metadados) ou (None, None) se ausente, de outra
+    versão de formato ou se o esquema lido não conferir com o gravado.
+    """
+    metadata = read_snapshot_metadata(path)
+    if metadata is None:
+        return None, None
+    try:
+        table = pq.read_table(path)
+        encoded = table.to_pandas()
+    except Exception:
+        return None, None
+    data = {}
+    for col in metadata["columns"]:
+        if col in metadata["mixed_columns"]:
+            tags = encoded[_TYPE_COLUMN_PREFIX + col].astype(object)
+            texts = encoded[col].astype(object)
+            data[col] = pd.Series(
+                [_decode_value(t, tag) for t, tag in zip(texts, tags)], dtype=object
+            )
+        else:
+            data[col] = encoded[col]
+    df = pd.DataFrame(data, columns=metadata["columns"])
+    if schema_fingerprint(df) != metadata["schema_fingerprint"]:
+        return None, None
+    return df, metadata
@@ -0,0 +1,198 @@
+"""
+Agregados diários das vistorias para os gráficos de tendência.
+
+A tabela de agregados tem uma linha por (dia do carimbo, cidade) com as
+vistorias, as vistorias com não conformidade e as não conformidades por área.
+Semanas e séries por cidade saem dessa tabela, que é pequena (dias x cidades).
+
+A atualização é incremental: as respostas do Forms só são acrescentadas e, com
+os dados ordenados pelo carimbo (normalize_vistoria_df), as novas ficam no topo.
+A cada nova versão dos dados só essas linhas são lidas (carimbo, cidade e não
+conformidades) e somadas à tabela; as demais nem são percorridas. A tabela é
+refeita por inteiro na primeira vez, quando as colunas ou o mapeamento mudam,
+quando há menos linhas ou as do topo não são todas mais recentes que as já vistas,
+e a cada full_rebuild_interval segundos, o que também recolhe respostas antigas
+editadas na planilha.
+
+Não depende do Streamlit.
+"""
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from relatorio import AREA_DISPLAY_NAMES, AREAS_ORDER, non_conformity_matrix
+
+# Intervalo padrão entre reconstruções completas (segundos)
+DEFAULT_FULL_REBUILD_INTERVAL = 3600
+
+AREA_COLUMNS = [AREA_DISPLAY_NAMES[area] for area in AREAS_ORDER]
+
+
+def _carimbo_stamps(df, schema, positions):
+    """Carimbo (datetime64[ns]) das linhas nas posições informadas; NaT onde não há carimbo."""
+    if schema.carimbo is None:
+        return np.full(len(positions), np.datetime64('NaT'), dtype='datetime64[ns]')
+    stamps = df[schema.carimbo].take(positions)
+    return pd.to_datetime(stamps, errors='coerce').to_numpy(dtype='datetime64[ns]')
+
+
+def city_labels(values):
+    """Nome da cidade como aparece na tabela: sem espaços nas pontas; vazio vira "N/A"."""
+    cidades = pd.Series(values, dtype=object)
+    cidades = cidades.where(cidades.notna(), "").astype(str).str.strip().replace("", "N/A")
+    return cidades.to_numpy(dtype=object)
+
+
+def aggregate_days(df, schema, non_conformities, positions, days):
+    """Agregados por (dia, cidade) das linhas nas posições informadas (days: dia de cada uma)."""
+    columns = [col for col, _, _ in schema.item_columns]
+    hits = non_conformities[columns].take(positions).to_numpy(dtype=bool)
+    areas = np.array([AREA_DISPLAY_NAMES.get(area, area) for _, area, _ in schema.item_columns], dtype=object)
+    total = hits.sum(axis=1)
+    if schema.cidade is not None:
+        cidades = city_labels(df[schema.cidade].take(positions).astype(object))
+    else:
+        cidades = np.full(len(positions), "N/A", dtype=object)
+    frame = pd.DataFrame({
+        'dia': days,
+        'cidade': cidades,
+        'vistorias': 1,
+        'com_nc': (total > 0).astype(int),
+        'nao_conformidades': total,
+        **{area: hits[:, areas == area].sum(axis=1) for area in AREA_COLUMNS},
+    })
+    return frame.groupby(['dia', 'cidade'], sort=True).sum()
+
+
+class DailyRollup:
+    """
+    Tabela de agregados diários mantida entre reruns e sessões (uma instância por
+    processo). update() recebe cada nova versão dos dados e processa só as linhas novas.
+    """
+
+    def __init__(self, full_rebuild_interval=DEFAULT_FULL_REBUILD_INTERVAL):
+        self.full_rebuild_interval = full_rebuild_interval
+        self._lock = threading.Lock()
+        self._table = None
+        # Linhas já somadas à tabela e o carimbo mais recente entre elas
+        self._rows = 0
+        self._newest = np.datetime64('NaT', 'ns')
+        self._version = None
+        self._layout = None
+        self._built_at = 0.0
+        self.full_builds = 0
+        self.incremental_updates = 0
+        self.last_rows_processed = 0
+        self.last_update_seconds = None
+
+    def _new_rows(self, df, schema):
+        """
+        Quantas linhas do topo de df são novas, ou None se df não for os dados já vistos
+        mais linhas novas no topo (menos linhas, carimbos fora de ordem...).
+        """
+        added = len(df) - self._rows
+        if added < 0:
+            return None
+        if added == 0 or schema.carimbo is None:
+            # Sem carimbo nenhuma linha entra na tabela
+            return added
+        stamps = _carimbo_stamps(df, schema, np.arange(min(added + 1, len(df))))
+        new, following = stamps[:added], stamps[added:]
+        # As novas têm carimbo e são mais recentes que todas as já vistas...
+        if np.isnat(new).any() or (new <= self._newest).any():
+            return None
+        # ...e a seguinte já é uma das antigas
+        if len(following) and not np.isnat(following[0]) and not following[0] <= self._newest:
+            return None
+        return added
+
+    def update(self, df, schema, non_conformities=None, version=None):
+        """
+        Atualiza a tabela para os dados de df (version: identificador da versão, ex.: o
+        fingerprint; a mesma versão não é processada de novo). df ordenado como em
+        normalize_vistoria_df. non_conformities (opcional): matriz de df; sem ela, só a das
+        linhas processadas é calculada. Retorna a tabela de agregados.
+        """
+        with self._lock:
+            if version is not None and version == self._version:
+                return self._table
+            started = time.perf_counter()
+            layout = (tuple(df.columns), tuple(schema.item_columns))
+            added = None
+            if (
+                self._table is not None
+                and layout == self._layout
+                and time.time() - self._built_at < self.full_rebuild_interval
+            ):
+                added = self._new_rows(df, schema)
+            full = added is None
+            positions = np.arange(len(df) if full else added)
+            if non_conformities is None:
+                columns = [col for col, _, _ in schema.item_columns]
+                rows = df.iloc[positions]
+                non_conformities = non_conformity_matrix(rows, columns)
+            stamps = _carimbo_stamps(df, schema, positions)
+            valid = ~np.isnat(stamps)
+            partial = aggregate_days(
+                df, schema, non_conformities, positions[valid], stamps[valid].astype('datetime64[D]')
+            )
+            if full:
+                self._table = partial
+                self._built_at = time.time()
+                self._newest = stamps[valid].max() if valid.any() else np.datetime64('NaT', 'ns')
+                self.full_builds += 1
+            else:
+                if len(partial):
+                    # Tabela pequena (dias x cidades): somar os agregados das linhas novas
+                    self._table = pd.concat([self._table, partial]).groupby(level=['dia', 'cidade']).sum()
+                    self._newest = np.fmax(self._newest, stamps[valid].max())
+                self.incremental_updates += 1
+            self._rows = len(df)
+            self.last_rows_processed = len(positions)
+            self._layout = layout
+            self._version = version
+            self.last_update_seconds = time.perf_counter() - started
+            return self._table
+
+    def stats(self):
+        with self._lock:
+            days = self._table.index.get_level_values('dia').nunique() if self._table is not None else 0
+            return {
+                "days": days,
+                "rows": self._rows,
+                "full_builds": self.full_builds,
+                "incremental_updates": self.incremental_updates,
+                "last_rows_processed": self.last_rows_processed,
+                "last_update_seconds": self.last_update_seconds,
+            }
+
+
+def trend_series(table, freq='D', cidades=None):
+    """
+    Séries para os gráficos a partir da tabela de agregados, por dia ('D') ou semana ('W',
+    a partir de segunda-feira), sem lacunas de datas. cidades (opcional) restringe as linhas.
+    Retorna {'vistorias': DataFrame (vistorias, com_nc), 'areas': DataFrame por área,
+    'cidades': DataFrame com uma coluna de vistorias por cidade}.
+    """
+    if table is None or table.empty:
+        empty = pd.DataFrame()
+        return {'vistorias': empty, 'areas': empty, 'cidades': empty}
+    if cidades:
+        # Mesmo tratamento dos nomes da tabela (opções do filtro vêm dos valores crus)
+        table = table[table.index.get_level_values('cidade').isin(city_labels(list(cidades)))]
+    daily = table.groupby(level='dia').sum()
+    by_city = table['vistorias'].unstack('cidade', fill_value=0)
+    if not daily.empty:
+        calendar = pd.date_range(daily.index.min(), daily.index.max(), freq='D')
+        daily = daily.reindex(calendar, fill_value=0)
+        by_city = by_city.reindex(calendar, fill_value=0)
+    if freq == 'W':
+        daily = daily.resample('W-MON', label='left', closed='left').sum()
+        by_city = by_city.resample('W-MON', label='left', closed='left').sum()
+    return {
+        'vistorias': daily[['vistorias', 'com_nc']],
+        'areas': daily[AREA_COLUMNS],
+        'cidades': by_city,
+    }
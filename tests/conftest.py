@@ -0,0 +1,30 @@
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+# Os módulos do app ficam na raiz do repositório (layout plano)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def local_server():
+    """
+    Fábrica de servidores HTTP locais para imitar APIs: recebe a classe do handler,
+    inicia o servidor numa porta livre e devolve a URL base. Encerra tudo no fim do teste.
+    """
+    servers = []
+
+    def start(handler):
+        quiet = type(handler.__name__, (handler,), {'log_message': lambda self, *args: None})
+        server = ThreadingHTTPServer(('127.0.0.1', 0), quiet)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,40 @@
+import os
+
+from cache_relatorios import DiskLRU, ReportCache
+
+
+def test_disk_tier_counts_without_rescanning(tmp_path, monkeypatch):
+    cache = ReportCache(max_memory_bytes=0, disk_dir=str(tmp_path), max_disk_bytes=25)
+    for key in ('a', 'b'):
+        cache.put(key, b'x' * 10)
+    assert cache.get('a') == b'x' * 10
+
+    def no_scan(*args, **kwargs):
+        raise AssertionError("diretório varrido depois da criação")
+
+    monkeypatch.setattr(os, 'scandir', no_scan)
+    cache.put('c', b'y' * 10)
+    stats = cache.stats()
+    assert (stats['disk_entries'], stats['disk_bytes']) == (2, 20)
+    # 'b' era o acesso mais antigo
+    assert sorted(os.listdir(tmp_path)) == ['a.pdf', 'c.pdf']
+
+
+def test_disk_index_is_rebuilt_at_startup(tmp_path):
+    first = DiskLRU(str(tmp_path), max_bytes=100)
+    first.put('a', b'1' * 30)
+    first.put('b', b'2' * 30)
+    second = DiskLRU(str(tmp_path), max_bytes=100)
+    assert second.stats() == (2, 60)
+    assert second.get('b') == b'2' * 30
+    # Só cabe a metade: a varredura na criação já despeja o excedente
+    smaller = DiskLRU(str(tmp_path), max_bytes=40)
+    assert smaller.stats() == (1, 30)
+
+
+def test_missing_file_is_forgotten(tmp_path):
+    disk = DiskLRU(str(tmp_path), max_bytes=100)
+    disk.put('a', b'1' * 30)
+    os.remove(tmp_path / 'a.pdf')
+    assert disk.get('a') is None
+    assert disk.stats() == (0, 0)
@@ -0,0 +1,105 @@
+import io
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import requests
+from PIL import Image
+
+from fotos_vistoria import DriveFileFetcher, PhotoStore, drive_file_ids
+
+PHOTO_A = '1AAAAAAAAAAAA'
+PHOTO_B = '1BBBBBBBBBBBB'
+BROKEN = '1ZZZZZZZZZZZZ'
+
+
+def _jpeg(size=(1200, 1600)):
+    output = io.BytesIO()
+    Image.new('RGB', size, (120, 40, 200)).save(output, format='JPEG')
+    return output.getvalue()
+
+
+class FakeDrive:
+    """Servidor local que imita o download do Drive (files/<id>?alt=media)."""
+
+    def __init__(self, serve):
+        self.files = {PHOTO_A: _jpeg(), PHOTO_B: _jpeg()}
+        self.requests = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                file_id = self.path.split('?')[0].rsplit('/', 1)[-1]
+                fake.requests.append(file_id)
+                body = fake.files.get(file_id)
+                self.send_response(200 if body is not None else 404)
+                body = body if body is not None else b'{}'
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.url = serve(Handler)
+
+
+@pytest.fixture
+def drive(local_server):
+    return FakeDrive(local_server)
+
+
+def _store(drive, cache_dir, **kwargs):
+    return PhotoStore(DriveFileFetcher(requests.Session(), base_url=drive.url), str(cache_dir), **kwargs)
+
+
+def test_drive_file_ids():
+    value = (f"https://drive.google.com/open?id={PHOTO_A}, "
+             f"https://drive.google.com/file/d/{PHOTO_B}/view, https://drive.google.com/open?id={PHOTO_A}")
+    assert drive_file_ids(value) == [PHOTO_A, PHOTO_B]
+    assert drive_file_ids(float('nan')) == []
+
+
+def test_thumbnails_are_downloaded_once(drive, tmp_path):
+    store = _store(drive, tmp_path, max_pixels=320)
+    first = store.thumbnails([PHOTO_A, PHOTO_B])
+    assert max(Image.open(io.BytesIO(first[PHOTO_A])).size) == 320
+    again = _store(drive, tmp_path).thumbnails([PHOTO_A, PHOTO_B])
+    assert again == first
+    assert sorted(drive.requests) == [PHOTO_A, PHOTO_B]
+
+
+def test_failures_are_remembered(drive, tmp_path):
+    store = _store(drive, tmp_path, failure_ttl=60)
+    assert store.thumbnails([BROKEN, PHOTO_A])[BROKEN] is None
+    assert store.thumbnails([BROKEN])[BROKEN] is None
+    assert drive.requests.count(BROKEN) == 1
+    assert store.stats()['failure_hits'] == 1
+
+    retry = _store(drive, tmp_path / 'outro', failure_ttl=0)
+    assert retry.thumbnails([BROKEN])[BROKEN] is None
+    drive.files[BROKEN] = _jpeg()
+    # failure_ttl vencido: tenta de novo e agora baixa
+    assert retry.thumbnails([BROKEN])[BROKEN] is not None
+
+
+def test_thumbnail_directory_is_capped(drive, tmp_path):
+    size = len(_store(drive, tmp_path / 'medida').thumbnails([PHOTO_A])[PHOTO_A])
+    store = _store(drive, tmp_path / 'fotos', max_cache_bytes=size + size // 2)
+    store.thumbnails([PHOTO_A])
+    store.thumbnails([PHOTO_B])
+    stats = store.stats()
+    assert stats['cache_entries'] == 1 and stats['cache_bytes'] <= size + size // 2
+    assert [p.name for p in (tmp_path / 'fotos').iterdir()] == [f'{PHOTO_B}.jpg']
+
+
+def test_download_finished_after_first_lookup_is_not_repeated(drive, tmp_path):
+    store = _store(drive, tmp_path)
+    store._disk.put(PHOTO_A, b'miniatura')
+    disk_get = store._disk.get
+    lookups = []
+
+    def stale_first_lookup(file_id):
+        # Primeira leitura antes de outro pedido terminar o mesmo download
+        lookups.append(file_id)
+        return None if len(lookups) == 1 else disk_get(file_id)
+
+    store._disk.get = stale_first_lookup
+    assert store.thumbnails([PHOTO_A]) == {PHOTO_A: b'miniatura'}
+    assert drive.requests == []
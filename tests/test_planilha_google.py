@@ -0,0 +1,200 @@
+import datetime
+import json
+import re
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, unquote, urlparse
+
+import pytest
+from google.oauth2.credentials import Credentials
+
+from planilha_google import DriveRevisionProbe, IncrementalSheetSync, SheetsClient
+
+
+class FakeSheets:
+    """Servidor local que imita o necessário das APIs do Sheets (v4) e do Drive (v3)."""
+
+    def __init__(self, serve):
+        self.values = [['Carimbo', 'Prefixo', 'Pneus']] + [
+            [f"0{d}/01/2024 10:00:00", str(100 + d), 'Sim'] for d in range(1, 6)
+        ]
+        self.drive_version = 1
+        # Status da resposta do Drive (403: API desativada no projeto)
+        self.drive_status = 200
+        self.requests = []
+        # (pedido, cabeçalho Authorization) de cada requisição
+        self.auth_log = []
+        self.tokens_issued = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, payload, status=200):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                # Endpoint de token (OAuth): cada renovação devolve um token novo
+                fake.auth_log.append(('token', self.headers.get('Authorization')))
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                fake.tokens_issued += 1
+                return self._send({'access_token': f"t{fake.tokens_issued}", 'expires_in': 3600})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                fake.auth_log.append(('get', self.headers.get('Authorization')))
+                if url.path.startswith('/drive/v3/files/'):
+                    fake.requests.append('drive')
+                    if fake.drive_status != 200:
+                        return self._send({'error': {'code': fake.drive_status, 'message': 'desativada'}},
+                                          fake.drive_status)
+                    return self._send({'version': str(fake.drive_version)})
+                if url.path.endswith('values:batchGet'):
+                    fake.requests.append('batchGet')
+                    ranges = parse_qs(url.query)['ranges']
+                    return self._send({'valueRanges': [
+                        {'range': r, 'majorDimension': 'ROWS', 'values': fake.rows(r)} for r in ranges
+                    ]})
+                match = re.match(r'/v4/spreadsheets/[^/]+/values/(.+)$', url.path)
+                if match:
+                    fake.requests.append('values')
+                    return self._send({'range': match.group(1), 'majorDimension': 'ROWS',
+                                       'values': fake.rows(match.group(1))})
+                fake.requests.append('metadata')
+                return self._send({'spreadsheetId': 'abc', 'properties': {'title': 'Vistorias'},
+                                   'sheets': [{'properties': {
+                                       'sheetId': 0, 'title': 'Respostas', 'index': 0,
+                                       'gridProperties': {'rowCount': 1000, 'columnCount': 3}}}]})
+
+        self.url = serve(Handler)
+
+    def rows(self, a1_range):
+        """Linhas do intervalo A1 pedido ('1:1', 'A6:C', aba inteira)."""
+        a1_range = unquote(a1_range).split('!')[-1]
+        match = re.match(r'^[A-Z]*(\d+):[A-Z]*(\d*)$', a1_range)
+        if not match:
+            return self.values
+        first = int(match.group(1))
+        last = int(match.group(2)) if match.group(2) else len(self.values)
+        return self.values[first - 1:last]
+
+
+@pytest.fixture
+def sheets(local_server):
+    return FakeSheets(local_server)
+
+
+def _client(sheets):
+    return SheetsClient(Credentials(token='teste'), 'abc', base_url=sheets.url)
+
+
+def test_incremental_sync_fetches_only_new_rows(sheets):
+    client = _client(sheets)
+    sync = IncrementalSheetSync(full_sync_interval=3600)
+    assert sync.sync(client.worksheet())
+    assert sync.last_mode == 'full'
+    header, rows, version = sync.snapshot()
+    assert header == ['Carimbo', 'Prefixo', 'Pneus'] and len(rows) == 5
+
+    sheets.values.append(['06/01/2024 10:00:00', '106', 'Não'])
+    sheets.requests.clear()
+    assert sync.sync(client.worksheet())
+    assert sync.last_mode == 'incremental' and sync.last_new_rows == 1
+    assert sheets.requests == ['batchGet']
+    _, new_rows, new_version = sync.snapshot()
+    assert new_rows[-1] == ['06/01/2024 10:00:00', '106', 'Não'] and new_version == version + 1
+    # O snapshot anterior não é alterado
+    assert len(rows) == 5
+
+    assert not sync.sync(client.worksheet())
+    assert sync.snapshot()[2] == version + 1
+    assert sync.appended_since(version)
+
+
+def test_full_sync_when_interval_expires_or_rows_change(sheets):
+    client = _client(sheets)
+    sync = IncrementalSheetSync(full_sync_interval=3600)
+    sync.sync(client.worksheet())
+    # Linha já lida foi editada: a conferência da última linha força a leitura completa
+    version = sync.snapshot()[2]
+    sheets.values[-1][2] = 'Não'
+    assert sync.sync(client.worksheet())
+    assert sync.last_mode == 'full' and sync.snapshot()[1][-1][2] == 'Não'
+    assert not sync.appended_since(version)
+
+
+def test_periodic_full_sync_waits_for_a_change(sheets):
+    client = _client(sheets)
+    sync = IncrementalSheetSync(full_sync_interval=0)
+    sync.sync(client.worksheet())
+    # Conferência vencida, mas o fim da aba não mudou: só a leitura incremental
+    sheets.values[1][2] = 'Não'
+    assert not sync.sync(client.worksheet())
+    assert sync.last_mode == 'incremental' and sync.full_syncs == 1 and sync.full_syncs_deferred == 1
+    version = sync.snapshot()[2]
+    # Resposta nova: a conferência completa roda e recolhe a edição antiga
+    sheets.values.append(['06/01/2024 10:00:00', '106', 'Sim'])
+    assert sync.sync(client.worksheet())
+    assert sync.last_mode == 'full' and sync.full_syncs == 2
+    rows = sync.snapshot()[1]
+    assert rows[0][2] == 'Não' and len(rows) == 6
+    assert not sync.appended_since(version)
+
+
+def test_probe_change_without_new_rows_reads_everything(sheets):
+    client = _client(sheets)
+    sync = IncrementalSheetSync(full_sync_interval=3600, probe=DriveRevisionProbe())
+    sync.sync(client.worksheet())
+    sheets.values[1][2] = 'Não'
+    sheets.drive_version += 1
+    assert sync.sync(client.worksheet())
+    assert sync.last_mode == 'full' and sync.snapshot()[1][0][2] == 'Não'
+
+
+def test_probe_skips_reading_unchanged_sheet(sheets):
+    client = _client(sheets)
+    sync = IncrementalSheetSync(full_sync_interval=0, probe=DriveRevisionProbe())
+    assert sync.sync(client.worksheet())
+    version = sync.snapshot()[2]
+
+    sheets.requests.clear()
+    assert not sync.sync(client.worksheet())
+    # Só a versão do arquivo: nem a leitura completa de conferência (intervalo 0)
+    assert sheets.requests == ['drive']
+    assert sync.last_mode == 'probe' and sync.probe_skips == 1
+
+    sheets.values.append(['06/01/2024 10:00:00', '106', 'Não'])
+    sheets.drive_version += 1
+    assert sync.sync(client.worksheet())
+    assert sync.last_mode == 'full' and sync.snapshot()[2] == version + 1
+
+
+def test_probe_is_disabled_after_consecutive_errors(sheets):
+    client = _client(sheets)
+    sheets.drive_status = 403
+    sync = IncrementalSheetSync(full_sync_interval=3600, probe=DriveRevisionProbe(), probe_max_errors=2)
+    for _ in range(3):
+        sync.sync(client.worksheet())
+    assert sync.probe_disabled and sync.probe_errors == 2
+    sheets.requests.clear()
+    sync.sync(client.worksheet())
+    assert 'drive' not in sheets.requests
+    assert sync.stats()['probe_disabled']
+
+
+def test_expired_token_is_refreshed_once_without_stale_bearer(sheets):
+    credentials = Credentials(
+        token='vencido',
+        refresh_token='renovacao',
+        token_uri=f"{sheets.url}/token",
+        client_id='app',
+        client_secret='segredo',
+        expiry=datetime.datetime(2000, 1, 1),
+    )
+    client = SheetsClient(credentials, 'abc', base_url=sheets.url)
+    client.worksheet()
+    assert sheets.auth_log[:2] == [('token', None), ('get', 'Bearer t1')]
+    assert sheets.tokens_issued == 1
+    assert client.stats()['auth_count'] == 1
@@ -0,0 +1,140 @@
+import os
+
+import pandas as pd
+
+from relatorio import (
+    ColumnMapping,
+    append_vistorias,
+    VistoriaIndex,
+    dataset_fingerprint,
+    format_frame,
+    format_item_cells,
+    format_value,
+    get_vistoria_schema,
+    non_conformity_matrix,
+    non_conformity_summary,
+    normalize_vistoria_df,
+    read_column_mapping,
+    read_vistorias_xlsx,
+    set_dataset_fingerprint,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ITEM = "Pneus em bom estado?"
+MAPPING = ColumnMapping({ITEM: {'nome_tratado': 'Pneus', 'area': 'EXTERNA'}})
+
+
+def _sheets_df():
+    """Respostas como o get_all_values() devolve: tudo texto, células em branco como ''."""
+    cidades = ['Vitória (ES)', '', 'Vitória (ES)', 'Serra', '', 'Serra', 'Vitória (ES)', 'Serra']
+    return pd.DataFrame({
+        'Carimbo de data/hora': [f"0{d}/02/2024 10:00:00" for d in range(1, 9)],
+        'Ônibus (prefixo)': ['101', '102', '', '101', '102', '101', '102', ''],
+        'Cidade': cidades,
+        'Vistoriador': ['Ana', 'Bia', 'Ana', ' ', 'Bia', 'Ana', 'Bia', 'Ana'],
+        ITEM: ['Não', 'Sim', 'Sim', 'Não', 'Sim', 'Sim', 'Não', 'Sim'],
+    })
+
+
+def test_blank_values_are_not_filter_options():
+    df = normalize_vistoria_df(_sheets_df())
+    assert isinstance(df['Cidade'].dtype, pd.CategoricalDtype)
+    index = VistoriaIndex(df, get_vistoria_schema(df.columns, MAPPING))
+    assert index.options('cidade') == ['Serra', 'Vitória (ES)']
+    assert index.options('prefixo') == ['101', '102']
+    assert index.options('vistoriador') == ['Ana', 'Bia']
+
+
+def test_blank_values_are_not_ranking_rows():
+    df = normalize_vistoria_df(_sheets_df())
+    summary = non_conformity_summary(df, get_vistoria_schema(df.columns, MAPPING))
+    assert set(summary['por_cidade'].index) == {'Serra', 'Vitória (ES)'}
+    assert set(summary['por_veiculo'].index) == {'101', '102'}
+
+
+def test_bulk_formatting_matches_format_value():
+    raw = read_vistorias_xlsx(os.path.join(ROOT, 'base_de_dados.xlsx'))
+    mapping = read_column_mapping(os.path.join(ROOT, 'formatacao_colunas.xlsx'))
+    columns = [col for col, _, _ in get_vistoria_schema(raw.columns, mapping).item_columns]
+    # Coluna toda vazia no xlsx: vira categórica sem nenhuma categoria
+    raw[columns[0]] = None
+    df = normalize_vistoria_df(raw)
+    assert len(df[columns[0]].cat.categories) == 0
+    schema = get_vistoria_schema(df.columns, mapping)
+    everything = format_frame(df, columns)
+    for pos in range(0, len(df), 5):
+        for col in columns:
+            assert everything.iloc[pos][col] == format_value(df.iloc[pos][col], col)
+    non_conformities = non_conformity_matrix(df, columns)
+    positions = list(range(0, len(df), 2))
+    formatted = format_item_cells(df, schema, positions, non_conformities)
+    for k, pos in enumerate(positions):
+        row_hits = non_conformities.iloc[pos]
+        for col in columns:
+            if row_hits[col]:
+                assert formatted.iloc[k][col] == format_value(df.iloc[pos][col], col)
+            else:
+                assert formatted.iloc[k][col] is None
+
+
+def test_fingerprint_of_edited_copy_is_recomputed():
+    df = normalize_vistoria_df(_sheets_df())
+    fingerprint = dataset_fingerprint(df)
+    copy = df.copy()
+    assert dataset_fingerprint(copy) == fingerprint
+    edited = df.copy()
+    edited.loc[0, ITEM] = 'Não'
+    assert dataset_fingerprint(edited) != fingerprint
+    assert dataset_fingerprint(df) == fingerprint
+
+
+def test_known_fingerprint_is_not_inherited():
+    df = normalize_vistoria_df(_sheets_df())
+    set_dataset_fingerprint(df, 'gravada')
+    assert dataset_fingerprint(df) == 'gravada'
+    assert dataset_fingerprint(df.copy()) != 'gravada'
+
+
+def test_carimbo_with_mixed_formats():
+    df = _sheets_df()
+    carimbo = 'Carimbo de data/hora'
+    df.loc[1, carimbo] = '2024-02-10 08:30:00'
+    df.loc[2, carimbo] = '2024-02-11T09:00:00'
+    df.loc[3, carimbo] = ''
+    stamps = normalize_vistoria_df(df)[carimbo]
+    assert stamps.notna().sum() == len(df) - 1
+    assert stamps.iloc[0] == pd.Timestamp('2024-02-11 09:00:00')
+    assert stamps.iloc[1] == pd.Timestamp('2024-02-10 08:30:00')
+    assert stamps.iloc[2] == pd.Timestamp('2024-02-08 10:00:00')
+
+
+def test_append_matches_full_normalization():
+    raw = _sheets_df()
+    raw.loc[6, 'Cidade'] = 'Cariacica'
+    raw.loc[7, ITEM] = 'Não se aplica'
+    old = normalize_vistoria_df(raw.iloc[:5])
+    assert isinstance(old[ITEM].dtype, pd.CategoricalDtype)
+    appended = append_vistorias(old, raw.iloc[5:])
+    full = normalize_vistoria_df(raw)
+    assert appended is not None
+    pd.testing.assert_frame_equal(
+        appended.astype(object).fillna('NA'), full.astype(object).fillna('NA'), check_dtype=False
+    )
+    assert isinstance(appended[ITEM].dtype, pd.CategoricalDtype)
+    assert dataset_fingerprint(appended) != dataset_fingerprint(old)
+
+
+def test_append_without_carimbo_keeps_sheet_order():
+    raw = _sheets_df().drop(columns='Carimbo de data/hora')
+    appended = append_vistorias(normalize_vistoria_df(raw.iloc[:5]), raw.iloc[5:])
+    assert appended['Ônibus (prefixo)'].tolist() == raw['Ônibus (prefixo)'].tolist()
+
+
+def test_append_falls_back_when_order_would_change():
+    raw = _sheets_df()
+    old = normalize_vistoria_df(raw.iloc[2:])
+    # Linhas mais antigas que as já normalizadas: só normalizando tudo de novo
+    assert append_vistorias(old, raw.iloc[:2]) is None
+    assert append_vistorias(old, raw.iloc[:0]) is old
+    assert append_vistorias(old, raw.iloc[:2, :3]) is None
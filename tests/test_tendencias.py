@@ -0,0 +1,45 @@
+import pandas as pd
+
+from relatorio import ColumnMapping, append_vistorias, get_vistoria_schema, normalize_vistoria_df
+from tendencias import DailyRollup, trend_series
+
+ITEM = "Pneus em bom estado?"
+MAPPING = ColumnMapping({ITEM: {'nome_tratado': 'Pneus', 'area': 'EXTERNA'}})
+
+
+def _sheets_df(days=10):
+    return pd.DataFrame({
+        'Carimbo de data/hora': [f"{d:02d}/03/2024 {8 + d % 3}:00:00" for d in range(1, days + 1)],
+        'Cidade': ['Serra', 'Serra ', '', 'Vitória (ES)', 'Serra'] * (days // 5),
+        ITEM: ['Não', 'Sim'] * (days // 2),
+    })
+
+
+def test_incremental_update_matches_full_build():
+    raw = _sheets_df()
+    old = normalize_vistoria_df(raw.iloc[:6])
+    new = append_vistorias(old, raw.iloc[6:])
+    schema = get_vistoria_schema(new.columns, MAPPING)
+    rollup = DailyRollup()
+    rollup.update(old, schema, version='v1')
+    table = rollup.update(new, schema, version='v2')
+    assert rollup.incremental_updates == 1 and rollup.last_rows_processed == 4
+    pd.testing.assert_frame_equal(table, DailyRollup().update(new, schema), check_dtype=False)
+
+
+def test_fewer_rows_rebuild_everything():
+    raw = _sheets_df()
+    schema = get_vistoria_schema(raw.columns, MAPPING)
+    rollup = DailyRollup()
+    rollup.update(normalize_vistoria_df(raw), schema, version='v1')
+    table = rollup.update(normalize_vistoria_df(raw.iloc[:4]), schema, version='v2')
+    assert rollup.full_builds == 2 and table['vistorias'].sum() == 4
+
+
+def test_city_filter_uses_table_labels():
+    df = normalize_vistoria_df(_sheets_df())
+    table = DailyRollup().update(df, get_vistoria_schema(df.columns, MAPPING))
+    # Opções do filtro como aparecem nos dados (com espaço sobrando)
+    series = trend_series(table, cidades=['Serra '])
+    assert series['vistorias']['vistorias'].sum() == 6
+    assert list(series['cidades'].columns) == ['Serra']